@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Fixtures shared by the tests
+Transfers run against stand-in phone servers on localhost and write to
+a temporary folder, nothing needs a phone or Qt
+'''
+
+import os
+import sys
+
+from threading import Event
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xender_pc.emulator import PhoneServer
+from xender_pc.pool import ConnectionPool
+
+ENDED = ('finished', 'cancelled', 'failed', 'corrupt')
+
+
+@pytest.fixture
+def serve():
+    '''Start a PhoneServer with the given arguments, stopped after the test'''
+    servers = []
+
+    def start(*args, **kwargs):
+        server = PhoneServer(*args, **kwargs).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def pool():
+    '''Connection pool of its own so tests do not share connections'''
+    pool = ConnectionPool()
+    yield pool
+    pool.clear()
+
+
+@pytest.fixture
+def run():
+    '''Start a transfer and wait for it to end, returns its last state'''
+    def run(transfer, timeout=60):
+        ended = Event()
+        states = []
+
+        def on_state(state):
+            states.append(state)
+            if state in ENDED:
+                ended.set()
+        transfer.on_state = on_state
+        transfer.start()
+        assert ended.wait(timeout), 'Transfer did not end, states: %r' % states
+        return states[-1]
+    return run
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Gateway discovery: the parser of every backend and the cached lookup'''
+
+import os
+import time
+import socket
+
+from threading import Thread
+
+import pytest
+
+from xender_pc import discovery
+from xender_pc.discovery import (EnvBackend, IpconfigBackend, NoWifiError, NotConnectedError,
+                                 ProcRouteBackend, parse_ipconfig, parse_ipconfig_all,
+                                 parse_proc_route)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    discovery.forget()
+    yield
+    discovery.forget()
+
+
+def test_parse_proc_route():
+    # Only default routes that are up, lowest metric first
+    assert parse_proc_route(fixture('proc_net_route.txt')) == [('eth0', '192.168.1.1'),
+                                                               ('wlan0', '192.168.43.1')]
+    assert parse_proc_route('Iface\tDestination\tGateway\n') == []
+
+
+def test_parse_ipconfig():
+    text = fixture('ipconfig.txt')
+    # The IPv6 gateway is skipped for the IPv4 one on the next line
+    assert parse_ipconfig(text) == '192.168.43.1'
+    assert parse_ipconfig_all(text) == ['192.168.1.1', '192.168.43.1']
+
+
+def test_parse_ipconfig_errors():
+    with pytest.raises(NotConnectedError):
+        parse_ipconfig(fixture('ipconfig_disconnected.txt'))
+    with pytest.raises(NoWifiError):
+        parse_ipconfig(fixture('ipconfig_no_wifi.txt'))
+    assert parse_ipconfig_all(fixture('ipconfig_disconnected.txt')) == []
+
+
+def fake_proc(tmp_path, wireless):
+    '''ProcRouteBackend reading the fixture table with wireless interfaces'''
+    backend = ProcRouteBackend()
+    backend.route_file = os.path.join(FIXTURES, 'proc_net_route.txt')
+    backend.net_dir = str(tmp_path)
+    for iface in ('eth0', 'wlan0'):
+        os.makedirs(os.path.join(str(tmp_path), iface))
+    for iface in wireless:
+        os.makedirs(os.path.join(str(tmp_path), iface, 'wireless'))
+    return backend
+
+
+def test_proc_backend_puts_wifi_first(tmp_path):
+    backend = fake_proc(tmp_path, ['wlan0'])
+    assert backend.available()
+    assert backend.wireless() == ['wlan0']
+    assert backend.gateways() == ['192.168.43.1', '192.168.1.1']
+
+
+def test_proc_backend_without_wifi(tmp_path):
+    with pytest.raises(NoWifiError):
+        fake_proc(tmp_path, []).gateways()
+
+
+def test_ipconfig_backend(monkeypatch):
+    text = fixture('ipconfig.txt')
+    monkeypatch.setattr(discovery.subprocess, 'check_output',
+                        lambda *args, **kwargs: text.encode('utf-8'))
+    assert IpconfigBackend().gateways() == ['192.168.43.1', '192.168.1.1']
+
+
+def test_env_backend(monkeypatch):
+    monkeypatch.setenv(EnvBackend.variable, ' 10.0.0.1, ,127.0.0.1')
+    backend = EnvBackend()
+    assert backend.available()
+    assert backend.gateways() == ['10.0.0.1', '127.0.0.1']
+    monkeypatch.setenv(EnvBackend.variable, '')
+    assert not backend.available()
+
+
+class CountingBackend:
+    name = 'counting'
+
+    def __init__(self, gateways):
+        self.found = gateways
+        self.calls = 0
+
+    def available(self):
+        return True
+
+    def gateways(self):
+        self.calls += 1
+        return list(self.found)
+
+
+def test_gateway_is_cached(monkeypatch):
+    backend = CountingBackend(['192.168.43.1'])
+    monkeypatch.setattr(discovery, 'BACKENDS', [backend])
+    assert discovery.find_gateways() == ['192.168.43.1']
+    assert discovery.find_gateways() == ['192.168.43.1']
+    assert backend.calls == 1
+    discovery.find_gateways(refresh=True)
+    assert backend.calls == 2
+    discovery.forget()
+    discovery.find_gateways()
+    assert backend.calls == 3
+
+
+def test_no_backend(monkeypatch):
+    monkeypatch.setattr(discovery, 'BACKENDS', [])
+    with pytest.raises(NoWifiError):
+        discovery.find_gateways()
+
+
+def listener(host, port, answer=None):
+    '''
+    Socket listening on host:port that accepts and sends answer, or that
+    never accepts when answer is None so connections wait for nothing
+    '''
+    sock = socket.socket()
+    try:
+        sock.bind((host, port))
+    except OSError as e:
+        sock.close()
+        pytest.skip('Loopback alias %s is not usable: %s' % (host, e))
+    sock.listen(8)
+    if answer is not None:
+        def serve():
+            while True:
+                try:
+                    conn, address = sock.accept()
+                except OSError:
+                    return
+                conn.sendall(answer)
+                conn.close()
+        Thread(target=serve, daemon=True).start()
+    return sock
+
+
+def test_probe_picks_the_phone_among_loopback_aliases(serve):
+    phone = serve(host='127.0.0.5')
+    port = phone.server_port
+    silent = listener('127.0.0.2', port) # Accepts nothing, like a wrong adapter
+    other = listener('127.0.0.3', port, b'SSH-2.0-OpenSSH\r\n') # Something else is listening
+    # 127.0.0.4 refuses the connection
+    hosts = ['127.0.0.2', '127.0.0.3', '127.0.0.4', '127.0.0.5']
+    try:
+        started = time.perf_counter()
+        assert discovery.probe_servers(hosts, port, timeout=2.0) == '127.0.0.5'
+        # The phone answers straight away, nothing waits for the silent one to time out
+        assert time.perf_counter() - started < 1.0
+        assert discovery.probe_servers(hosts[:3], port, timeout=0.2) is None
+    finally:
+        silent.close()
+        other.close()
+
+
+def test_find_server_remembers_the_one_that_answered(serve, monkeypatch):
+    phone = serve(host='127.0.0.7')
+    monkeypatch.setattr(discovery, 'BACKENDS', [CountingBackend(['127.0.0.6', '127.0.0.7'])])
+    assert discovery.find_server(phone.server_port) == '127.0.0.7'
+    assert discovery.find_gateways() == ['127.0.0.7', '127.0.0.6']
+    assert sorted(discovery.find_servers(phone.server_port)) == ['127.0.0.7']
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''The window sleeps while nothing happens, needs PyQt5 with QtWebEngine'''
+
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')
+pytest.importorskip('PyQt5.QtWebEngineWidgets')
+
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication
+
+from xender_pc import gui
+from xender_pc.progress import INTERVAL
+
+
+class Row:
+    '''Stands in for a DownloadItem that reports progress'''
+    valid = True
+
+    def __init__(self):
+        self.applied = []
+
+    def apply_progress(self, bytes_received, bytes_total):
+        self.applied.append(bytes_received)
+
+
+@pytest.fixture(scope='module')
+def window():
+    app = QApplication.instance() or QApplication(['xender-tests'])
+    window = gui.MainWindow()
+    QTest.qWait(500) # Let the first page load
+    yield window
+    window.close()
+    app.processEvents()
+
+
+def timers(window):
+    return [timer for timer in (window.hideTimer, window.progressTimer, window.statsTimer)
+            if timer.isActive()]
+
+
+def test_idle_window_has_no_timer_wakeups(window):
+    before = window.wakeups
+    QTest.qWait(2000)
+    assert window.wakeups == before
+    assert timers(window) == []
+
+
+def test_progress_timers_stop_once_transfers_end(window):
+    row = Row()
+    window.reportProgress(row, 100, 1000)
+    assert window.progressTimer.isActive() and window.statsTimer.isActive()
+    QTest.qWait(INTERVAL * 3)
+    assert row.applied == [100]
+    QTest.qWait(1500) # statsTimer finds nothing active and stops
+    assert timers(window) == []
+    before = window.wakeups
+    QTest.qWait(1000)
+    assert window.wakeups == before
+
+
+def test_connect_result_is_shown_without_polling(window):
+    url = gui.page('about.htm')
+    window.connected.emit(url)
+    # Delivered on the GUI thread straight away, not on the next tick of a timer
+    assert window.url == url
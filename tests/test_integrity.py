@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Hashes of files written out of order, and the status text they lead to'''
+
+import hashlib
+
+from xender_pc.integrity import StreamHasher
+from xender_pc.progress import finished_status
+
+CHUNK = 64 * 1024
+
+
+def test_out_of_order_writes_hash_like_the_file(tmp_path):
+    data = bytes(range(256)) * 4096 # 1 MiB
+    path = tmp_path / 'file.part'
+    path.write_bytes(data)
+    hasher = StreamHasher(str(path), 'sha256')
+    offsets = list(range(0, len(data), CHUNK))
+    # Later chunks first, like segments that run ahead of the first one
+    for offset in offsets[len(offsets)//2:] + offsets[:len(offsets)//2]:
+        hasher.update(offset, data[offset:offset+CHUNK])
+    assert hasher.finish(len(data)) == hashlib.sha256(data).hexdigest()
+
+
+def test_repeated_writes_are_hashed_once(tmp_path):
+    data = b'x' * (4 * CHUNK)
+    path = tmp_path / 'file.part'
+    path.write_bytes(data)
+    hasher = StreamHasher(str(path), 'sha256')
+    for offset in (0, CHUNK, 0, CHUNK, 2*CHUNK, 3*CHUNK):
+        hasher.update(offset, data[offset:offset+CHUNK])
+    assert hasher.finish(len(data)) == hashlib.sha256(data).hexdigest()
+
+
+def test_only_a_matched_digest_reads_verified():
+    assert finished_status('verified') == 'Verified'
+    assert finished_status('size') == 'Completed (size OK)'
+    assert finished_status('unchecked') == 'Completed'
+    assert finished_status(None) == 'Completed'
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Interrupted downloads resume from the journal to a byte-identical file'''
+
+import os
+import sys
+import time
+import subprocess
+
+from threading import Event
+
+from xender_pc.emulator import content
+from xender_pc.journal import RECORD, Journal, discard, gaps, journal_path, merge, pending
+from xender_pc.transfer import CHUNK_SIZE, CONNECTIONS, SegmentedDownload
+
+SIZE = 32 * 1024 * 1024 + 99
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DOWNLOAD = '''
+import sys, time
+from xender_pc.transfer import SegmentedDownload
+SegmentedDownload(sys.argv[1], sys.argv[2], journal_dir=sys.argv[3]).start()
+time.sleep(60)
+'''
+
+
+def recorded(journal):
+    '''Range records appended to journal so far, read without touching it'''
+    try:
+        with open(journal, 'rb') as f:
+            f.readline()
+            return len(f.read()) // RECORD.size
+    except OSError:
+        return 0
+
+
+def resume(url, path, journal_dir, pool, run):
+    '''Download url again, returns the bytes of its first progress report'''
+    transfer = SegmentedDownload(url, path, journal_dir=journal_dir, pool=pool)
+    first = []
+    transfer.on_progress = lambda received, total: first or first.append(received)
+    assert run(transfer) == 'finished'
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(content(0, SIZE))
+    assert not os.path.exists(journal_path(path, journal_dir))
+    return first[0]
+
+
+def test_killed_download_resumes(serve, pool, run, tmp_path):
+    phone = serve({'/big.bin': SIZE}, bandwidth=16*1024*1024)
+    path = str(tmp_path / 'big.bin')
+    journal = journal_path(path, str(tmp_path))
+    process = subprocess.Popen([sys.executable, '-c', DOWNLOAD, phone.url+'/big.bin', path,
+                                str(tmp_path)], cwd=ROOT)
+    try:
+        # Kill it once a few ranges reached the journal, like a crash or power cut
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if recorded(journal) >= 8:
+                break
+            time.sleep(0.02)
+    finally:
+        process.kill()
+        process.wait()
+    assert os.path.exists(path+'.part')
+    resumed_from = resume(phone.url+'/big.bin', path, str(tmp_path), pool, run)
+    assert CHUNK_SIZE * CONNECTIONS < resumed_from < SIZE
+
+
+def test_suspended_download_resumes(serve, pool, run, tmp_path):
+    phone = serve({'/big.bin': SIZE}, bandwidth=32*1024*1024)
+    path = str(tmp_path / 'big.bin')
+    transfer = SegmentedDownload(phone.url+'/big.bin', path, journal_dir=str(tmp_path),
+                                 pool=pool)
+    halfway = Event()
+    transfer.on_progress = lambda received, total: received > SIZE // 2 and halfway.set()
+    transfer.start()
+    assert halfway.wait(20)
+    transfer.suspend()
+    deadline = time.monotonic() + 10
+    while transfer.state not in ('suspended', 'finished') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert Journal.find(path, str(tmp_path)).header['host'] == '127.0.0.1'
+    resumed_from = resume(phone.url+'/big.bin', path, str(tmp_path), pool, run)
+    assert resumed_from > SIZE // 2
+
+
+def test_changed_file_starts_over(serve, pool, run, tmp_path):
+    path = str(tmp_path / 'big.bin')
+    Journal.create({'url': '', 'path': path, 'size': SIZE + 1, 'etag': '', 'last_modified': ''},
+                   str(tmp_path)).record(0, SIZE // 2)
+    with open(path+'.part', 'wb') as f:
+        f.write(b'\0' * (SIZE // 2))
+    phone = serve({'/big.bin': SIZE})
+    # The first report is of new data, not of the half the old journal had
+    assert resume(phone.url+'/big.bin', path, str(tmp_path), pool, run) <= CHUNK_SIZE * CONNECTIONS
+
+
+def test_only_journals_of_the_phone_are_pending(tmp_path):
+    directory = str(tmp_path)
+    for host, name in (('192.168.43.1', 'a'), ('192.168.49.1', 'b')):
+        Journal.create({'url': 'http://%s:33455/%s' % (host, name), 'host': host,
+                        'path': str(tmp_path / name), 'size': 10}, directory)
+    # Written before hosts were recorded, the url still tells
+    Journal.create({'url': 'http://192.168.43.1:33455/old', 'path': str(tmp_path / 'old'),
+                    'size': 10}, directory)
+    def names(host=None):
+        return sorted(os.path.basename(journal.header['path'])
+                      for journal in pending(directory, host))
+    assert names() == ['a', 'b', 'old']
+    assert names('192.168.43.1') == ['a', 'old']
+    discard(str(tmp_path / 'a'), directory)
+    assert names('192.168.43.1') == ['old']
+
+
+def test_torn_record_is_ignored(tmp_path):
+    journal = Journal.create({'url': 'http://phone/a', 'path': str(tmp_path / 'a'), 'size': 100},
+                             str(tmp_path))
+    journal.record(0, 10)
+    journal.record(10, 30)
+    journal.record(50, 60)
+    journal.close()
+    with open(journal.path, 'ab') as f:
+        f.write(RECORD.pack(60, 100)[:7])
+    loaded = Journal.load(journal.path)
+    assert loaded.ranges == [[0, 30], [50, 60]]
+    assert loaded.missing() == [[30, 50], [60, 100]]
+
+
+def test_merge_and_gaps():
+    assert merge([(5, 8), (0, 2), (2, 4), (7, 9)]) == [[0, 4], [5, 9]]
+    assert gaps([[0, 4], [5, 9]], 12) == [[4, 5], [9, 12]]
+    assert gaps([], 3) == [[0, 3]]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Connections are shared, capped and given back by paused transfers'''
+
+import time
+
+from threading import Event
+
+from xender_pc.emulator import content
+from xender_pc.pool import ConnectionPool
+from xender_pc.transfer import SegmentedDownload
+
+SIZE = 32 * 1024 * 1024
+
+
+def test_paused_download_gives_its_connections_back(serve, run, tmp_path):
+    phone = serve({'/a.bin': SIZE, '/b.bin': SIZE}, bandwidth=32*1024*1024)
+    pool = ConnectionPool(size=2)
+    first = SegmentedDownload(phone.url+'/a.bin', str(tmp_path / 'a.bin'), connections=2,
+                              journal_dir=str(tmp_path), pool=pool)
+    started = Event()
+    first.on_progress = lambda received, total: started.set()
+    first.start()
+    assert started.wait(10)
+    first.pause()
+    deadline = time.monotonic() + 5
+    while any(pool.busy.values()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not any(pool.busy.values())
+    # Would wait forever for a connection if the paused one kept them
+    second = SegmentedDownload(phone.url+'/b.bin', str(tmp_path / 'b.bin'), connections=2,
+                               journal_dir=str(tmp_path), pool=pool)
+    assert run(second, timeout=20) == 'finished'
+    ended = Event()
+    first.on_state = lambda state: state == 'finished' and ended.set()
+    first.resume()
+    assert ended.wait(20)
+    with open(str(tmp_path / 'a.bin'), 'rb') as f:
+        assert f.read() == b''.join(content(0, SIZE))
+    pool.clear()
+
+
+def test_parked_connection_does_not_count(serve):
+    phone = serve({'/a.bin': 10})
+    pool = ConnectionPool(size=1)
+    conn, reused = pool.acquire(phone.url)
+    pool.park(conn)
+    other, reused = pool.acquire(phone.url) # Does not wait
+    pool.release(other)
+    pool.unpark(conn)
+    assert pool.busy[next(iter(pool.busy))] == 1
+    pool.release(conn)
+    assert not any(pool.busy.values())
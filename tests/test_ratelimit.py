@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Transfers stay within a few percent of the caps, changed or not'''
+
+import time
+
+import pytest
+
+from threading import Thread, Event
+
+from xender_pc.ratelimit import BURST, BandwidthLimiter, TokenBucket, parse_rate
+from xender_pc.transfer import SegmentedDownload
+
+MB = 1000 * 1000
+TOLERANCE = 0.05
+
+
+class Clock:
+    '''Time that moves only when the bucket sleeps or the test says so'''
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+def download(phone, name, tmp_path, pool, limiter):
+    return SegmentedDownload(phone.url+'/'+name, str(tmp_path / name),
+                             journal_dir=str(tmp_path), limiter=limiter, pool=pool)
+
+
+def rates(transfers, timeout=60):
+    '''Start transfers together, returns the bytes per second each achieved'''
+    ended = {}
+    done = Event()
+
+    def on_state(transfer, state):
+        if state in ('finished', 'cancelled', 'failed', 'corrupt'):
+            ended[transfer] = (time.perf_counter(), state)
+            if len(ended) == len(transfers):
+                done.set()
+    started = time.perf_counter()
+    for transfer in transfers:
+        transfer.on_state = lambda state, transfer=transfer: on_state(transfer, state)
+        transfer.start()
+    assert done.wait(timeout)
+    assert all(state == 'finished' for at, state in ended.values())
+    return [transfer.bytes_total / (ended[transfer][0] - started) for transfer in transfers]
+
+
+def test_bucket_pays_out_at_its_rate():
+    clock = Clock()
+    bucket = TokenBucket(1000, clock, clock.sleep)
+    for i in range(50):
+        bucket.consume(100)
+    assert clock.slept == pytest.approx(5.0)
+
+
+def test_bucket_saves_up_only_a_short_burst():
+    clock = Clock()
+    bucket = TokenBucket(1000, clock, clock.sleep)
+    clock.now += 100 # Idle for a long time
+    bucket.consume(1000 * BURST)
+    assert clock.slept == 0
+    bucket.consume(1000)
+    assert clock.slept == pytest.approx(1.0)
+
+
+def test_bucket_follows_a_new_rate_and_unlimited_is_free():
+    clock = Clock()
+    bucket = TokenBucket(1000, clock, clock.sleep)
+    bucket.consume(1000)
+    bucket.set_rate(4000)
+    bucket.consume(4000)
+    assert clock.slept == pytest.approx(2.0)
+    bucket.set_rate(0)
+    bucket.consume(10 ** 9)
+    assert clock.slept == pytest.approx(2.0)
+
+
+def test_parse_rate():
+    assert parse_rate('500K') == 500 * 1000
+    assert parse_rate('1.5M/s') == 1500 * 1000
+    with pytest.raises(ValueError):
+        parse_rate('fast')
+
+
+def test_global_cap(serve, pool, tmp_path):
+    phone = serve({'/a.bin': 8 * MB})
+    limiter = BandwidthLimiter(4 * MB)
+    rate, = rates([download(phone, 'a.bin', tmp_path, pool, limiter)])
+    assert rate == pytest.approx(4 * MB, rel=TOLERANCE)
+
+
+def test_per_file_cap(serve, pool, tmp_path):
+    phone = serve({'/a.bin': 4 * MB, '/b.bin': 4 * MB})
+    limiter = BandwidthLimiter(per_transfer=2 * MB)
+    for rate in rates([download(phone, name, tmp_path, pool, limiter)
+                       for name in ('a.bin', 'b.bin')]):
+        assert rate == pytest.approx(2 * MB, rel=TOLERANCE)
+
+
+def test_fair_share(serve, pool, tmp_path):
+    phone = serve({'/a.bin': 4 * MB, '/b.bin': 4 * MB})
+    limiter = BandwidthLimiter(4 * MB, fair_share=True)
+    for rate in rates([download(phone, name, tmp_path, pool, limiter)
+                       for name in ('a.bin', 'b.bin')]):
+        assert rate == pytest.approx(2 * MB, rel=TOLERANCE)
+
+
+def test_limit_changed_while_running(serve, pool, tmp_path):
+    phone = serve({'/a.bin': 16 * MB})
+    limiter = BandwidthLimiter(2 * MB)
+    transfer = download(phone, 'a.bin', tmp_path, pool, limiter)
+    samples = []
+    transfer.on_progress = lambda received, total: samples.append((time.perf_counter(), received))
+    changed = []
+
+    def change():
+        time.sleep(1)
+        before = samples[-1][1]
+        limiter.set_limits(8 * MB)
+        changed.append((time.perf_counter(), before))
+    Thread(target=change).start()
+    rates([transfer])
+    at, before = changed[0]
+    # About a second at the old rate, then the rest at the new one
+    assert before == pytest.approx(2 * MB, rel=0.15)
+    first = next(i for i, (when, received) in enumerate(samples) if when >= at)
+    start, received = samples[first]
+    end, total = samples[-1]
+    assert (total - received) / (end - start) == pytest.approx(8 * MB, rel=TOLERANCE)
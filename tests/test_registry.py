@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Rows of the download list and the registry of transfers behind them'''
+
+import time
+import random
+
+from xender_pc.registry import Rows, TransferRegistry
+
+
+class Item:
+    def __init__(self, number):
+        self.number = number
+
+    def __repr__(self):
+        return 'Item(%d)' % self.number
+
+
+def test_rows_match_a_list_through_random_changes():
+    rows = Rows()
+    expected = []
+    rng = random.Random(7)
+    for step in range(5000):
+        if rng.random() < 0.55 or not expected:
+            item = Item(step)
+            expected.append(item)
+            assert rows.append(item) == len(expected) - 1
+        else:
+            item = rng.choice(expected)
+            row = expected.index(item)
+            if rng.random() < 0.5:
+                assert rows.remove(item) == row
+            else:
+                assert rows.pop(row) is item
+            expected.remove(item)
+        if step % 250 == 0:
+            assert list(rows) == expected
+            assert [rows[row] for row in range(len(rows))] == expected
+            assert [rows.row(item) for item in expected] == list(range(len(expected)))
+
+
+def test_rows_of_unknown_items():
+    rows = Rows()
+    item = Item(1)
+    assert rows.row(item) is None
+    assert rows.remove(item) is None
+    rows.append(item)
+    assert item in rows
+    rows.clear()
+    assert len(rows) == 0 and item not in rows
+
+
+class Transfer:
+    '''A download as the registry and the list see it'''
+    def __init__(self, number, attempt):
+        self.number = number
+        self.attempt = attempt
+        self.path = '/dest/IMG_%05d.jpg' % number
+        self.url = 'http://192.168.43.1:33455/DCIM/IMG_%05d.jpg?try=%d' % (number, attempt)
+
+
+def accept(registry, rows, transfer):
+    '''What MainWindow.download does with a new transfer'''
+    old = registry.replace(transfer)
+    if old is not None:
+        rows.remove(old)
+    rows.append(transfer)
+
+
+def test_ten_thousand_downloads_with_retries():
+    count = 10000
+    registry = TransferRegistry()
+    rows = Rows()
+    rng = random.Random(8)
+    started = time.perf_counter()
+    for number in range(count):
+        accept(registry, rows, Transfer(number, 0))
+    # Retry a random half of them, three times over, some twice in a round
+    attempts = [0] * count
+    for i in range(3):
+        for number in rng.sample(range(count), count // 2) + rng.sample(range(count), 500):
+            attempts[number] += 1
+            accept(registry, rows, Transfer(number, attempts[number]))
+    elapsed = time.perf_counter() - started
+    # Every file is listed once, as its latest attempt
+    assert len(rows) == len(registry) == count
+    assert sorted(transfer.number for transfer in rows) == list(range(count))
+    for transfer in rows:
+        assert transfer.attempt == attempts[transfer.number]
+        assert registry.find_path(transfer.path) is transfer
+        assert registry.find_url(transfer.url) is transfer
+        assert rows[rows.row(transfer)] is transfer
+    # Renumbering rows in Python on every retry took several seconds
+    assert elapsed < 3.0, elapsed
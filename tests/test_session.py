@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Several phones in one process, changed only on the thread that waits'''
+
+import time
+
+from threading import Thread, Event, get_ident
+
+from xender_pc.pool import ConnectionPool
+from xender_pc.session import SessionManager
+
+
+class Transfer:
+    '''Ends a moment after it starts or after hold is set, or when suspended'''
+    def __init__(self, seconds=0.01, size=1000, hold=None):
+        self.seconds = seconds
+        self.hold = hold
+        self.bytes_total = size
+        self.on_state = None
+        self.suspended = Event()
+
+    def start(self):
+        def run():
+            if self.hold is not None:
+                self.hold.wait()
+            if not self.suspended.wait(self.seconds):
+                self.on_state('finished')
+        Thread(target=run, daemon=True).start()
+
+    def suspend(self):
+        self.suspended.set()
+
+
+def test_sessions_are_changed_on_the_waiting_thread():
+    threads = set()
+    manager = SessionManager(2, pool=ConnectionPool())
+    first = manager.add('http://10.0.0.1:33455')
+    assert manager.add('http://10.0.0.1:33455') is first
+    joined = Event() # The first session stays busy until the second is added
+    manager.feed(first, ((Transfer(hold=joined), 1000) for i in range(10)))
+    assert len(manager) == 0 # Joins once wait() runs
+
+    def later():
+        # Another phone joins from another thread while the first is busy
+        second = manager.add('http://10.0.0.2:33455')
+        manager.feed(second, ((Transfer(), 1000) for i in range(5)))
+        joined.set()
+    Thread(target=later).start()
+    manager.wait(tick=lambda: threads.add(get_ident()), interval=0.01)
+    assert threads == {get_ident()}
+    assert len(manager) == 2
+    assert sorted(session.finished for session in manager) == [5, 10]
+
+
+def test_dropped_session_stops_and_the_others_carry_on():
+    ended = []
+    manager = SessionManager(2, on_end=lambda session, transfer, state: ended.append(session),
+                             pool=ConnectionPool())
+    slow = [Transfer(seconds=30) for i in range(4)]
+    stuck = manager.add('http://10.0.0.1:33455')
+    other = manager.add('http://10.0.0.2:33455')
+    manager.feed(stuck, ((transfer, 1000) for transfer in slow))
+    manager.feed(other, ((Transfer(), 1000) for i in range(3)))
+    Thread(target=lambda: (time.sleep(0.05), manager.drop(stuck.url))).start()
+    started = time.monotonic()
+    manager.wait(interval=0.01)
+    assert time.monotonic() - started < 10
+    assert len(manager) == 1 and list(manager) == [other]
+    assert other.finished == 3 and ended == [other] * 3
+    assert all(transfer.suspended.is_set() for transfer in slow[:2]) # The running ones
+    assert manager.add(stuck.url) is not stuck # Dropped urls can join again
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Index of pulled files'''
+
+import os
+
+from xender_pc.remote import RemoteFile
+from xender_pc.sync import SyncIndex
+
+
+def remote(number, mtime=1.7e9):
+    path = '/DCIM/IMG_%04d.jpg' % number
+    return RemoteFile('http://phone'+path, path, 1000 + number, mtime)
+
+
+def test_changes_skip_what_was_pulled(tmp_path):
+    index = SyncIndex(':memory:')
+    dest = str(tmp_path)
+    for number in range(10):
+        index.record(dest, remote(number), os.path.join(dest, 'IMG_%04d.jpg' % number),
+                     1000 + number)
+    index.commit()
+    listing = [remote(number) for number in range(12)]
+    listing[3] = remote(3, mtime=1.8e9)
+    changed = [item.path for item in index.changes(dest, listing, check_local=False)]
+    assert changed == ['/DCIM/IMG_0003.jpg', '/DCIM/IMG_0010.jpg', '/DCIM/IMG_0011.jpg']
+    assert index.skipped == 9
+
+
+def test_move_follows_the_file_through_its_index(tmp_path):
+    index = SyncIndex(str(tmp_path / 'sync.sqlite'))
+    dest = str(tmp_path)
+    old = os.path.join(dest, 'IMG_0001.jpg')
+    new = os.path.join(dest, '2023', '11', 'IMG_0001.jpg')
+    index.record(dest, remote(1), old, 1001)
+    index.move(old, new)
+    assert index.lookup(dest, ['/DCIM/IMG_0001.jpg'])['/DCIM/IMG_0001.jpg'][2] == new
+    plan = ' '.join(str(row) for row in index.db.execute(
+        'EXPLAIN QUERY PLAN UPDATE files SET local = ? WHERE local = ?', (new, old)))
+    assert 'files_local' in plan
+    index.close()
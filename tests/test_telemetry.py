@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Rates, ETAs and stalls of synthetic progress streams'''
+
+import pytest
+
+from xender_pc.telemetry import SAMPLES, STALL, RateMeter, Telemetry, format_eta
+
+
+class Clock:
+    '''Time that only moves when told to'''
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def stream(telemetry, clock, key, rate, seconds, total=-1, step=0.1, start=0):
+    '''Report progress of key at a steady rate, returns the bytes received'''
+    received = start
+    telemetry.record(key, received, total) # Transfers report where they start
+    for i in range(int(seconds / step)):
+        clock.now += step
+        received += int(rate * step)
+        telemetry.record(key, received, total)
+    return received
+
+
+def test_steady_stream_rate_and_eta():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    stream(telemetry, clock, 'a', 2000000, 10, total=40000000)
+    meter = telemetry.meters['a']
+    assert meter.rate == pytest.approx(2000000, rel=0.01)
+    assert meter.eta() == pytest.approx(10, rel=0.02)
+    assert format_eta(meter.eta()) in ('0:09', '0:10')
+
+
+def test_rate_follows_a_slowdown():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    received = stream(telemetry, clock, 'a', 4000000, 5)
+    stream(telemetry, clock, 'a', 1000000, 10, start=received)
+    assert telemetry.meters['a'].rate == pytest.approx(1000000, rel=0.05)
+
+
+def test_ring_keeps_a_fixed_number_of_samples():
+    meter = RateMeter()
+    for i in range(SAMPLES * 10):
+        meter.add(float(i), i * 100)
+    assert len(meter.times) == SAMPLES
+    assert meter.rate == pytest.approx(100)
+
+
+def test_stall_after_no_progress():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    stream(telemetry, clock, 'a', 1000000, 2)
+    meter = telemetry.meters['a']
+    assert not meter.stalled(clock.now)
+    assert meter.stalled(clock.now + STALL)
+
+
+def test_session_totals_and_end():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    a = stream(telemetry, clock, 'a', 1000000, 2)
+    b = stream(telemetry, clock, 'b', 1000000, 2)
+    assert telemetry.active() == 2
+    assert telemetry.bytes_total == a + b
+    telemetry.end('a', True)
+    telemetry.end('b')
+    assert telemetry.active() == 0
+    assert telemetry.completed == 1
+    assert telemetry.throughput() == 0.0
+
+
+def test_clear_forgets_every_meter():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    stream(telemetry, clock, 'a', 1000000, 1)
+    telemetry.clear()
+    assert telemetry.active() == 0
+    assert telemetry.snapshot()['transfers'] == []
+
+
+def test_resumed_transfer_counts_only_new_bytes():
+    clock = Clock()
+    telemetry = Telemetry(clock)
+    resumed_at = 2000 * 1000 * 1000 # Already on disk from before
+    received = stream(telemetry, clock, 'a', 1000000, 10, total=4000000000, start=resumed_at)
+    assert telemetry.bytes_total == received - resumed_at
+    assert telemetry.throughput() == pytest.approx(1000000, rel=0.05)
+    assert telemetry.meters['a'].rate == pytest.approx(1000000, rel=0.05)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Downloads against the stand-in server end up byte-identical'''
+
+import os
+import re
+
+import pytest
+
+from xender_pc.emulator import PhoneHandler, content
+from xender_pc.progress import finished_status
+from xender_pc.storage import ALIGNMENT, parse_size
+from xender_pc.transfer import MAX_SEGMENT_SIZE, SegmentedDownload, split_segments
+
+SIZE = 40 * 1024 * 1024 + 123 # Four segments and a ragged end
+
+
+def expected(size):
+    return b''.join(content(0, size))
+
+
+class RangeOnlyForProbe(PhoneHandler):
+    '''Answers the bytes=0-0 probe with 206 and every other range with the whole file'''
+    def do_GET(self):
+        if self.headers.get('Range') not in (None, 'bytes=0-0'):
+            del self.headers['Range']
+        PhoneHandler.do_GET(self)
+
+
+class ShortRanges(PhoneHandler):
+    '''Answers every range after the probe with its first half only'''
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match and self.headers['Range'] != 'bytes=0-0':
+            start, end = int(match.group(1)), int(match.group(2))
+            self.headers.replace_header('Range', 'bytes=%d-%d' % (start, (start+end) // 2))
+        PhoneHandler.do_GET(self)
+
+
+def test_segmented_download(serve, pool, run, tmp_path):
+    phone = serve({'/big.bin': SIZE})
+    path = str(tmp_path / 'big.bin')
+    transfer = SegmentedDownload(phone.url+'/big.bin', path, journal_dir=str(tmp_path),
+                                 pool=pool)
+    assert run(transfer) == 'finished'
+    assert len(transfer.segments) > 1
+    with open(path, 'rb') as f:
+        assert f.read() == expected(SIZE)
+
+
+def test_ignored_range_falls_back_to_one_stream(serve, pool, run, tmp_path):
+    phone = serve({'/big.bin': SIZE})
+    phone.RequestHandlerClass = RangeOnlyForProbe
+    path = str(tmp_path / 'big.bin')
+    transfer = SegmentedDownload(phone.url+'/big.bin', path, journal_dir=str(tmp_path),
+                                 pool=pool)
+    assert run(transfer) == 'finished'
+    assert transfer.bytes_received == SIZE
+    with open(path, 'rb') as f:
+        assert f.read() == expected(SIZE)
+    assert not os.path.exists(path+'.part')
+
+
+def test_split_segments_cover_the_file_in_order():
+    size = 1000 * 1000 * 1000 + 7
+    segments = split_segments(size, 4)
+    assert segments[0][0] == 0 and segments[-1][1] == size
+    assert all(a[1] == b[0] for a, b in zip(segments, segments[1:]))
+    assert max(end-start for start, end in segments) <= MAX_SEGMENT_SIZE
+    assert split_segments(size, 1) == [[0, size]]
+    assert split_segments(1000, 4) == [[0, 1000]]
+
+
+def test_finished_download_is_checked_by_size(serve, pool, run, tmp_path):
+    phone = serve({'/small.bin': 1000})
+    transfer = SegmentedDownload(phone.url+'/small.bin', str(tmp_path / 'small.bin'),
+                                 journal_dir=str(tmp_path), pool=pool)
+    assert run(transfer) == 'finished'
+    # The stand-in sends no digest, so only the size was compared
+    assert transfer.verification == 'size'
+    assert finished_status(transfer.verification) == 'Completed (size OK)'
+
+
+def test_buffer_sizes_are_binary_and_aligned():
+    assert parse_size('256K') == 256 * 1024
+    assert parse_size('4M') == 4 * 1024 * 1024 == parse_size('4MiB')
+    assert parse_size('1.5M') == 2 * ALIGNMENT
+    assert parse_size('1000') == 1000
+    for text in ('4M/s', '0', 'lots'):
+        with pytest.raises(ValueError):
+            parse_size(text)
+
+
+def test_short_ranges_end_corrupt(serve, pool, run, tmp_path):
+    phone = serve({'/big.bin': SIZE})
+    phone.RequestHandlerClass = ShortRanges
+    path = str(tmp_path / 'big.bin')
+    transfer = SegmentedDownload(phone.url+'/big.bin', path, journal_dir=str(tmp_path),
+                                 pool=pool)
+    assert run(transfer) == 'corrupt'
+    assert transfer.bytes_received < SIZE
+    assert not os.path.exists(path) # Never renamed to its final name
+
+
+def test_empty_file_answering_416_to_the_probe(serve, pool, run, tmp_path):
+    phone = serve({'/empty.txt': 0})
+    path = str(tmp_path / 'empty.txt')
+    transfer = SegmentedDownload(phone.url+'/empty.txt', path, journal_dir=str(tmp_path),
+                                 pool=pool)
+    assert run(transfer) == 'finished'
+    assert os.path.getsize(path) == 0
@@ -0,0 +1,956 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmarks against the stand-in phone server
+Each benchmark returns a dict of results, scale shrinks the workload
+for quick runs. Results saved from two commits are compared by the
+suffix of their keys: *_per_second should not drop, *seconds and *_us
+should not grow
+'''
+
+import os
+import sys
+import time
+import random
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import importlib.util
+
+from queue import Queue, Empty
+from threading import Event, Thread
+
+from . import discovery
+from .emulator import PhoneServer
+from .monitor import INTERVAL as BEAT_INTERVAL, Monitor
+from .pool import ConnectionPool
+from .postprocess import DEFAULT_STAGES, Image, PostProcessor, process, resolve
+from .progress import ProgressBatcher, get_size, progress_status
+from .registry import Rows, TransferRegistry
+from .remote import RemoteFile
+from .scheduler import MAX_ACTIVE, TransferScheduler
+from .session import SessionManager, fairness
+from .storage import FileWriter
+from .integrity import StreamHasher
+from .sync import SyncIndex
+from .telemetry import Telemetry, format_rate
+from .transfer import CHUNK_SIZE, CONNECTIONS, SegmentedDownload
+from .upload import Upload, upload_url, walk
+
+ENDED = ('finished', 'cancelled', 'failed', 'corrupt')
+THRESHOLD = 0.1 # Relative change reported as a regression
+HIGHER_BETTER = ('_per_second', 'speedup', 'fairness')
+LOWER_BETTER = ('seconds', '_us', '_per_gb', '_kb')
+
+
+def run_transfers(transfers, max_active=MAX_ACTIVE, ended=None, sizes=None):
+    '''
+    Run transfers through a scheduler, returns how many finished
+    sizes are the file sizes in the listing, for smallest first, and the
+    time.perf_counter() of every finish is added to the ended list
+    '''
+    events = Queue()
+    scheduler = TransferScheduler(lambda transfer: transfer.start(), max_active)
+    for i, transfer in enumerate(transfers):
+        transfer.on_state = lambda state, transfer=transfer: events.put((transfer, state))
+        scheduler.submit(transfer, sizes[i] if sizes else transfer.bytes_total)
+    finished = 0
+    while scheduler.active or len(scheduler):
+        transfer, state = events.get()
+        if state in ENDED:
+            scheduler.done(transfer)
+            finished += state == 'finished'
+            if ended is not None and state == 'finished':
+                ended.append(time.perf_counter())
+    return finished
+
+
+def bench_upload(scale=1.0, files=10000, file_size=10*1000, large=5*1000**3,
+                 max_active=MAX_ACTIVE):
+    '''
+    Uploads of a folder of small files and of one large file to the stand-in
+    phone's upload handler. The large file is sparse so it costs no disk
+    '''
+    files = max(1, int(files * scale))
+    large = max(CHUNK_SIZE, int(large * scale))
+    results = {}
+    with PhoneServer() as phone, tempfile.TemporaryDirectory() as source:
+        url = upload_url(phone.url)
+        tree = os.path.join(source, 'Album')
+        block = os.urandom(file_size)
+        for i in range(files):
+            folder = os.path.join(tree, '%03d' % (i // 100))
+            if not i % 100:
+                os.makedirs(folder)
+            with open(os.path.join(folder, 'IMG_%05d.jpg' % i), 'wb') as f:
+                f.write(block)
+        big = os.path.join(source, 'movie.mp4')
+        with open(big, 'wb') as f:
+            f.truncate(large)
+
+        for name, paths, size in (('tree', [tree], files * file_size),
+                                  ('large', [big], large)):
+            pool = ConnectionPool()
+            started = time.perf_counter()
+            # The folder is walked as the uploads are made, like a drop
+            uploads = [Upload(url, path, relative, pool=pool) for path, relative in walk(paths)]
+            finished = run_transfers(uploads, max_active)
+            elapsed = time.perf_counter() - started
+            pool.clear()
+            results[name] = {'files': len(uploads),
+                             'finished': finished,
+                             'bytes': size,
+                             'seconds': round(elapsed, 3),
+                             'files_per_second': round(len(uploads) / elapsed, 1),
+                             'megabytes_per_second': round(size / elapsed / 1e6, 1),
+                             }
+        results['received_bytes'] = sum(size for name, size in phone.uploads)
+    return results
+
+
+def bench_scheduling(scale=1.0, small=200, small_size=200*1000, large=4,
+                     large_size=25*1000*1000, bandwidth=40*1000*1000, latency=0.002,
+                     limits=(1, 2, 3, 4, 8, 0)):
+    '''
+    Total and median completion time of a batch of photos and videos
+    through a throttled phone, for each limit of transfers at once. A
+    limit of 0 starts them all together like accepting every download did
+    '''
+    small = max(1, int(small * scale))
+    large = max(1, int(large * scale))
+    listing = {'/DCIM/IMG_%04d.jpg' % i: small_size for i in range(small)}
+    listing.update(('/Movies/VID_%02d.mp4' % i, large_size) for i in range(large))
+    results = {'files': len(listing),
+               'bytes': small * small_size + large * large_size,
+               'bandwidth': bandwidth,
+               }
+    with PhoneServer(listing, bandwidth=bandwidth, latency=latency) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        for limit in limits:
+            transfers = [SegmentedDownload(phone.url+path,
+                                           os.path.join(dest, os.path.basename(path)),
+                                           journal_dir=dest, pool=ConnectionPool())
+                         for path in listing]
+            ended = []
+            started = time.perf_counter()
+            finished = run_transfers(transfers, limit or len(transfers), ended,
+                                     list(listing.values()))
+            elapsed = time.perf_counter() - started
+            results['all' if not limit else str(limit)] = {
+                'finished': finished,
+                'seconds': round(elapsed, 3),
+                'median_file_seconds': round(median([end - started for end in ended]), 3),
+                'files_per_minute': round(finished / elapsed * 60),
+                }
+            for transfer in transfers:
+                os.remove(transfer.path)
+    return results
+
+
+def bench_pool(scale=1.0, files=5000, size=100*1000, max_active=MAX_ACTIVE):
+    '''Small files per second with and without keep-alive connections'''
+    files = max(1, int(files * scale))
+    listing = {'/small/%05d.jpg' % i: size for i in range(files)}
+    results = {'files': files, 'size': size}
+    with PhoneServer(listing) as phone, tempfile.TemporaryDirectory() as dest:
+        # An idle timeout of 0 closes every connection after its request
+        for name, pool in (('unpooled', ConnectionPool(idle_timeout=0)),
+                           ('pooled', ConnectionPool())):
+            transfers = [SegmentedDownload(phone.url+path,
+                                           os.path.join(dest, os.path.basename(path)),
+                                           journal_dir=dest, pool=pool)
+                         for path in listing]
+            started = time.perf_counter()
+            finished = run_transfers(transfers, max_active)
+            elapsed = time.perf_counter() - started
+            pool.clear()
+            results[name] = {'finished': finished,
+                             'seconds': round(elapsed, 3),
+                             'files_per_second': round(files / elapsed, 1),
+                             'megabytes_per_second': round(files * size / elapsed / 1e6, 1),
+                             'connections': pool.opened,
+                             }
+    results['speedup'] = round(results['pooled']['files_per_second']
+                               / results['unpooled']['files_per_second'], 2)
+    return results
+
+
+def bench_sessions(scale=1.0, phones=10, files=20, size=4*1000*1000,
+                   max_active=MAX_ACTIVE):
+    '''Pull from several stand-in phones at once, aggregate rate and fairness between them'''
+    files = max(1, int(files * scale))
+    servers = [PhoneServer({'/DCIM/%03d.mp4' % i: size for i in range(files)}).start()
+               for phone in range(phones)]
+    manager = SessionManager(max_active)
+    try:
+        with tempfile.TemporaryDirectory() as dest:
+            started = time.perf_counter()
+            for server in servers:
+                session = manager.add(server.url)
+                folder = os.path.join(dest, session.name)
+                os.makedirs(folder)
+                manager.feed(session, ((SegmentedDownload(server.url+path,
+                                                          folder+path.replace('/', '_'),
+                                                          journal_dir=folder), size)
+                                       for path in server.files))
+            manager.wait()
+            elapsed = time.perf_counter() - started
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    rates = [session.throughput() for session in manager]
+    return {'phones': phones,
+            'files_per_phone': files,
+            'size': size,
+            'finished': sum(session.finished for session in manager),
+            'seconds': round(elapsed, 3),
+            'megabytes_per_second': round(phones * files * size / elapsed / 1e6, 1),
+            'session_megabytes_per_second': [round(rate / 1e6, 1) for rate in rates],
+            'fairness': round(fairness(rates), 3),
+            }
+
+
+def synthetic_listing(files, changed_every=100, mtime=1.7e9):
+    '''RemoteFiles like a DCIM folder, every changed_every-th one newer than mtime'''
+    for i in range(files):
+        path = '/DCIM/Camera/IMG_%07d.jpg' % i
+        changed = changed_every and i % changed_every == 0
+        yield RemoteFile('http://phone'+path, path, 3000000 + i % 1000,
+                         mtime + 60 if changed else mtime)
+
+
+def bench_sync(scale=1.0, files=200000):
+    '''Diff a listing against an index of the same files, a few of them changed'''
+    files = max(1, int(files * scale))
+    results = {'files': files}
+    with tempfile.TemporaryDirectory() as folder:
+        index = SyncIndex(os.path.join(folder, 'sync.sqlite'))
+        started = time.perf_counter()
+        for remote in synthetic_listing(files, changed_every=0):
+            index.record(folder, remote, folder+remote.path, remote.size)
+        index.commit()
+        results['record_seconds'] = round(time.perf_counter() - started, 3)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        changed = sum(1 for remote in index.changes(folder, synthetic_listing(files),
+                                                    check_local=False))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        index.close()
+    results.update({'changed': changed,
+                    'skipped': files - changed,
+                    'diff_seconds': round(elapsed, 3),
+                    'entries_per_second': round(files / elapsed),
+                    'peak_memory_kb': peak // 1024,
+                    })
+    return results
+
+
+def bench_storage(scale=1.0, size=1024**3,
+                  buffer_sizes=(CHUNK_SIZE, 1024**2, 4*1024**2, 16*1024**2)):
+    '''
+    Sustained write rate and CPU time per GB through FileWriter for each buffer size
+    The file goes to the temporary folder, set TMPDIR to measure another disk
+    '''
+    size = max(CHUNK_SIZE, int(size * scale))
+    chunk = os.urandom(CHUNK_SIZE)
+    results = {'bytes': size}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.bin')
+        for buffer_size in buffer_sizes:
+            writer = FileWriter(path, size, buffer_size)
+            wall, cpu = time.perf_counter(), time.process_time()
+            writer.create()
+            buffer = writer.buffer(0)
+            for offset in range(0, size, CHUNK_SIZE):
+                buffer.add(chunk[:size-offset])
+            buffer.flush()
+            writer.finalize() # Includes the fsync before the rename
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            os.remove(path)
+            results[str(buffer_size)] = {'megabytes_per_second': round(size / wall / 1e6, 1),
+                                         'cpu_seconds_per_gb': round(cpu * 1e9 / size, 3),
+                                         }
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle-1] + values[middle]) / 2
+
+
+def bench_connect(scale=1.0, trials=50, latency=0.0):
+    '''Seconds to find the stand-in server through gateway discovery, as connect() does'''
+    trials = max(3, int(trials * scale))
+    variable = discovery.EnvBackend.variable
+    saved = os.environ.get(variable)
+    # An address that never answers is probed alongside, like a second adapter
+    os.environ[variable] = '127.0.0.1,192.0.2.1'
+    times = []
+    try:
+        with PhoneServer({}, latency=latency) as phone:
+            for trial in range(trials):
+                discovery.forget()
+                started = time.perf_counter()
+                host = discovery.find_server(phone.server_port)
+                times.append(time.perf_counter() - started)
+                if host != '127.0.0.1':
+                    raise ConnectionError('Stand-in server was not found')
+            started = time.perf_counter()
+            for trial in range(trials):
+                discovery.find_server(phone.server_port) # Cached gateway
+            cached = (time.perf_counter() - started) / trials
+    finally:
+        discovery.forget()
+        if saved is None:
+            del os.environ[variable]
+        else:
+            os.environ[variable] = saved
+    return {'trials': trials,
+            'connect_seconds': round(median(times), 4),
+            'connect_max_seconds': round(max(times), 4),
+            'reconnect_seconds': round(cached, 4),
+            }
+
+
+def reap(process):
+    '''Wait for a child process, returns its peak memory in KB, None where it cannot be told'''
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # Linux counts in KB and macOS in bytes
+    return usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+STARTUP_STEPS = (('imported', 'import_seconds'), ('window created', 'window_seconds'),
+                 ('first paint', 'first_paint_seconds'), ('connect started', 'connect_seconds'))
+
+
+def bench_startup(scale=1.0, runs=5, timeout=60):
+    '''
+    Seconds from starting python -m xender_pc to the window's startup steps
+    Each run is a new process with XENDER_TRACE_STARTUP set, timed as its
+    lines arrive so interpreter start is counted. XENDER_AUTO_CONNECT makes
+    it connect as if Link Phone was clicked, and it is stopped once connect()
+    has started. Qt draws offscreen unless QT_QPA_PLATFORM says otherwise
+    '''
+    if importlib.util.find_spec('PyQt5') is None:
+        return {'skipped': 'PyQt5 is not installed'}
+    runs = max(1, int(runs * scale))
+    env = dict(os.environ, XENDER_TRACE_STARTUP='1', XENDER_AUTO_CONNECT='1',
+               PYTHONUNBUFFERED='1')
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = {label: [] for label, key in STARTUP_STEPS}
+    peaks = []
+    for run in range(runs):
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-m', 'xender_pc'], cwd=root, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        lines = Queue()
+        def read(stdout=process.stdout, lines=lines):
+            for line in stdout:
+                lines.put((time.perf_counter(), line))
+            lines.put((None, None))
+        Thread(target=read, daemon=True).start()
+        seen = {}
+        output = []
+        try:
+            while len(seen) < len(times):
+                arrived, line = lines.get(timeout=timeout)
+                if line is None:
+                    break
+                output.append(line)
+                label = line.partition('startup: ')[2].rsplit(' ', 2)[0]
+                if label in times and label not in seen:
+                    seen[label] = arrived - started
+        except Empty:
+            pass
+        finally:
+            process.kill()
+            peaks.append(reap(process))
+        if len(seen) < len(times):
+            raise RuntimeError('Window did not start:\n' + ''.join(output[-20:]))
+        for label, elapsed in seen.items():
+            times[label].append(elapsed)
+    results = {'runs': runs}
+    for label, key in STARTUP_STEPS:
+        results[key] = round(median(times[label]), 3)
+    if None not in peaks:
+        results['peak_kb'] = median(peaks)
+    return results
+
+
+def bench_footprint(scale=1.0, runs=5, files=20, size=1000*1000):
+    '''
+    Startup time and peak memory of the command line next to the window
+    Each path's modules are imported in a fresh process, and a whole pull
+    of files from the stand-in phone is run as the command line would.
+    bench startup times the window up to connect()
+    '''
+    runs = max(1, int(runs * scale))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = {'cli': 'xender_pc.cli'}
+    if importlib.util.find_spec('PyQt5') is not None:
+        paths['gui'] = 'xender_pc.gui'
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    results = {'runs': runs}
+    for name, module in paths.items():
+        code = ('import time; started = time.perf_counter(); import %s; '
+                'print(time.perf_counter() - started)' % module)
+        seconds = []
+        peaks = []
+        for run in range(runs):
+            process = subprocess.Popen([sys.executable, '-c', code], cwd=root, env=env,
+                                       stdout=subprocess.PIPE, universal_newlines=True)
+            output = process.stdout.read()
+            peaks.append(reap(process))
+            if process.returncode:
+                raise RuntimeError('Importing %s failed' % module)
+            seconds.append(float(output))
+        results[name] = {'import_seconds': round(median(seconds), 3)}
+        if None not in peaks:
+            results[name]['import_peak_kb'] = median(peaks)
+    if 'gui' not in paths:
+        results['gui'] = {'skipped': 'PyQt5 is not installed'}
+
+    listing = {'/DCIM/Camera/IMG_%05d.jpg' % i: size for i in range(files)}
+    seconds = []
+    peaks = []
+    with PhoneServer(listing) as phone:
+        for run in range(runs):
+            with tempfile.TemporaryDirectory() as dest:
+                started = time.perf_counter()
+                process = subprocess.Popen([sys.executable, '-m', 'xender_pc', 'pull',
+                                            '--url', phone.url, '--dest', dest], cwd=root,
+                                           stdout=subprocess.DEVNULL)
+                peaks.append(reap(process))
+                seconds.append(time.perf_counter() - started)
+                if process.returncode:
+                    raise RuntimeError('pull failed')
+    results['cli']['pull_files'] = files
+    results['cli']['pull_seconds'] = round(median(seconds), 3)
+    if None not in peaks:
+        results['cli']['pull_peak_kb'] = median(peaks)
+    return results
+
+
+def bench_throughput(scale=1.0, size=512*1000*1000, connections=CONNECTIONS,
+                     connection_bandwidth=20*1000*1000):
+    '''
+    One large file over one and several connections
+    Each connection is capped on its own, like a TCP stream over Wi-Fi
+    that gets less than the link, which is what segments make up for
+    '''
+    size = max(CHUNK_SIZE, int(size * scale))
+    with PhoneServer({'/Movies/large.mp4': size},
+                     connection_bandwidth=connection_bandwidth) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        results = {'bytes': size, 'connections': connections,
+                   'connection_bandwidth': connection_bandwidth}
+        for name, count in (('single', 1), ('segmented', connections)):
+            transfer = SegmentedDownload(phone.url+'/Movies/large.mp4',
+                                         os.path.join(dest, name+'.mp4'),
+                                         connections=count, journal_dir=dest,
+                                         pool=ConnectionPool())
+            started = time.perf_counter()
+            finished = run_transfers([transfer])
+            elapsed = time.perf_counter() - started
+            results[name] = {'finished': finished,
+                             'seconds': round(elapsed, 3),
+                             'megabytes_per_second': round(size / elapsed / 1e6, 1),
+                             }
+    results['speedup'] = round(results['single']['seconds'] / results['segmented']['seconds'], 2)
+    return results
+
+
+class NullHasher:
+    '''Stands in for StreamHasher to time a download without hashing'''
+    def __init__(self, path, algorithm):
+        self.algorithm = algorithm
+
+    def update(self, offset, data):
+        pass
+
+    def close(self):
+        pass
+
+    def finish(self, size):
+        return ''
+
+
+def bench_hashing(scale=1.0, size=256*1000*1000, repeats=3, connections=CONNECTIONS,
+                  bandwidth=40*1000*1000):
+    '''
+    Cost of hashing downloads as they are written, as a share of throughput
+    The server is held to a Wi-Fi like rate, unlimited loopback would only
+    measure the CPU that the server in this process leaves over. Runs with
+    and without the hasher take turns so both see the same machine
+    '''
+    size = max(CHUNK_SIZE, int(size * scale))
+    seconds = {'hashed': [], 'plain': []}
+    with PhoneServer({'/Movies/large.mp4': size}, bandwidth=bandwidth) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        for repeat in range(repeats + 1):
+            for name, hashing in (('hashed', StreamHasher), ('plain', NullHasher)):
+                transfer = SegmentedDownload(phone.url+'/Movies/large.mp4',
+                                             os.path.join(dest, name+'.mp4'),
+                                             connections=connections, journal_dir=dest,
+                                             pool=ConnectionPool(), hashing=hashing)
+                started = time.perf_counter()
+                if run_transfers([transfer]) != 1:
+                    raise RuntimeError('Download did not finish: '+name)
+                if repeat: # The first round warms the page cache and the pool
+                    seconds[name].append(time.perf_counter() - started)
+                os.remove(os.path.join(dest, name+'.mp4'))
+    hashed = median(seconds['hashed'])
+    plain = median(seconds['plain'])
+    overhead = (hashed - plain) / plain * 100
+    return {'bytes': size,
+            'bandwidth': bandwidth,
+            'repeats': repeats,
+            'hashed': {'seconds': round(hashed, 3),
+                       'megabytes_per_second': round(size / hashed / 1e6, 1)},
+            'plain': {'seconds': round(plain, 3),
+                      'megabytes_per_second': round(size / plain / 1e6, 1)},
+            'overhead_percent': round(overhead, 1),
+            'under_5_percent': overhead < 5,
+            }
+
+
+def progress_after(transfer, after=0):
+    '''
+    List that gets the time.monotonic() of the first progress report of
+    transfer past after bytes, with an Event set at the same time
+    '''
+    seen = []
+    reached = Event()
+    def progress(bytes_received, bytes_total):
+        if bytes_received > after and not seen:
+            seen.append(time.monotonic())
+            reached.set()
+    transfer.on_progress = progress
+    return seen, reached
+
+
+def bench_recovery(scale=1.0, size=64*1000*1000, drop_after=8*1000*1000):
+    '''
+    Seconds from a dropped connection to the next written buffer, and
+    from restarting a suspended download to its first new buffer
+    '''
+    size = max(4*CHUNK_SIZE, int(size * scale))
+    drop_after = min(drop_after, size // 4)
+    path = '/Movies/drop.mp4'
+    results = {'bytes': size}
+    # Every other download request is cut, so the retry of a dropped one goes through
+    with PhoneServer({path: size}, drop_every=2, drop_after=drop_after) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        phone.requests = 1 # The first request is the one dropped
+        transfer = SegmentedDownload(phone.url+path, os.path.join(dest, 'drop.mp4'),
+                                     connections=1, journal_dir=dest, pool=ConnectionPool())
+        seen, reached = progress_after(transfer, drop_after)
+        started = time.perf_counter()
+        finished = run_transfers([transfer])
+        results['retry'] = {'finished': finished,
+                            'drops': len(phone.drops),
+                            'seconds': round(time.perf_counter() - started, 3),
+                            }
+        if phone.drops and seen:
+            results['retry']['recovery_seconds'] = round(seen[0] - phone.drops[0], 4)
+
+    # Throttled so the first attempt can be suspended halfway
+    with PhoneServer({path: size}, bandwidth=size) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        target = os.path.join(dest, 'resume.mp4')
+        transfer = SegmentedDownload(phone.url+path, target, journal_dir=dest)
+        seen, reached = progress_after(transfer, size // 2)
+        transfer.on_state = lambda state: None
+        transfer.start()
+        reached.wait()
+        transfer.suspend()
+        time.sleep(0.5) # The workers write their buffers and close the journal
+        offset = transfer.bytes_received
+        phone.bucket.set_rate(0)
+        transfer = SegmentedDownload(phone.url+path, target, journal_dir=dest)
+        seen, reached = progress_after(transfer, offset)
+        started = time.monotonic()
+        finished = run_transfers([transfer])
+        results['resume'] = {'finished': finished,
+                             'resumed_from': offset,
+                             }
+        if seen:
+            results['resume']['first_buffer_seconds'] = round(seen[0] - started, 4)
+    return results
+
+
+def bench_small_files(scale=1.0, files=2000, size=100*1000, latency=0.002):
+    '''Small files per second over pooled connections with Wi-Fi like latency'''
+    files = max(1, int(files * scale))
+    listing = {'/small/%05d.jpg' % i: size for i in range(files)}
+    with PhoneServer(listing, latency=latency) as phone, \
+         tempfile.TemporaryDirectory() as dest:
+        pool = ConnectionPool()
+        transfers = [SegmentedDownload(phone.url+path,
+                                       os.path.join(dest, os.path.basename(path)),
+                                       journal_dir=dest, pool=pool)
+                     for path in listing]
+        started = time.perf_counter()
+        finished = run_transfers(transfers)
+        elapsed = time.perf_counter() - started
+        pool.clear()
+    return {'files': files,
+            'size': size,
+            'latency': latency,
+            'finished': finished,
+            'seconds': round(elapsed, 3),
+            'files_per_second': round(files / elapsed, 1),
+            }
+
+
+class SyntheticRow:
+    '''What a row of the download list keeps, without Qt'''
+    __slots__ = ('path', 'url', 'name', 'status', 'size', 'state', 'total', 'shown')
+
+    def __init__(self, number, attempt=0):
+        self.name = 'IMG_%05d.jpg' % number
+        self.path = '/dest/'+self.name
+        self.url = 'http://192.168.43.1:33455/DCIM/%s?try=%d' % (self.name, attempt)
+        self.status = 'Queued'
+        self.size = ''
+        self.state = 'queued'
+        self.total = None
+        self.shown = None
+
+    def apply_progress(self, telemetry, received, total):
+        '''DownloadItem.apply_progress, True when the row would be redrawn'''
+        if total != self.total:
+            self.total = total
+            self.size = get_size(total)
+        self.status = progress_status(received, total)
+        meter = telemetry.meters.get(self)
+        if meter is not None and meter.rate:
+            self.status += ' '+format_rate(meter)
+        shown = (self.state, self.name, self.status, self.size)
+        if shown == self.shown:
+            return False
+        self.shown = shown
+        return True
+
+
+def fill_rows(count):
+    '''Rows and registry of count synthetic transfers'''
+    rows = Rows()
+    registry = TransferRegistry()
+    for number in range(count):
+        item = SyntheticRow(number)
+        registry.replace(item)
+        rows.append(item)
+    return rows, registry
+
+
+def bench_rows(scale=1.0, rows=10000, updates=10):
+    '''
+    Insert, update, retry and remove transfers in the download list store,
+    the way the window's model does it, with the memory the rows take
+    '''
+    count = max(100, int(rows * scale))
+    results = {'rows': count}
+    tracemalloc.start()
+    store, registry = fill_rows(count)
+    results['memory_kb'] = tracemalloc.get_traced_memory()[0] // 1024
+    tracemalloc.stop()
+    del store, registry
+
+    started = time.perf_counter()
+    store, registry = fill_rows(count)
+    results['insert_seconds'] = round(time.perf_counter() - started, 4)
+
+    started = time.perf_counter()
+    changed = 0
+    for update in range(1, updates+1):
+        for item in store:
+            item.status = progress_status(update, updates)
+            shown = (item.state, item.name, item.status, item.size)
+            if shown != item.shown:
+                item.shown = shown
+                if store.row(item) is not None:
+                    changed += 1
+    results['update_seconds'] = round(time.perf_counter() - started, 4)
+    results['updates_per_second'] = round(changed / max(time.perf_counter() - started, 1e-9))
+
+    # Retrying every file replaces its row, the old one goes from the middle of the list
+    started = time.perf_counter()
+    for number in range(count):
+        item = SyntheticRow(number, 1)
+        old = registry.replace(item)
+        if old is not None:
+            store.remove(old)
+        store.append(item)
+    results['retry_seconds'] = round(time.perf_counter() - started, 4)
+
+    order = list(store)
+    random.Random(1).shuffle(order)
+    started = time.perf_counter()
+    for item in order:
+        registry.discard(item)
+        store.remove(item)
+    results['remove_seconds'] = round(time.perf_counter() - started, 4)
+    return results
+
+
+def bench_progress(scale=1.0, events=200000, transfers=200, frame_every=500):
+    '''
+    Cost of a progress report on the way to the download list: the
+    telemetry record and batching per event, and per frame the status
+    text and the check that skips rows whose text did not change.
+    Everything but drawing, which needs Qt
+    '''
+    events = max(transfers, int(events * scale))
+    telemetry = Telemetry()
+    batcher = ProgressBatcher()
+    rows = [SyntheticRow(number) for number in range(transfers)]
+    for row in rows:
+        row.state = 'inprogress'
+    total = 1000 * 1000 * 1000
+    redrawn = skipped = 0
+    started = time.perf_counter()
+    for event in range(events):
+        row = rows[event % transfers]
+        received = event * CHUNK_SIZE // transfers
+        telemetry.record(row, received, total)
+        batcher.report(row, received, total)
+        if event % frame_every == 0:
+            for item, (received, total) in batcher.take():
+                if item.apply_progress(telemetry, received, total):
+                    redrawn += 1
+                else:
+                    skipped += 1
+    elapsed = time.perf_counter() - started
+    return {'events': events,
+            'transfers': transfers,
+            'rows_redrawn': redrawn,
+            'rows_skipped': skipped,
+            'event_us': round(elapsed / events * 1e6, 2),
+            'events_per_second': round(events / elapsed),
+            }
+
+
+
+class Slots:
+    '''Stand-in for a window class, its slot does what a row update costs'''
+    def progress(self, received, total):
+        return received * 100 // total if total > 0 else 0
+
+
+def time_calls(slot, calls):
+    '''Seconds per call of slot'''
+    started = time.perf_counter()
+    for call in range(calls):
+        slot(call, calls)
+    return (time.perf_counter() - started) / calls
+
+
+def bench_monitor(scale=1.0, calls=200000, repeats=5, stall=0.2):
+    '''
+    Cost of the monitor's hooks on a slot, disabled and enabled, and
+    whether a stall of the calling thread is caught with its stack
+    The slots are warmed up and then timed in turn each repeat, so a slow
+    patch of the machine hits all of them, and overheads are the median
+    of the differences within a repeat
+    '''
+    calls = max(1000, int(calls * scale))
+    results = {'calls': calls * repeats}
+    # Each gets its own copy of the class since instrument() changes it in place
+    disabled = Monitor(0, None).instrument(type('Disabled', (Slots,), {'progress': Slots.progress}))
+    enabled = Monitor(1000, None).instrument(type('Enabled', (Slots,), {'progress': Slots.progress}))
+    # Off means the very function runs, which timing alone cannot tell from noise
+    results['disabled_unwrapped'] = vars(disabled)['progress'] is Slots.progress
+    slots = {'plain': Slots().progress, 'disabled': disabled().progress, 'enabled': enabled().progress}
+    times = {name: [] for name in slots}
+    for slot in slots.values():
+        time_calls(slot, min(calls, 10000))
+    for repeat in range(repeats):
+        for name, slot in slots.items():
+            times[name].append(time_calls(slot, calls))
+    # Per call times follow the machine's load more than the code, so they
+    # end in _per_call to stay out of compare()
+    for name in slots:
+        results[name+'_us_per_call'] = round(median(times[name]) * 1e6, 4)
+    for name in ('disabled', 'enabled'):
+        overhead = median([hooked - plain for hooked, plain in zip(times[name], times['plain'])])
+        results[name+'_overhead_us_per_call'] = round(overhead * 1e6, 4)
+
+    watcher = Monitor(stall * 500, None) # Half the stall as the threshold
+    watcher.start()
+    for beat in range(3):
+        time.sleep(BEAT_INTERVAL)
+        watcher.beat()
+    time.sleep(BEAT_INTERVAL + stall) # The blocked event loop
+    watcher.beat()
+    watcher.stop()
+    results['stalls'] = len(watcher.stalls)
+    if watcher.stalls:
+        start, seconds, stack = watcher.stalls[0]
+        results['stall_length'] = round(seconds, 3)
+        results['stall_frame'] = stack[-1]
+    return results
+
+
+def sample_photo(size):
+    '''Bytes of a JPEG when Pillow is there to read it back, random bytes otherwise'''
+    if Image is None:
+        return os.urandom(size)
+    from io import BytesIO
+    image = Image.effect_noise((1024, 768), 64).convert('RGB')
+    data = BytesIO()
+    image.save(data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+def bench_postprocess(scale=1.0, files=2000, size=256*1024,
+                      stages=DEFAULT_STAGES+('sort',), workers=None):
+    '''
+    Post-processing of finished files, one after the other as a slot
+    on the GUI thread would do it, then in the process pool. blocked is
+    the time the calling thread could not handle events
+    '''
+    files = max(1, int(files * scale))
+    data = sample_photo(size)
+    functions = resolve(stages)
+    results = {'files': files, 'size': len(data), 'stages': list(stages),
+               'thumbnails': Image is not None}
+    with tempfile.TemporaryDirectory() as folder:
+        options = {'sort_root': os.path.join(folder, 'sorted'),
+                   'thumbnail_dir': os.path.join(folder, 'thumbnails')}
+        for name in ('serial', 'pooled'):
+            source = os.path.join(folder, name)
+            os.makedirs(source)
+            paths = [os.path.join(source, 'IMG_%05d.jpg' % i) for i in range(files)]
+            for path in paths:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            failed = 0
+            started = time.perf_counter()
+            if name == 'serial':
+                for path in paths:
+                    failed += 'error' in process(path, functions, options)
+                blocked = time.perf_counter() - started
+                workers_used = 1
+            else:
+                outcomes = []
+                processor = PostProcessor(functions, options, workers,
+                                          on_state=lambda key, state, info:
+                                          outcomes.append(state))
+                for path in paths:
+                    processor.submit(path, path)
+                blocked = time.perf_counter() - started
+                processor.wait()
+                processor.shutdown()
+                failed = outcomes.count('failed')
+                workers_used = processor.workers
+            elapsed = time.perf_counter() - started
+            results[name] = {'workers': workers_used,
+                             'failed': failed,
+                             'seconds': round(elapsed, 3),
+                             'blocked_seconds': round(blocked, 4),
+                             'files_per_second': round(files / elapsed, 1),
+                             }
+    results['speedup'] = round(results['pooled']['files_per_second']
+                               / results['serial']['files_per_second'], 2)
+    return results
+
+
+def metadata():
+    '''What the results were measured on, so runs from two commits can be told apart'''
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return {'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'argv': sys.argv[1:],
+            }
+
+
+def flatten(results, prefix=''):
+    '''Dotted key to number for every measurement in nested results'''
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix+key+'.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix+key] = value
+    return values
+
+
+def compare(old, new, threshold=THRESHOLD):
+    '''
+    (key, old value, new value, relative change) of the measurements in
+    new that got worse than old by more than threshold
+    '''
+    old, new = flatten(old), flatten(new)
+    regressions = []
+    for key, value in sorted(new.items()):
+        before = old.get(key)
+        if not before:
+            continue
+        change = (value - before) / before
+        name = key.rsplit('.', 1)[-1]
+        if name.endswith(HIGHER_BETTER):
+            worse = -change
+        elif name.endswith(LOWER_BETTER):
+            worse = change
+        else:
+            continue # Counts and settings
+        if worse > threshold:
+            regressions.append((key, before, value, change))
+    return regressions
+
+
+BENCHMARKS = {'connect': bench_connect,
+              'footprint': bench_footprint,
+              'hashing': bench_hashing,
+              'monitor': bench_monitor,
+              'pool': bench_pool,
+              'postprocess': bench_postprocess,
+              'progress': bench_progress,
+              'recovery': bench_recovery,
+              'rows': bench_rows,
+              'scheduling': bench_scheduling,
+              'sessions': bench_sessions,
+              'small_files': bench_small_files,
+              'startup': bench_startup,
+              'storage': bench_storage,
+              'sync': bench_sync,
+              'throughput': bench_throughput,
+              'upload': bench_upload,
+              }
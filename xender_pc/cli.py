@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Command line entry point
+    python -m xender_pc                   opens the window
+    python -m xender_pc --stall-ms 200    and reports what blocks it
+    python -m xender_pc pull --dest DIR   transfers without Qt
+    python -m xender_pc pull --all        from every phone whose hotspot is joined
+    python -m xender_pc push PATH...
+    python -m xender_pc emulator          serves files like a phone for trying the others
+Qt is only imported when the window is opened
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from functools import partial
+from queue import Queue, Empty
+
+from .discovery import PORT, NoWifiError, find_server, find_servers, server_url
+from .postprocess import PostProcessor, MediaIndex, resolve
+from .progress import get_size, finished_status, STATUS
+from .ratelimit import LIMITER, parse_rate
+from .storage import BUFFER_SIZE, FSYNC, FSYNC_POLICIES, FileWriter, parse_size
+from .remote import LISTING_PATH, list_files, local_path
+from .scheduler import MAX_ACTIVE
+from .session import SessionManager, fairness
+from .sync import INDEX_PATH, SyncIndex
+from .telemetry import Telemetry
+from .transfer import CONNECTIONS, SegmentedDownload
+from .upload import UPLOAD_PATH, Upload, upload_url, walk
+
+def find_url():
+    '''Url of the phone's server, like connect() in the window'''
+    try:
+        gateway = find_server()
+    except NoWifiError:
+        print('Wi-Fi is not available on this system', file=sys.stderr)
+        return None
+    except OSError:
+        print('Wi-Fi is not connected. Connect to your phone', file=sys.stderr)
+        return None
+    if gateway is None:
+        print('Xender is not open on the phone', file=sys.stderr)
+        return None
+    return server_url(gateway)
+
+
+def find_urls():
+    '''Urls of every phone server reachable, one per hotspot joined'''
+    try:
+        hosts = find_servers()
+    except OSError:
+        hosts = []
+    if not hosts:
+        print('No phone with Xender open was found', file=sys.stderr)
+    return [server_url(host) for host in hosts]
+
+
+def status_text(download):
+    if download.state == 'finished':
+        return finished_status(download.verification)
+    return STATUS.get(download.state, download.state)
+
+
+def report(download):
+    print('%-10s %10s  %s' % (status_text(download), get_size(download.bytes_total),
+                              download.path))
+
+
+class Runner:
+    '''
+    Runs the transfers of one or more phones and reports each one as it ends
+    Every phone is a session, their state changes are handled on this thread
+    '''
+    def __init__(self, args):
+        self.sessions = SessionManager(args.max_active, self.ended)
+        self.telemetry = Telemetry()
+        self.telemetry_file = args.telemetry
+        self.next_write = time.monotonic()
+        if args.metrics_port:
+            self.telemetry.serve(args.metrics_port)
+        self.failed = 0
+        self.index = None # SyncIndex finished downloads are recorded in
+        self.synced = {} # Download to the (dest, RemoteFile) it fetches, while syncing
+        self.skipped = 0 # Files the sync found up to date
+        self.processor = None # Runs the --post stages on finished downloads
+        self.media = None # MediaIndex of what they found
+        self.processed = Queue() # (download, state, info) from the pool's threads
+        if getattr(args, 'post', None):
+            self.processor = PostProcessor(args.post, {'sort_root': args.sort_into},
+                                           args.post_workers, on_state=self.post_state)
+            self.media = MediaIndex()
+        LIMITER.set_limits(args.limit, args.per_file_limit, args.fair_share)
+
+    def track(self, transfer):
+        transfer.on_progress = lambda received, total: self.telemetry.record(
+            transfer, received, total, transfer.path)
+        return transfer
+
+    def downloads(self, base, dest, args, storage):
+        '''
+        Generate (download, size) for the files of base that dest needs
+        Runs on the session's listing thread, so it opens its own SyncIndex
+        '''
+        remotes = list_files(base, args.listing)
+        index = None
+        if args.index:
+            index = SyncIndex(args.index)
+            remotes = index.changes(dest, remotes)
+        try:
+            for remote in remotes:
+                path = local_path(dest, remote.path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                download = SegmentedDownload(remote.url, path, connections=args.connections,
+                                             storage=storage)
+                if index is not None:
+                    self.synced[download] = dest, remote
+                yield self.track(download), remote.size
+        finally:
+            if index is not None:
+                self.skipped += index.skipped
+                index.close()
+
+    def ended(self, session, transfer, state):
+        '''Slot of the sessions for transfers that stopped'''
+        self.telemetry.end(transfer, state == 'finished')
+        report(transfer)
+        if state != 'finished':
+            self.failed += 1
+        synced = self.synced.pop(transfer, None)
+        if synced is not None and state == 'finished':
+            digest = '%s:%s' % transfer.digest if transfer.digest else None
+            self.index.record(synced[0], synced[1], transfer.path,
+                              transfer.bytes_total, digest)
+        if self.processor is not None and state == 'finished':
+            self.processor.submit(transfer, transfer.path)
+
+    def post_state(self, download, state, info):
+        '''Called by the pool's threads, handled on this one by drain()'''
+        if state != 'processing':
+            self.processed.put((download, state, info))
+
+    def drain(self):
+        '''Record the downloads the pool is done with'''
+        while True:
+            try:
+                download, state, info = self.processed.get_nowait()
+            except Empty:
+                return
+            if state == 'failed':
+                self.failed += 1
+                print('%-10s %10s  %s (%s)' % ('Failed', '', info['path'], info['error']))
+                continue
+            print('%-10s %10s  %s' % ('Processed', '', info['path']))
+            if info['path'] != download.path and self.index is not None:
+                self.index.move(download.path, info['path'])
+            self.media.record(info)
+
+    def tick(self):
+        if self.telemetry_file and time.monotonic() >= self.next_write:
+            self.telemetry.write_jsonl(self.telemetry_file)
+            self.next_write += 1
+        if self.processor is not None:
+            self.drain()
+
+    def wait(self):
+        self.sessions.wait(self.tick)
+        if self.processor is not None:
+            while not self.processor.wait(1):
+                self.tick()
+            self.drain()
+            self.processor.shutdown()
+            self.media.close()
+        if len(self.sessions) > 1:
+            for session in self.sessions:
+                rate = int(session.throughput())
+                print('%-22s %5d done %5d failed  %s' % (
+                    session.name, session.finished, session.failed,
+                    get_size(rate)+'/s' if rate else '-'))
+            print('Fairness %.2f' % fairness(session.throughput() for session in self.sessions))
+        failed = self.failed + sum(session.failed for session in self.sessions)
+        return 1 if failed else 0
+
+    def stop(self):
+        '''Suspend running transfers, journals are kept so the next run resumes'''
+        self.sessions.stop()
+        if self.processor is not None:
+            self.processor.shutdown(wait=False)
+            self.media.close()
+
+
+def pull(args):
+    '''
+    Download every file the phones share into args.dest
+    With args.index only files that are new or changed since the last sync.
+    Several phones are pulled at once, each into a folder of its own
+    '''
+    urls = find_urls() if args.all else args.url or [find_url()]
+    if not urls or None in urls:
+        return 2
+    runner = Runner(args)
+    if args.index:
+        runner.index = SyncIndex(args.index)
+    storage = partial(FileWriter, buffer_size=args.buffer_size, fsync=args.fsync)
+    try:
+        for url in urls:
+            session = runner.sessions.add(url)
+            dest = args.dest if len(urls) == 1 else os.path.join(args.dest, session.name)
+            runner.sessions.feed(session, runner.downloads(url, dest, args, storage))
+        return runner.wait()
+    except KeyboardInterrupt:
+        runner.stop()
+        return 130
+    finally:
+        if runner.index is not None:
+            print(runner.skipped, 'files already up to date')
+            runner.index.close()
+
+
+def push(args):
+    '''Send files and folders to the phone'''
+    base = args.url or find_url()
+    if base is None:
+        return 2
+    url = upload_url(base, args.upload_path)
+    runner = Runner(args)
+    session = runner.sessions.add(base)
+    uploads = (Upload(url, path, name) for path, name in walk(args.paths))
+    try:
+        runner.sessions.feed(session, ((runner.track(upload), upload.bytes_total)
+                                       for upload in uploads))
+        return runner.wait()
+    except KeyboardInterrupt:
+        runner.stop()
+        return 130
+
+
+def bench(args):
+    '''
+    Run benchmarks against the stand-in server and print the results as JSON
+    With --compare, exits with 1 when a result got worse than the saved one
+    '''
+    from .bench import BENCHMARKS, compare, metadata
+    names = args.names or sorted(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print('Unknown benchmark:', ', '.join(unknown), file=sys.stderr)
+        return 2
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+    results = {'meta': metadata()}
+    for name in names:
+        results[name] = BENCHMARKS[name](scale=args.scale)
+        print(name, json.dumps(results[name]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if old is None:
+        return 0
+    regressions = compare(old, results, args.threshold)
+    for key, before, after, change in regressions:
+        print('Regression: %s %s -> %s (%+.0f%%)' % (key, before, after, change * 100))
+    if not regressions:
+        print('No regressions against', old.get('meta', {}).get('commit') or args.compare)
+    return 1 if regressions else 0
+
+
+def emulator(args):
+    '''Serve files like a phone until interrupted'''
+    from .emulator import PhoneServer
+    files = {'/DCIM/Camera/IMG_%05d.jpg' % i: args.size for i in range(args.files)}
+    server = PhoneServer(files, args.port, args.root, args.latency, args.bandwidth,
+                         args.drop_every, args.drop_after, args.upload_dir, host=args.host,
+                         connection_bandwidth=args.connection_bandwidth)
+    print('Serving', len(files), 'generated files' + (' and ' + args.root if args.root else ''),
+          'on', server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def gui(args):
+    # Set before the window module is imported, it instruments its classes on import
+    from .monitor import MONITOR
+    if args.profile or args.stall_ms:
+        MONITOR.configure(args.stall_ms or MONITOR.stall_ms, args.profile or MONITOR.profile)
+    from .gui import main as gui_main
+    return gui_main()
+
+
+def add_telemetry(command):
+    command.add_argument('--telemetry', metavar='FILE',
+                         help='append a JSON line of rates every second')
+    command.add_argument('--metrics-port', type=int, default=0,
+                         help='serve Prometheus text on localhost:PORT/metrics')
+
+
+def post_stages(text):
+    '''Check a --post list while parsing'''
+    try:
+        resolve(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def add_limits(command):
+    command.add_argument('--limit', type=parse_rate, default=0, metavar='RATE',
+                         help='bytes per second for all files together, like 500K or 2M')
+    command.add_argument('--per-file-limit', type=parse_rate, default=0, metavar='RATE',
+                         help='bytes per second for each file')
+    command.add_argument('--fair-share', action='store_true',
+                         help='split --limit evenly between running files')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='xender_pc', description='Xender for PC')
+    parser.set_defaults(run=gui)
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the window to FILE: cProfile stats for .prof, '
+                             'trace events for chrome://tracing otherwise')
+    parser.add_argument('--stall-ms', type=float, default=0, metavar='MS',
+                        help='report the stack whenever the window is blocked this long')
+    commands = parser.add_subparsers(dest='command')
+
+    for name in ('pull', 'sync'):
+        if name == 'pull':
+            command = commands.add_parser(name, help='download every shared file from the phone')
+            command.set_defaults(index=None)
+        else:
+            command = commands.add_parser(name, help='download only files not pulled before')
+            command.add_argument('--index', default=INDEX_PATH,
+                                 help='file that remembers what was pulled')
+        command.add_argument('--dest', default='.', help='folder to save files in')
+        command.add_argument('--url', action='append',
+                             help='server url, found on the hotspot when left out; '
+                                  'repeat it to pull from several phones at once')
+        command.add_argument('--all', action='store_true',
+                             help='pull from every phone whose hotspot is joined')
+        command.add_argument('--listing', default=LISTING_PATH, help='path of the file listing')
+        command.add_argument('--connections', type=int, default=CONNECTIONS,
+                             help='connections per large file')
+        command.add_argument('--max-active', type=int, default=MAX_ACTIVE,
+                             help='files downloaded at the same time')
+        command.add_argument('--buffer-size', type=parse_size, default=BUFFER_SIZE,
+                             metavar='SIZE', help='bytes collected per write, like 4M for 4 MiB')
+        command.add_argument('--fsync', choices=FSYNC_POLICIES, default=FSYNC,
+                             help='sync files to disk never, at the end or after every write')
+        command.add_argument('--post', type=post_stages, metavar='STAGES',
+                             help='comma list of hash, sort, thumbnail and metadata '
+                                  'to run on each finished file')
+        command.add_argument('--post-workers', type=int, default=None, metavar='N',
+                             help='processes running the --post stages, one per CPU by default')
+        command.add_argument('--sort-into', metavar='DIR',
+                             help='folder the sort stage makes year/month folders in, '
+                                  'next to each file by default')
+        add_limits(command)
+        add_telemetry(command)
+        command.set_defaults(run=pull)
+
+    command = commands.add_parser('push', help='send files and folders to the phone')
+    command.add_argument('paths', nargs='+', help='files and folders to send')
+    command.add_argument('--url', help='server url, found on the hotspot when left out')
+    command.add_argument('--upload-path', default=UPLOAD_PATH, help='path files are posted to')
+    command.add_argument('--max-active', type=int, default=MAX_ACTIVE,
+                         help='files sent at the same time')
+    add_limits(command)
+    add_telemetry(command)
+    command.set_defaults(run=push)
+
+    command = commands.add_parser('bench', help='measure transfers against a local stand-in server')
+    command.add_argument('names', nargs='*', help='benchmarks to run, all when left out')
+    command.add_argument('--scale', type=float, default=1.0,
+                         help='fraction of the full workload, 0.1 for a quick run')
+    command.add_argument('--output', metavar='FILE', help='save the results as JSON')
+    command.add_argument('--compare', metavar='FILE',
+                         help='results saved with --output to check for regressions')
+    command.add_argument('--threshold', type=float, default=0.1,
+                         help='relative change counted as a regression')
+    command.set_defaults(run=bench)
+
+    command = commands.add_parser('emulator', help='serve files like a phone, for testing')
+    command.add_argument('--port', type=int, default=PORT)
+    command.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    command.add_argument('--root', help='folder whose files are served as well')
+    command.add_argument('--files', type=int, default=100, help='generated files to serve')
+    command.add_argument('--size', type=parse_rate, default=3*1000*1000, metavar='SIZE',
+                         help='bytes of each generated file, like 3M')
+    command.add_argument('--latency', type=float, default=0.0,
+                         help='seconds added before every response')
+    command.add_argument('--bandwidth', type=parse_rate, default=0, metavar='RATE',
+                         help='bytes per second for all responses together')
+    command.add_argument('--connection-bandwidth', type=parse_rate, default=0, metavar='RATE',
+                         help='bytes per second for each connection on its own')
+    command.add_argument('--drop-every', type=int, default=0, metavar='N',
+                         help='cut every Nth download partway')
+    command.add_argument('--drop-after', type=parse_rate, default=1024*1024, metavar='SIZE',
+                         help='bytes sent before a download is cut')
+    command.add_argument('--upload-dir', help='folder to save uploads in')
+    command.set_defaults(run=emulator)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Finds the gateway of the phone's Wi-Fi hotspot
+Backends read the routing table of the platform. Every candidate is
+probed on the Xender port at once and the first real server wins.
+The last gateway found is cached so reconnecting does not repeat the lookup
+'''
+
+import os
+import asyncio
+import sys
+import socket
+import struct
+import subprocess
+
+PORT = int(os.environ.get('XENDER_PORT', 33455)) # Port of the Xender server on the phone
+PROBE_TIMEOUT = 0.3 # Seconds to connect and get a response line
+RTF_UP = 0x1
+RTF_GATEWAY = 0x2
+
+
+class NoWifiError(ConnectionError):
+    '''No Wi-Fi adapter on this system'''
+
+
+class NotConnectedError(ConnectionError):
+    '''Wi-Fi adapter is not connected to a network'''
+
+
+def parse_proc_route(text):
+    '''
+    Default gateways in the text of /proc/net/route
+    Returns (interface, gateway) pairs, lowest metric first
+    '''
+    routes = []
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        iface, destination, gateway, flags, metric = (fields[0], fields[1], fields[2],
+                                                      int(fields[3], 16), int(fields[6]))
+        if destination != '00000000' or not flags & RTF_UP or not flags & RTF_GATEWAY:
+            continue
+        # Addresses are stored as little endian hex
+        address = socket.inet_ntoa(struct.pack('<L', int(gateway, 16)))
+        routes.append((metric, iface, address))
+    routes.sort()
+    return [(iface, address) for metric, iface, address in routes]
+
+
+def parse_ipconfig(text):
+    '''
+    Gateway of the Wi-Fi adapter in the output of ipconfig
+    Raises NoWifiError or NotConnectedError
+    '''
+    lines = [line.lower() for line in text.splitlines()]
+    try:
+        # Check if adapter is availabe
+        wifi_index = lines.index('wireless lan adapter wi-fi:')
+    except ValueError:
+        raise NoWifiError('Wi-Fi is not available on this system')
+    wifi_info = lines[wifi_index:len(lines)]
+
+    # Check if it is  connected to a network
+    test_index = wifi_index+2
+    if test_index < len(lines) and lines[test_index].endswith('media disconnected'):
+        raise NotConnectedError('Wi-Fi is not connected')
+    gateway = ''
+    for line in wifi_info:
+        if 'default gateway' in line:
+            gateway = line
+            break
+    if gateway == '':
+        raise NotConnectedError('Wi-Fi has no gateway')
+
+    if gateway.count(':')>1: # IpV6 address
+        try:
+            gateway = wifi_info[wifi_info.index(gateway)+1]
+        except IndexError:
+            raise NotConnectedError('Wi-Fi has no IPv4 gateway')
+    gateway = gateway.split(':')[-1].strip()
+    if not gateway:
+        raise NotConnectedError('Wi-Fi has no gateway')
+    return gateway
+
+
+def parse_ipconfig_all(text):
+    '''IPv4 default gateways of every adapter in the output of ipconfig'''
+    gateways = []
+    lines = [line.strip().lower() for line in text.splitlines()]
+    for index, line in enumerate(lines):
+        if not line.startswith('default gateway'):
+            continue
+        # Addresses follow the colon and may continue on the next lines
+        values = [line.split(' : ', 1)[-1].strip()]
+        for extra in lines[index+1:]:
+            if not extra or extra.count(':') == 1:
+                break
+            values.append(extra)
+        for value in values:
+            if value.count('.') == 3 and value not in gateways:
+                gateways.append(value)
+    return gateways
+
+
+class ProcRouteBackend:
+    '''Linux: reads the kernel routing table without starting a process'''
+    name = 'proc'
+    route_file = '/proc/net/route'
+    net_dir = '/sys/class/net'
+
+    def available(self):
+        return os.path.isfile(self.route_file)
+
+    def wireless(self):
+        '''Names of wireless interfaces'''
+        try:
+            return [iface for iface in os.listdir(self.net_dir)
+                    if os.path.isdir(os.path.join(self.net_dir, iface, 'wireless'))]
+        except OSError:
+            return []
+
+    def gateways(self):
+        '''Gateways reachable over Wi-Fi, best first'''
+        wifi = self.wireless()
+        if not wifi:
+            raise NoWifiError('Wi-Fi is not available on this system')
+        with open(self.route_file) as f:
+            routes = parse_proc_route(f.read())
+        found = [address for iface, address in routes if iface in wifi]
+        if not found:
+            raise NotConnectedError('Wi-Fi is not connected')
+        # Other adapters are probed too in case the phone is reached through them
+        for iface, address in routes:
+            if address not in found:
+                found.append(address)
+        return found
+
+
+class IpconfigBackend:
+    '''Windows: parses the output of ipconfig (English locale)'''
+    name = 'ipconfig'
+
+    def available(self):
+        return sys.platform == 'win32'
+
+    def gateways(self):
+        raw = subprocess.check_output('ipconfig', shell=True) # runs 'ipconfig' on cmd
+        text = raw.decode('utf-8', 'replace')
+        found = [parse_ipconfig(text)]
+        for address in parse_ipconfig_all(text):
+            if address not in found:
+                found.append(address)
+        return found
+
+
+class EnvBackend:
+    '''Gateways listed in XENDER_GATEWAYS, used to reach the stand-in server'''
+    name = 'env'
+    variable = 'XENDER_GATEWAYS'
+
+    def available(self):
+        return bool(os.environ.get(self.variable, '').strip())
+
+    def gateways(self):
+        return [address.strip() for address in os.environ[self.variable].split(',')
+                if address.strip()]
+
+
+BACKENDS = [EnvBackend(), ProcRouteBackend(), IpconfigBackend()]
+_cache = []
+
+
+def find_gateways(refresh=False):
+    '''
+    Candidate gateways of the hotspot, best first
+    The cached result is returned unless refresh is set
+    '''
+    if _cache and not refresh:
+        return list(_cache)
+    for backend in BACKENDS:
+        if backend.available():
+            gateways = backend.gateways()
+            _cache[:] = gateways
+            return list(gateways)
+    raise NoWifiError('No gateway discovery backend for '+sys.platform)
+
+
+def forget():
+    '''Drop the cached gateway, used when it stops answering'''
+    _cache.clear()
+
+
+async def _handshake(host, port, timeout):
+    '''Check that host answers HTTP on port'''
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(('GET / HTTP/1.0\r\nHost: %s:%d\r\n\r\n' % (host, port)).encode())
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line.startswith(b'HTTP/'):
+            raise ConnectionError('Not a HTTP server')
+        return host
+    finally:
+        writer.close()
+
+
+async def _first_server(hosts, port, timeout):
+    tasks = [asyncio.ensure_future(_handshake(host, port, timeout)) for host in hosts]
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                return await task
+            except (OSError, asyncio.TimeoutError):
+                continue
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _all_servers(hosts, port, timeout):
+    results = await asyncio.gather(*[_handshake(host, port, timeout) for host in hosts],
+                                   return_exceptions=True)
+    return [result for result in results if isinstance(result, str)]
+
+
+def probe_servers(hosts, port=PORT, timeout=PROBE_TIMEOUT):
+    '''
+    Probe every host on port at the same time
+    Returns the first one with a server or None
+    '''
+    if not hosts:
+        return None
+    return asyncio.run(_first_server(hosts, port, timeout))
+
+
+def find_server(port=PORT, timeout=PROBE_TIMEOUT):
+    '''
+    Host of the Xender server on the hotspot or None
+    The cached gateway is tried first, then every candidate is looked up again
+    '''
+    if _cache:
+        host = probe_servers(_cache[:1], port, timeout)
+        if host:
+            return host
+    gateways = find_gateways(refresh=True)
+    host = probe_servers(gateways, port, timeout)
+    if host:
+        # Remember the one that answered first
+        _cache[:] = [host] + [gateway for gateway in gateways if gateway != host]
+    return host
+
+
+def find_servers(port=PORT, timeout=PROBE_TIMEOUT):
+    '''Hosts of every Xender server that answers, one per phone hotspot joined'''
+    gateways = find_gateways(refresh=True)
+    if not gateways:
+        return []
+    return asyncio.run(_all_servers(gateways, port, timeout))
+
+
+def server_url(gateway, port=PORT):
+    '''Url of the Xender server behind gateway'''
+    return 'http://'+gateway+':'+str(port)
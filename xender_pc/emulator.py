@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Stand-in for the phone's server
+Serves generated files and the files of a folder with keep-alive and
+Range support, lists them as JSON (HTML for browsers) and takes uploads.
+Latency, bandwidth and dropped connections can be set to mimic Wi-Fi, so
+transfers can be tried and measured without a phone
+'''
+
+import os
+import re
+import html
+import json
+import time
+import socket
+
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, quote
+
+from .ratelimit import TokenBucket
+from .upload import UPLOAD_PATH
+
+PATTERN = 251 # File bytes repeat with this period
+BLOCK = bytes(range(PATTERN)) * 1024 # Whole periods, sliced to make file data
+READ_SIZE = 256 * 1024 # Bytes read from files on disk and uploads at a time
+MTIME = 1700000000.0 # Modification time of generated files
+
+
+def content(offset, length):
+    '''Generate the bytes of any file from offset, in blocks'''
+    while length > 0:
+        start = offset % PATTERN
+        data = BLOCK[start:start+length]
+        yield data
+        offset += len(data)
+        length -= len(data)
+
+
+def read_file(path, offset, length):
+    '''Generate the bytes of a file on disk from offset, in blocks'''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                return
+            yield data
+            length -= len(data)
+
+
+class PhoneHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive like the phone
+    disable_nagle_algorithm = True # Headers and body go out without waiting for ACKs
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Each connection has its own cap, like one TCP stream over Wi-Fi
+        self.bucket = TokenBucket(self.server.connection_bandwidth)
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.delay()
+        path = unquote(self.path.split('?')[0])
+        if path == '/':
+            if 'text/html' in self.headers.get('Accept', ''):
+                self.send_body(server.listing_html(), 'text/html; charset=utf-8')
+            else:
+                self.send_body(server.listing_json(), 'application/json')
+            return
+        found = server.lookup(path)
+        if found is None:
+            self.send_error(404)
+            return
+        size, mtime, source = found
+        start, end = 0, size
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and int(match.group(1)) >= size:
+            # Nothing to send from there, an empty file answers every range like this
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if match:
+            start = int(match.group(1))
+            end = min(size, int(match.group(2))+1) if match.group(2) else size
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end-1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end-start))
+        self.send_header('ETag', '"%x-%x"' % (size, int(mtime)))
+        self.end_headers()
+        if source is None:
+            blocks = content(start, end-start)
+        else:
+            blocks = read_file(source, start, end-start)
+        cut = server.cut_after(end-start)
+        sent = 0
+        for data in blocks:
+            if cut is not None and sent + len(data) > cut:
+                # Like the phone leaving the hotspot halfway through
+                self.wfile.write(data[:cut-sent])
+                server.dropped()
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            server.throttle(len(data))
+            self.bucket.consume(len(data))
+            self.wfile.write(data)
+            sent += len(data)
+
+    def do_POST(self):
+        '''One multipart file, the way Upload and the upload form send it'''
+        server = self.server
+        server.delay()
+        if unquote(self.path.split('?')[0]) != server.upload_path:
+            self.send_error(404)
+            return
+        match = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', ''))
+        length = int(self.headers.get('Content-Length', 0))
+        if not match or not length:
+            self.send_error(400)
+            return
+        # The part headers end at the first blank line, the closing boundary ends the body
+        head = b''
+        while not head.endswith(b'\r\n\r\n') and len(head) < 64 * 1024:
+            line = self.rfile.readline()
+            if not line:
+                break
+            head += line
+        name = re.search(rb'filename="([^"]*)"', head)
+        name = name.group(1).decode('utf-8', 'replace') if name else 'upload'
+        tail = len(b'\r\n--' + match.group(1).strip('"').encode('ascii') + b'--\r\n')
+        remaining = length - len(head) - tail
+        received = 0
+        target = None
+        if server.upload_dir:
+            target = open(os.path.join(server.upload_dir, os.path.basename(name)), 'wb')
+        try:
+            while received < remaining:
+                data = self.rfile.read(min(READ_SIZE, remaining-received))
+                if not data:
+                    break
+                server.throttle(len(data))
+                received += len(data)
+                if target:
+                    target.write(data)
+            self.rfile.read(tail)
+        finally:
+            if target:
+                target.close()
+        server.uploaded(name, received)
+        self.send_body(b'OK', 'text/plain')
+
+
+class PhoneServer(ThreadingHTTPServer):
+    '''
+    Serves files, a dict of path to size, and the files under root
+    latency is added before every response, bandwidth caps all responses
+    together in bytes per second, connection_bandwidth caps each connection
+    on its own, and every drop_every-th download longer than drop_after
+    bytes is cut there. Uploads are saved to upload_dir when it is set.
+    Use as a context manager or call start() and shutdown()
+    '''
+    daemon_threads = True
+
+    def __init__(self, files=None, port=0, root=None, latency=0.0, bandwidth=0,
+                 drop_every=0, drop_after=1024*1024, upload_dir=None,
+                 upload_path=UPLOAD_PATH, host='127.0.0.1', connection_bandwidth=0):
+        ThreadingHTTPServer.__init__(self, (host, port), PhoneHandler)
+        self.files = files or {}
+        self.root = root
+        self.latency = latency
+        self.bucket = TokenBucket(bandwidth)
+        self.connection_bandwidth = connection_bandwidth
+        self.drop_every = drop_every
+        self.drop_after = drop_after
+        self.upload_dir = upload_dir
+        self.upload_path = upload_path
+        self.requests = 0 # Downloads long enough to be dropped
+        self.drops = [] # Times connections were cut
+        self.uploads = [] # (name, bytes) received
+        self._lock = Lock()
+
+    def handle_error(self, request, client_address):
+        pass # Clients drop connections on pause and cancel
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.server_address[0], self.server_port)
+
+    def entries(self):
+        '''(path, size, mtime) of every file served'''
+        for path, size in self.files.items():
+            yield path, size, MTIME
+        if self.root:
+            for folder, names, files in os.walk(self.root):
+                for name in files:
+                    full = os.path.join(folder, name)
+                    stat = os.stat(full)
+                    path = '/' + os.path.relpath(full, self.root).replace(os.sep, '/')
+                    yield path, stat.st_size, stat.st_mtime
+
+    def lookup(self, path):
+        '''(size, mtime, file on disk or None) of path, None when it is not served'''
+        if path in self.files:
+            return self.files[path], MTIME, None
+        if self.root:
+            root = os.path.realpath(self.root)
+            full = os.path.realpath(os.path.join(root, path.lstrip('/')))
+            if full.startswith(root + os.sep) and os.path.isfile(full):
+                stat = os.stat(full)
+                return stat.st_size, stat.st_mtime, full
+        return None
+
+    def listing_json(self):
+        return json.dumps([{'url': quote(path), 'size': size, 'mtime': mtime}
+                           for path, size, mtime in self.entries()]).encode('utf-8')
+
+    def listing_html(self):
+        links = ''.join('<li><a href="%s">%s</a></li>' % (quote(path), html.escape(path))
+                        for path, size, mtime in self.entries())
+        form = ('<form method="post" action="%s" enctype="multipart/form-data">'
+                '<input type="file" name="file"><input type="submit" value="Send"></form>'
+                % self.upload_path)
+        return ('<html><body><ul>%s</ul>%s</body></html>' % (links, form)).encode('utf-8')
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def throttle(self, count):
+        self.bucket.consume(count)
+
+    def cut_after(self, length):
+        '''Bytes to send before dropping this download, None to send it all'''
+        if not self.drop_every or length <= self.drop_after:
+            return None # Probes and small files always get through
+        with self._lock:
+            self.requests += 1
+            if self.requests % self.drop_every:
+                return None
+        return self.drop_after
+
+    def dropped(self):
+        with self._lock:
+            self.drops.append(time.monotonic())
+
+    def uploaded(self, name, size):
+        with self._lock:
+            self.uploads.append((name, size))
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,1153 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys 
+import subprocess 
+import os
+import time
+import itertools
+import webbrowser
+
+STARTED = time.perf_counter() # Taken before Qt is imported to time startup
+
+from functools import lru_cache
+from threading import Thread
+from PyQt5.QtCore import (QFileInfo, QUrl, QTimer, QSize, Qt, QObject, QEvent, pyqtSignal,
+                          QAbstractTableModel, QModelIndex)
+from PyQt5.QtWidgets import (QTreeView, QMainWindow, QWidget, QGridLayout, 
+                            QToolButton, QFrame, QLabel, QPushButton, QApplication,
+                            QComboBox, QCheckBox, QFileDialog)
+from PyQt5.QtGui import QIcon, QDesktopServices
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineDownloadItem
+
+from .discovery import (NoWifiError, NotConnectedError, find_server,
+                        forget, server_url)
+from .transfer import SegmentedDownload
+from .upload import Upload, upload_url, walk
+from .journal import JOURNAL_DIR, discard, pending, rebase
+from .progress import (ProgressBatcher, INTERVAL, get_size, progress_status,
+                       finished_status)
+from .registry import Rows, TransferRegistry
+from .scheduler import TransferScheduler
+from .telemetry import Telemetry, format_rate
+from .ratelimit import LIMITER
+from .monitor import MONITOR, INTERVAL as BEAT_INTERVAL
+from .remote import list_files, local_path
+from .sync import BATCH, SyncIndex
+from .postprocess import DEFAULT_STAGES, PostProcessor, MediaIndex
+
+
+# Pages and icons are found from here instead of changing directory
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources')
+TRACE_STARTUP = bool(os.environ.get('XENDER_TRACE_STARTUP'))
+AUTO_CONNECT = bool(os.environ.get('XENDER_AUTO_CONNECT')) # Connect without the Link Phone click
+METRICS_PORT = int(os.environ.get('XENDER_METRICS_PORT', 0)) # Serves /metrics when set
+TELEMETRY_FILE = os.environ.get('XENDER_TELEMETRY_FILE') # JSON lines written every second
+# Stages run on finished downloads once Process downloads is checked
+POST_STAGES = os.environ.get('XENDER_POSTPROCESS', ','.join(DEFAULT_STAGES))
+# Journals of the window's downloads, kept apart so pull's are never resumed here
+JOURNALS = os.path.join(JOURNAL_DIR, 'window')
+LIMITS = (('Unlimited', 0), ('256 KB/s', 256000), ('1 MB/s', 1000000),
+          ('5 MB/s', 5000000), ('10 MB/s', 10000000)) # Speed limit choices
+
+
+def page(name):
+    '''Absolute path of a page in resources'''
+    return QFileInfo(os.path.join(RESOURCES, name)).absoluteFilePath()
+
+
+@lru_cache(maxsize=None)
+def icon(name):
+    '''Icon from resources, loaded once per process'''
+    return QIcon(os.path.join(RESOURCES, name))
+
+
+def trace(label):
+    '''Print time since startup when XENDER_TRACE_STARTUP is set'''
+    if TRACE_STARTUP:
+        print('startup: %s %.1f ms' % (label, (time.perf_counter()-STARTED)*1000))
+
+
+class FirstPaint(QObject):
+    '''Event filter that traces the first paint of any widget, then removes itself'''
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Paint, QEvent.Expose):
+            trace('first paint')
+            QApplication.instance().removeEventFilter(self)
+        return False
+
+
+trace('imported')
+# Global URL Variable Used for setting browser URL
+URL = page('index.htm')
+
+def connect():
+    '''
+    Checks for the IP Address of the WiFi Hotspot Server
+    All errors in connection are handled
+    Returns the url the browser should show
+    '''
+    global URL
+    try:
+        # Every candidate gateway is probed, the first Xender server wins
+        gateway = find_server()
+    except NoWifiError:
+        # If WiFi adapter is not available
+        print('Wi-Fi is not available on this system')
+        URL = page('no-wifi.htm')
+        return URL
+    except (NotConnectedError, OSError, subprocess.CalledProcessError):
+        # If it is not connected
+        print('Wi-Fi is not connected. Connect to your phone')
+        URL = page('not-connected.htm')
+        return URL
+
+    if gateway is None:
+        # Connected but Xender is not serving on any gateway
+        print('Xender is not open on the phone')
+        URL = page('not-open.htm')
+        return URL
+    
+    # If all conditions are positive the final Url is set
+    URL = server_url(gateway)
+    return URL
+
+class NativeTransferItem(QObject):
+    '''
+    Stands in for a QWebEngineDownloadItem on transfers with the phone
+    Subclasses create the engine that moves the bytes
+    '''
+    finished = pyqtSignal()
+    downloadProgress = pyqtSignal('qint64', 'qint64')
+    stateChanged = pyqtSignal(QWebEngineDownloadItem.DownloadState)
+    isPausedChanged = pyqtSignal(bool)
+
+    # Engine callbacks run on worker threads, these carry them to the GUI thread
+    _progress = pyqtSignal('qint64', 'qint64')
+    _state = pyqtSignal(str)
+
+    def __init__(self, url, path):
+        QObject.__init__(self)
+        self._url = url
+        self._path = path
+        self.engine = self.create_engine()
+        self._progress.connect(self.downloadProgress, Qt.QueuedConnection)
+        self._state.connect(self.engine_state, Qt.QueuedConnection)
+
+    def engine_state(self, state):
+        '''Translate engine states to QWebEngineDownloadItem signals'''
+        DownloadState = QWebEngineDownloadItem.DownloadState
+        if state == 'inprogress':
+            self.isPausedChanged.emit(False)
+            self.stateChanged.emit(DownloadState.DownloadInProgress)
+        elif state == 'paused':
+            self.isPausedChanged.emit(True)
+        elif state == 'finished':
+            self.stateChanged.emit(DownloadState.DownloadCompleted)
+            self.finished.emit()
+        elif state == 'cancelled':
+            self.stateChanged.emit(DownloadState.DownloadCancelled)
+        else:
+            self.stateChanged.emit(DownloadState.DownloadInterrupted)
+
+    def accept(self):
+        self.engine.start()
+
+    def pause(self):
+        self.engine.pause()
+
+    def resume(self):
+        self.engine.resume()
+
+    def cancel(self):
+        self.engine.cancel()
+
+    def suspend(self):
+        self.engine.suspend()
+
+    def path(self):
+        return self._path
+
+    def url(self):
+        return QUrl(self._url)
+
+    def downloadDirectory(self):
+        return os.path.dirname(self._path)
+
+    def downloadFileName(self):
+        return os.path.basename(self._path)
+
+
+class NativeDownloadItem(NativeTransferItem):
+    '''The file is fetched by SegmentedDownload over several connections'''
+    def create_engine(self):
+        return SegmentedDownload(self._url, self._path,
+                                 on_progress=self._progress.emit,
+                                 on_state=self._state.emit,
+                                 journal_dir=JOURNALS)
+
+
+class NativeUploadItem(NativeTransferItem):
+    '''A local file streamed to the phone by Upload'''
+    def __init__(self, url, path, name):
+        self.name = name # Name on the phone, may include folders
+        NativeTransferItem.__init__(self, url, path)
+
+    def create_engine(self):
+        return Upload(self._url, self._path, self.name,
+                      on_progress=self._progress.emit,
+                      on_state=self._state.emit)
+
+    def downloadFileName(self):
+        return '\u2191 '+self.name # Arrow marks rows sent to the phone
+
+class DownloadItem:
+    '''
+    Registers, manages and ends download
+    One row of DownloadModel, kept small for lists of thousands of files
+    '''
+    __slots__ = ('model', 'window', 'downloadItem', 'path', 'url', 'folder', 'name',
+                 'status', 'size', 'state', 'valid', 'total', 'shown', '__weakref__')
+
+    # Icons are shared by every row and loaded on first use
+    icon_files = {'queued': 'res/Down.png',
+                  'inprogress': 'res/Down.png',
+                  'finished': 'res/file.png',
+                  'paused': 'res/pause.png',
+                  'failed': 'res/alert-box.png',
+                  'cancelled': 'res/alert-box.png',
+                  'corrupt': 'res/alert-box.png',
+                  }
+
+    def __init__(self, model, downloadItem, window):
+        self.model = model # DownloadModel
+        self.window = window # mainWindow
+        self.downloadItem = downloadItem # QWebEngineDownloadItem
+
+        # Connect signals and slots
+        self.downloadItem.finished.connect(self.finished)
+        self.downloadItem.downloadProgress.connect(self.download_progess)
+        self.downloadItem.stateChanged.connect(self.state_changed)
+        self.downloadItem.isPausedChanged.connect(self.paused_changed)
+
+        # Set properies
+        self.path = self.downloadItem.path()
+        self.url = self.downloadItem.url().toString()
+        self.folder = self.downloadItem.downloadDirectory()
+        self.name = self.downloadItem.downloadFileName()
+        self.status = 'Waiting'
+        self.size = ''
+        self.state = 'inprogress'
+        self.valid = True # Valid until cancelled or failed
+        self.total = None # bytes_total the size text was made from
+        self.shown = None # Text currently on the row
+        self.model.add(self)
+    
+    @classmethod
+    def icon(cls, state):
+        return icon(cls.icon_files[state])
+    
+    def download_progess(self, bytes_received, bytes_total):
+        # To handle download progress
+        # Counters are batched and drawn by MainWindow.flushProgress
+        if self.valid:
+            self.window.telemetry.record(self, bytes_received, bytes_total, self.name)
+            self.window.reportProgress(self, bytes_received, bytes_total)
+
+    def apply_progress(self, bytes_received, bytes_total):
+        '''Show the latest batched progress'''
+        if not self.valid or self.state != 'inprogress':
+            return
+        if bytes_total != self.total:
+            self.total = bytes_total
+            self.size = get_size(bytes_total)
+        self.status = progress_status(bytes_received, bytes_total)
+        meter = self.window.telemetry.meters.get(self)
+        if meter is not None and meter.rate:
+            self.status += ' '+format_rate(meter)
+        self.update_data()
+    
+    def update_data(self):
+        ''' Update visible data on the downloadWidget'''
+        shown = (self.state, self.name, self.status, self.size)
+        if shown == self.shown:
+            return # Nothing visible changed
+        self.shown = shown
+        self.model.itemChanged(self)
+    
+    def state_changed(self, state):
+        '''Manage state changes'''
+        self.window.hideDownloadActions()
+        if state not in (QWebEngineDownloadItem.DownloadState.DownloadRequested,
+                         QWebEngineDownloadItem.DownloadState.DownloadInProgress):
+            self.window.scheduler.done(self) # Let the next queued transfer start
+            self.window.telemetry.end(
+                self, state == QWebEngineDownloadItem.DownloadState.DownloadCompleted)
+
+        if state == QWebEngineDownloadItem.DownloadState.DownloadRequested:
+            self.state = 'inprogress'
+            self.status = 'Waiting'
+            self.update_data()
+        elif state == QWebEngineDownloadItem.DownloadState.DownloadInProgress:
+            self.state = 'inprogress'
+            self.status = 'In progress'
+            self.update_data()
+        elif state == QWebEngineDownloadItem.DownloadState.DownloadCompleted:
+            self.state = 'finished'
+            self.status = self.completed_status()
+            if not os.path.isfile(self.path):
+                self.valid = False
+                self.state = 'cancelled'
+                self.status = 'Cancelled'
+            self.update_data()
+        elif state == QWebEngineDownloadItem.DownloadState.DownloadCancelled:
+            self.valid = False
+            self.state = 'cancelled'
+            self.status = 'Cancelled'
+            self.update_data()
+        elif self.verification() == 'corrupt':
+            # Finished but did not match its size or digest
+            self.valid = False
+            self.state = 'corrupt'
+            self.status = 'Corrupt'
+            self.update_data()
+        else:
+            self.valid = False
+            self.state = 'failed'
+            self.status = 'Failed'
+            print('Download Failed')
+            self.update_data()
+            
+    def paused_changed(self, paused):
+        '''Manage pause and resume events'''
+        if paused:
+            self.state = 'paused'
+            self.status = 'Paused'
+        else:
+            self.state = 'inprogress'
+            self.status = 'Resuming'
+        self.update_data()
+
+    def finished(self):
+        '''Manage download completed event'''
+        self.window.scheduler.done(self)
+        self.window.telemetry.end(self, True)
+        self.state = 'finished'
+        self.status = self.completed_status()
+        if not os.path.isfile(self.path):
+            self.valid = False
+            self.state = 'cancelled'
+            self.status = 'Cancelled'
+        else:
+            self.window.synced(self)
+            self.window.postProcess(self)
+        self.update_data()
+
+    def verification(self):
+        '''Integrity result of a native transfer, checked off the GUI thread'''
+        if isinstance(self.downloadItem, NativeTransferItem):
+            return self.downloadItem.engine.verification
+        return None
+
+    def completed_status(self):
+        return finished_status(self.verification())
+
+    def queue(self):
+        '''Wait for the scheduler to start the transfer'''
+        self.state = 'queued'
+        self.status = 'Queued'
+        self.update_data()
+
+    def start(self):
+        '''Called by the scheduler when a slot is free'''
+        self.downloadItem.accept()
+
+    def pause(self):
+        self.downloadItem.pause()
+
+    def resume(self):
+        self.downloadItem.resume()
+
+    def cancel(self):
+        if self.state == 'queued':
+            # Never started, so no signal will report it
+            self.window.scheduler.discard(self)
+            self.valid = False
+            self.state = 'cancelled'
+            self.status = 'Cancelled'
+            self.update_data()
+            return
+        self.downloadItem.cancel()
+
+    def suspend(self):
+        '''Stop for a reconnect, native transfers keep their journal'''
+        self.valid = False # Progress already queued must not bring back its meter
+        if isinstance(self.downloadItem, NativeTransferItem):
+            self.downloadItem.suspend()
+        else:
+            self.downloadItem.cancel()
+
+    def remove(self, forget=False):
+        '''Drop the row, forget also drops the journal so it is not resumed on connect'''
+        self.valid = False
+        if forget and isinstance(self.downloadItem, NativeDownloadItem):
+            discard(self.path, JOURNALS)
+        self.window.progress.discard(self)
+        self.window.registry.discard(self)
+        self.window.scheduler.discard(self)
+        self.window.telemetry.end(self)
+        self.model.remove(self)
+
+
+class DownloadModel(QAbstractTableModel):
+    '''
+    Table of DownloadItems shown by the download view
+    Rows finds the row of an item and the item of a row in O(log n)
+    '''
+    headers = ('Name', 'Status', 'Size')
+
+    def __init__(self):
+        QAbstractTableModel.__init__(self)
+        self.rows = Rows() # DownloadItems in row order
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return (item.name, item.status, item.size)[index.column()]
+        if role == Qt.DecorationRole and index.column() == 0:
+            return DownloadItem.icon(item.state)
+        return None
+
+    def item(self, row):
+        if 0 <= row < len(self.rows):
+            return self.rows[row]
+        return None
+
+    def add(self, item):
+        row = len(self.rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.append(item)
+        self.endInsertRows()
+
+    def itemChanged(self, item):
+        row = self.rows.row(item)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.headers)-1))
+
+    def remove(self, item):
+        row = self.rows.row(item)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.rows.pop(row)
+        self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows.clear()
+        self.endResetModel()
+
+
+class MainWindow(QMainWindow):
+    '''User Interface and other micro tasks'''
+    # Result of connect() from the background thread
+    connected = pyqtSignal(str)
+    # Folder and a batch of new or changed RemoteFiles from the sync thread
+    syncFound = pyqtSignal(str, list)
+    # DownloadItem, state and results from the post-processing pool
+    postProcessed = pyqtSignal(object, str, dict)
+
+    def __init__(self):
+        QMainWindow.__init__(self)
+        # MainWindow setting
+        self.setWindowTitle('Xender for PC')
+        self.setWindowIcon(icon('icon.png'))
+        # Icon dictionary
+        self.icons = {'resume': icon('res/resume.png'),
+                      'remove': icon('res/delete.png'),
+                      'pause': icon('res/pause.png'),
+                      'retry': icon('res/179407.png'),
+                      'cancel':icon('res/stop.png'),
+                      'open': icon('res/file.png')}  
+         
+        # Window internals
+        self.widget = QWidget()
+        self.setCentralWidget(self.widget)
+        layout = QGridLayout(self.widget)
+        layout.setContentsMargins(0,0,0,0)
+
+        # Other properties
+        self.url = page('index.htm')
+        self.showDownload = False
+        self.downloadModel = DownloadModel()
+        self.downloadItems = self.downloadModel.rows
+        self.registry = TransferRegistry() # DownloadItems by path and url
+        self.scheduler = TransferScheduler(DownloadItem.start) # Limits phone transfers running at once
+        self.resumePending = True # Resume journaled transfers once connected
+        self.syncIndex = None # Opened on the first synced download
+        self.syncing = {} # Path of a synced download to (folder, RemoteFile)
+        self.processor = None # PostProcessor, started with the first finished download
+        self.mediaIndex = None # Where the processed files are recorded
+
+        # Browser widget
+        self.browser = QWebEngineView()
+        self.browser.setUrl(QUrl(self.url))
+        self.browser.setAcceptDrops(True)
+        # Drops land on the page's child widget, filters are added as it appears
+        self.browser.installEventFilter(self)
+        self.uploads = None # Files of a drop waiting to be queued
+        layout.addWidget(self.browser)
+
+        #Timer
+        self.hideTimer = QTimer() # Hide download frame and panel timer
+        self.progressTimer = QTimer() # Draws batched progress, runs only while downloading
+        self.progressTimer.setInterval(INTERVAL)
+        self.progress = ProgressBatcher()
+        self.statsTimer = QTimer() # Rates and stalls, runs only while transfers are active
+        self.statsTimer.setInterval(1000)
+        self.wakeups = 0 # Timer slots run, stays put while the window is idle
+        self.telemetry = Telemetry()
+        if METRICS_PORT:
+            self.telemetry.serve(METRICS_PORT)
+
+        # Reconnect button
+        self.reconnectButton = QToolButton(self.widget)
+        self.reconnectButton.setText('Reconnect')
+        buttonIcon = icon('res/179407.png')
+        self.reconnectButton.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+        self.reconnectButton.setIconSize(QSize(36,36))
+        self.reconnectButton.setIcon(buttonIcon)
+        self.reconnectButton.setFixedSize(60,60)
+        buttonPos = (self.size().width()-80 , self.size().height()-80)
+        self.reconnectButton.move(buttonPos[0],buttonPos[1])
+        self.reconnectButton.clicked.connect(self.reconnect)
+        self.reconnectButton.hide()
+
+        # Download button( to show downloads)
+        self.downloadButton = QToolButton(self.widget)
+        self.downloadButton.setText('Downloads')
+        buttonIcon = icon('res/Down.png')
+        self.downloadButton.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+        self.downloadButton.setIconSize(QSize(36,36))
+        self.downloadButton.setIcon(buttonIcon)
+        self.downloadButton.setFixedSize(60,60)
+        buttonPos = (self.size().width()-80 , 60)
+        self.downloadButton.move(buttonPos[0],buttonPos[1])
+        self.downloadButton.clicked.connect(self.toggleDownload)
+        self.downloadButton.hide()
+
+        # Download notice panel
+        self.panel = QFrame(self.widget)
+        self.panel.setFixedSize(300,60)
+        self.panel.setStyleSheet('background: #ffffff;border: 1px solid #b9b9b9;')
+        panelPos = (self.size().width()-390, 60)
+        self.panel.move(panelPos[0], panelPos[1])
+        self.panelLayout = QGridLayout(self.panel)
+        text = '''<b>Note:</b> Downloads are cleared upon log out or reconnection.
+        Interrupted transfers from the phone resume when it is connected again.'''
+        self.totalDownload = QLabel(text)
+        self.totalDownload.setWordWrap(True)
+        self.totalDownload.setStyleSheet('border: 0px solid #000000')
+        self.panelLayout.addWidget(self.totalDownload, 0,0)
+        self.panel.hide()
+
+        # Download frame
+        self.frame = QFrame(self.widget)
+        self.frame.setFixedSize(370,320)
+        framePos = (self.size().width()-390, 130)
+        self.frame.move(framePos[0], framePos[1])
+        self.frameLayout = QGridLayout(self.frame)
+        self.frameLayout.setContentsMargins(0,0,0,0)
+        self.downloadWidget = QTreeView()
+        self.downloadWidget.setModel(self.downloadModel)
+        self.buttonA = QPushButton('Pause')
+        self.buttonB = QPushButton('Cancel')
+        self.buttonC = QPushButton('Show in Explorer')
+        self.buttonC.setIcon(icon('res/open.png'))
+        self.buttonA.clicked.connect(self.buttonA_handle)
+        self.buttonB.clicked.connect(self.buttonB_handle)
+        self.buttonC.clicked.connect(self.buttonC_handle)
+        self.hideDownloadActions()
+        self.frameLayout.addWidget(self.downloadWidget, 0,0,1,3)
+        self.frameLayout.addWidget(self.buttonA, 1,0)
+        self.frameLayout.addWidget(self.buttonB, 1,1)
+        self.frameLayout.addWidget(self.buttonC, 1,2)
+        self.throughputLabel = QLabel('')
+        self.frameLayout.addWidget(self.throughputLabel, 2,0,1,3) 
+        self.limitBox = QComboBox()
+        for text, rate in LIMITS:
+            self.limitBox.addItem(text, rate)
+        self.limitBox.setToolTip('Speed limit of all transfers together')
+        self.limitBox.currentIndexChanged.connect(self.limitChanged)
+        self.perFileBox = QComboBox()
+        for text, rate in LIMITS:
+            self.perFileBox.addItem(text+' each' if rate else text, rate)
+        self.perFileBox.setToolTip('Speed limit of each transfer')
+        self.perFileBox.currentIndexChanged.connect(self.limitChanged)
+        self.fairShareBox = QCheckBox('Fair share')
+        self.fairShareBox.setToolTip('Split the speed limit evenly between transfers')
+        self.fairShareBox.toggled.connect(self.limitChanged)
+        self.frameLayout.addWidget(self.limitBox, 3,0)
+        self.frameLayout.addWidget(self.perFileBox, 3,1)
+        self.frameLayout.addWidget(self.fairShareBox, 3,2)
+        self.syncButton = QPushButton('Sync to Folder')
+        self.syncButton.setToolTip('Download the files that are new since the last sync')
+        self.syncButton.clicked.connect(self.syncFolder)
+        self.frameLayout.addWidget(self.syncButton, 4,0,1,2)
+        self.processBox = QCheckBox('Process downloads')
+        self.processBox.setToolTip('Run '+POST_STAGES.replace(',', ', ')+' on finished files')
+        self.frameLayout.addWidget(self.processBox, 4,2)
+        self.frame.hide()  
+
+        # Download Widget
+        self.downloadWidget.setRootIsDecorated(False)
+        self.downloadWidget.setUniformRowHeights(True) # Only visible rows are laid out
+        self.downloadWidget.selectionModel().currentChanged.connect(self.updateButtons)
+        self.downloadWidget.clicked.connect(self.updateButtons)
+        self.downloadWidget.setAlternatingRowColors(True)
+        self.downloadWidget.setAllColumnsShowFocus(False)
+        self.downloadWidget.setColumnWidth(0,160)
+        self.downloadWidget.setDragEnabled(False)
+
+        # List of pages available offline
+        self.offlinePages = ['connecting.htm', 'help.htm','index.htm','no-wifi.htm',
+                             'not-connected.htm', 'not-open.htm','about.htm','gnu-gplv3.htm']
+        
+        # Connect Signals and Slots
+        self.connected.connect(self.applyUrl)
+        self.syncFound.connect(self.queueSync)
+        self.postProcessed.connect(self.applyPostProcess, Qt.QueuedConnection)
+        self.hideTimer.timeout.connect(self.hideDownload)
+        self.progressTimer.timeout.connect(self.flushProgress)
+        self.statsTimer.timeout.connect(self.updateStats)
+        # Hovering the downloads keeps them open
+        for widget in (self.frame, self.panel, self.downloadButton):
+            widget.installEventFilter(self)
+        self.browser.urlChanged.connect(self.handleUrlChange)
+        self.browser.loadFinished.connect(self.loadFinished)
+        self.browser.page().profile().downloadRequested.connect(self.download)
+       
+        # Display window
+        self.setMinimumSize(QSize(640,480))
+        self.showMaximized()
+        self.show()
+    
+    def download(self, item, size=-1):
+        '''Function to initiate downloads
+            To delete failed downloads'''
+        
+        # Files from the phone are fetched natively over several connections.
+        # The WebEngine item is left unaccepted so Chromium drops its stream
+        if isinstance(item, QWebEngineDownloadItem) and self.isPhoneUrl(item.url()):
+            size = item.totalBytes()
+            item = NativeDownloadItem(item.url().toString(), item.path())
+        native = isinstance(item, NativeTransferItem)
+
+        if not native:
+            item.accept()
+        downloadItem = DownloadItem(self.downloadModel, item, self)
+        # To stop failed or cancelled downloads from reinitaiting
+        # the row of an earlier download to the same path is replaced
+        old_item = self.registry.replace(downloadItem)
+        if old_item is not None:
+            old_item.remove()
+        if native:
+            # Phone transfers wait for a free slot, small files first
+            downloadItem.queue()
+            self.scheduler.submit(downloadItem, size)
+        
+    def reportProgress(self, item, bytes_received, bytes_total):
+        '''Queue progress of item for the next frame'''
+        if self.progress.report(item, bytes_received, bytes_total):
+            if not self.progressTimer.isActive():
+                self.progressTimer.start()
+        if not self.statsTimer.isActive():
+            self.statsTimer.start()
+
+    def flushProgress(self):
+        '''Slot for progressTimer, draw the rows that changed since the last frame'''
+        self.wakeups += 1
+        if not len(self.progress):
+            self.progressTimer.stop() # Idle until the next report
+            return
+        for item, (bytes_received, bytes_total) in self.progress.take():
+            item.apply_progress(bytes_received, bytes_total)
+
+    def limitChanged(self):
+        '''Apply the speed limit controls, running transfers follow straight away'''
+        LIMITER.set_limits(self.limitBox.currentData(), self.perFileBox.currentData(),
+                           self.fairShareBox.isChecked())
+
+    def updateStats(self):
+        '''Slot for statsTimer, show session throughput and mark stalled rows'''
+        self.wakeups += 1
+        telemetry = self.telemetry
+        if TELEMETRY_FILE:
+            telemetry.write_jsonl(TELEMETRY_FILE)
+        active = telemetry.active()
+        if not active:
+            self.statsTimer.stop()
+            self.throughputLabel.setText('')
+            return
+        text = '%d active' % active
+        rate = int(telemetry.throughput())
+        if rate:
+            text += ', %s/s' % get_size(rate)
+        self.throughputLabel.setText(text)
+        now = telemetry.clock()
+        for item, meter in list(telemetry.meters.items()):
+            if not item.valid:
+                telemetry.end(item) # Row went away, a late signal left its meter
+            elif meter.stalled(now) and item.state == 'inprogress':
+                item.status = 'Stalled'
+                item.update_data()
+
+    def isPhoneUrl(self, url):
+        '''Check if url is served by the connected phone'''
+        phone = QUrl(URL)
+        return (phone.scheme() == 'http' and url.host() == phone.host()
+                and url.port() == phone.port())
+
+    def updateButtons(self):
+        '''
+        To update text and icon on the action buttons
+        based on the state of the downloadItem
+        '''
+        item = self.currentItem()
+        if not item:
+            return
+        if item.state == 'queued':
+            self.buttonA.setText('Start')
+            self.buttonA.setIcon(self.icons['resume'])
+            self.buttonB.setText('Cancel')
+            self.buttonB.setIcon(self.icons['cancel'])
+        elif item.state == 'inprogress':
+            self.buttonA.setText('Pause')
+            self.buttonA.setIcon(self.icons['pause'])
+            self.buttonB.setText('Cancel')
+            self.buttonB.setIcon(self.icons['cancel'])
+        elif item.state == 'paused':
+            self.buttonA.setText('Resume')
+            self.buttonA.setIcon(self.icons['resume'])
+            self.buttonB.setText('Cancel')
+            self.buttonB.setIcon(self.icons['cancel'])
+        elif item.state in ('failed', 'corrupt'):
+            self.buttonA.setText('Retry')
+            self.buttonA.setIcon(self.icons['retry'])
+            self.buttonB.setText('Remove')
+            self.buttonB.setIcon(self.icons['remove'])
+        elif item.state == 'finished':
+            self.buttonA.setText('Open')
+            self.buttonA.setIcon(self.icons['open'])
+            self.buttonB.setText('Remove')
+            self.buttonB.setIcon(self.icons['remove'])
+        elif item.state == 'cancelled':
+            self.buttonA.setText('Retry')
+            self.buttonA.setIcon(self.icons['retry'])
+            self.buttonB.setText('Remove')
+            self.buttonB.setIcon(self.icons['remove'])
+        self.showDownloadActions()
+    
+    def currentItem(self):
+        '''DownloadItem of the selected row or None'''
+        return self.downloadModel.item(self.downloadWidget.currentIndex().row())
+
+    def hideDownloadActions(self):
+        '''Hide action button to prevent event overload'''
+        self.buttonA.hide()
+        self.buttonB.hide()
+        self.buttonC.hide()
+        self.downloadWidget.clearSelection()
+    
+    def showDownloadActions(self):
+        '''Show action button to perform actions on downloadItem'''
+        self.buttonA.show()
+        self.buttonB.show()
+        self.buttonC.show()
+    
+    def buttonA_handle(self):
+        '''Handle events from buttonA based on the text'''
+        item = self.currentItem()
+        text =self.buttonA.text()
+        if not item:
+            return
+        if text == 'Start':
+            self.scheduler.start_now(item)
+        elif text == 'Pause':
+            item.pause()
+        elif text == 'Resume':
+            item.resume()
+        elif text == 'Retry':
+            url = item.url
+            if isinstance(item.downloadItem, NativeDownloadItem):
+                # Continues from the journal into the same file
+                self.download(NativeDownloadItem(url, item.path), item.total or -1)
+            elif isinstance(item.downloadItem, NativeUploadItem):
+                uploadItem = NativeUploadItem(url, item.path, item.downloadItem.name)
+                self.download(uploadItem, uploadItem.engine.bytes_total)
+            else:
+                item.remove()
+                self.browser.setUrl(QUrl(url))
+        elif text == 'Open':
+            QDesktopServices.openUrl(QUrl.fromLocalFile(item.path))
+
+        self.hideDownloadActions()
+    
+    def buttonB_handle(self):
+        '''Handle events from buttonB based on the text'''
+        item = self.currentItem()
+        text =self.buttonB.text()
+        if not item:
+            return
+        if text=='Cancel':
+            item.cancel()
+        elif text=='Remove':
+            # Rows replaced by a retry keep the journal the retry continues from
+            item.remove(forget=True)
+        self.hideDownloadActions()
+    
+    def buttonC_handle(self):
+        '''Handle events from buttonC
+        Open explorer and select the requested file'''
+        item = self.currentItem()
+        if not item:
+            return
+        path = item.path.replace('/','\\')
+        subprocess.Popen('explorer /select,"'+path+'"')
+        self.hideDownloadActions()
+    
+    def resizeEvent(self, e):
+        '''To move Download, and Reconnect buttons 
+        Panel and frame position accordingly based on window size'''
+        buttonPos = (self.size().width()-80 , self.size().height()-80)
+        self.reconnectButton.move(buttonPos[0], buttonPos[1])
+        buttonPos = (self.size().width()-80 , 60)
+        self.downloadButton.move(buttonPos[0],buttonPos[1])
+        panelPos = (self.size().width()-390, 60)
+        self.panel.move(panelPos[0], panelPos[1])
+        framePos = (self.size().width()-390, 130)
+        self.frame.move(framePos[0], framePos[1])
+    
+    def eventFilter(self, obj, event):
+        '''Hold the hide timer while the mouse is over the downloads
+        and send files dropped on the phone's page natively'''
+        kind = event.type()
+        if obj is self.browser:
+            if kind == QEvent.ChildAdded and event.child().isWidgetType():
+                event.child().installEventFilter(self)
+        elif obj in (self.frame, self.panel, self.downloadButton):
+            if kind == QEvent.Enter:
+                self.hideTimer.stop()
+            elif kind == QEvent.Leave and self.showDownload:
+                self.hideTimer.start(10000)
+        elif kind in (QEvent.DragEnter, QEvent.DragMove, QEvent.Drop):
+            paths = self.droppedFiles(event)
+            if paths:
+                if kind == QEvent.Drop:
+                    self.upload(paths)
+                event.acceptProposedAction()
+                return True
+        return QMainWindow.eventFilter(self, obj, event)
+
+    def droppedFiles(self, event):
+        '''Local files in a drag when the phone's page is open'''
+        if not self.isPhoneUrl(QUrl(URL)):
+            return []
+        return [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+
+    def upload(self, paths):
+        '''Queue files and folders to be sent to the phone'''
+        walker = walk(paths)
+        if self.uploads is None:
+            self.uploads = walker
+            QTimer.singleShot(0, self.queueUploads)
+        else:
+            self.uploads = itertools.chain(self.uploads, walker)
+
+    def queueUploads(self):
+        '''Add dropped files in small batches so large folders don't freeze the window'''
+        if self.uploads is None:
+            return
+        batch = list(itertools.islice(self.uploads, 200))
+        if not batch:
+            self.uploads = None
+            return
+        url = upload_url(URL)
+        for path, name in batch:
+            try:
+                item = NativeUploadItem(url, path, name)
+            except OSError:
+                continue # Removed since the drop
+            self.download(item, item.engine.bytes_total)
+        QTimer.singleShot(0, self.queueUploads)
+
+    def syncFolder(self):
+        '''Slot for syncButton, pull what the folder is missing from the phone'''
+        if not self.isPhoneUrl(QUrl(URL)):
+            return
+        folder = QFileDialog.getExistingDirectory(self, 'Sync to Folder')
+        if folder:
+            Thread(target=self.findChanges, args=(URL, folder), daemon=True).start()
+
+    def findChanges(self, url, folder):
+        '''Sync thread: diff the phone's listing with the index in batches'''
+        index = SyncIndex()
+        batch = []
+        try:
+            for remote in index.changes(folder, list_files(url)):
+                batch.append(remote)
+                if len(batch) >= BATCH:
+                    self.syncFound.emit(folder, batch)
+                    batch = []
+            if batch:
+                self.syncFound.emit(folder, batch)
+        except (OSError, ValueError) as e:
+            print('Sync Failed:', e)
+        finally:
+            index.close()
+
+    def queueSync(self, folder, batch):
+        '''Slot for syncFound, queue a batch of files for download'''
+        for remote in batch:
+            try:
+                path = local_path(folder, remote.path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            except (OSError, ValueError):
+                continue
+            self.syncing[path] = folder, remote
+            self.download(NativeDownloadItem(remote.url, path), remote.size)
+
+    def synced(self, item):
+        '''A download finished, remember it if it was part of a sync'''
+        entry = self.syncing.pop(item.path, None)
+        if entry is None:
+            return
+        if self.syncIndex is None:
+            self.syncIndex = SyncIndex()
+        engine = item.downloadItem.engine
+        digest = '%s:%s' % engine.digest if engine.digest else None
+        self.syncIndex.record(entry[0], entry[1], item.path, engine.bytes_total, digest)
+        self.syncIndex.commit()
+
+    def postProcess(self, item):
+        '''A download finished, hand it to the pool when processing is on'''
+        if not self.processBox.isChecked() or isinstance(item.downloadItem, NativeUploadItem):
+            return
+        if self.processor is None:
+            self.processor = PostProcessor(POST_STAGES, on_state=self.postProcessed.emit)
+            QApplication.instance().aboutToQuit.connect(self.stopProcessing)
+        item.status = item.completed_status()+', waiting to process'
+        self.processor.submit(item, item.path)
+
+    def applyPostProcess(self, item, state, info):
+        '''Slot for postProcessed, show the stage results on the row'''
+        if state == 'processing':
+            item.status = item.completed_status()+', processing'
+        elif state == 'failed':
+            item.status = item.completed_status()+', processing failed'
+            print('Processing Failed:', info['error'])
+        else:
+            item.status = item.completed_status()+', processed'
+            if info['path'] != item.path:
+                self.moved(item, info['path'])
+            if self.mediaIndex is None:
+                self.mediaIndex = MediaIndex()
+            self.mediaIndex.record(info)
+            if not self.processor.busy():
+                self.mediaIndex.commit()
+        item.update_data()
+
+    def moved(self, item, path):
+        '''The sort stage moved the file of item to path'''
+        if self.syncIndex is not None:
+            self.syncIndex.move(item.path, path)
+        self.registry.discard(item)
+        item.path = path
+        item.folder = os.path.dirname(path)
+        self.registry.replace(item)
+
+    def stopProcessing(self):
+        self.processor.shutdown(wait=False)
+        if self.mediaIndex is not None:
+            self.mediaIndex.close()
+
+    def hideDownload(self):
+        '''hide download due to inactivity'''
+        self.wakeups += 1
+        if self.frame.underMouse() or self.panel.underMouse() or self.downloadButton.underMouse():
+            # Leaving the widgets starts the timer again
+            self.hideTimer.stop()
+            return
+        self.hideTimer.stop()
+        self.showDownload = False
+        self.panel.hide()
+        self.frame.hide()
+        self.hideDownloadActions()
+    
+    def toggleDownload(self):
+        '''Slot for downloadButton'''
+        if self.showDownload:
+            self.showDownload = False
+            self.panel.hide()
+            self.frame.hide()
+            self.hideDownloadActions()
+            self.hideTimer.stop()
+        else:
+            self.showDownload = True
+            self.panel.show()
+            self.frame.show()
+            self.hideTimer.start(10000)
+        
+    def loadFinished(self, state):
+        '''Check page url after loading to determine wether
+        or not to show the reconnect and downloads button'''
+        global URL
+        fullUrl = self.browser.url().toString()
+        if not state:
+            if fullUrl == 'https://bixoftware.wordpress.com/xenderforpc':
+                webbrowser.open_new_tab("https://bixoftware.wordpress.com/xenderforpc")
+                URL = self.url = page('about.htm')
+                self.browser.setUrl(QUrl(self.url))
+            elif fullUrl == "https://github.com/emmanuelekopimo/xender-for-pc":
+                webbrowser.open_new_tab("https://github.com/emmanuelekopimo/xender-for-pc")
+                URL = self.url = page('about.htm')
+                self.browser.setUrl(QUrl(self.url))
+            else:
+                forget() # Look the gateway up again on reconnect
+                URL = self.url = page('not-open.htm')
+                self.browser.setUrl(QUrl(self.url))
+        else: # Internet available
+            if fullUrl == 'https://bixoftware.wordpress.com/xenderforpc':
+                webbrowser.open_new_tab("https://bixoftware.wordpress.com/xenderforpc")
+                URL = self.url = page('about.htm')
+                self.browser.setUrl(QUrl(self.url))
+            elif fullUrl == "https://github.com/emmanuelekopimo/xender-for-pc":
+                webbrowser.open_new_tab("https://github.com/emmanuelekopimo/xender-for-pc")
+                URL = self.url = page('about.htm')
+                self.browser.setUrl(QUrl(self.url))
+            else:
+                pass
+        fileNameUrl = os.path.split(self.browser.url().toString())[-1]
+        print(fileNameUrl)
+        if fileNameUrl in self.offlinePages:
+            self.reconnectButton.hide()
+            self.downloadButton.hide()
+            self.panel.hide()
+            self.frame.hide()
+            self.buttonA.hide()
+            self.buttonB.hide()
+            self.buttonC.hide()
+            self.downloadWidget.clearSelection()
+            self.showDownload = False
+        else:
+            self.reconnectButton.show()
+            self.downloadButton.show()
+            
+        
+    def handleUrlChange(self):
+        global URL
+        fullUrl = self.browser.url().toString()
+        fileNameUrl = os.path.split(self.browser.url().toString())[-1]
+        self.url = URL = fullUrl
+        if fileNameUrl=='connecting.htm':
+            for item in self.downloadItems:
+                item.suspend()
+            self.downloadModel.clear()
+            self.registry.clear()
+            self.scheduler.clear()
+            self.progress.clear()
+            self.telemetry.clear()
+            self.uploads = None
+            self.syncing.clear()
+            self.resumePending = True
+            self.startConnect()
+        elif self.resumePending and self.isPhoneUrl(self.browser.url()):
+            self.resumePending = False
+            self.resumeTransfers()
+        if fullUrl == 'about:blank':
+            URL = self.url = page('index.htm')
+            self.browser.setUrl(QUrl(self.url))
+
+        
+    def resumeTransfers(self):
+        '''Restart the connected phone's transfers left in the journal by a reconnect or restart'''
+        for journal in pending(JOURNALS, QUrl(URL).host()):
+            url = rebase(journal.header['url'], URL)
+            self.download(NativeDownloadItem(url, journal.header['path']),
+                          journal.header['size'])
+
+    def startConnect(self):
+        '''Run connect() in the background, the result arrives through connected'''
+        trace('connect started')
+        connect_thread = Thread(target=lambda: self.connected.emit(connect()), daemon=True)
+        connect_thread.start()
+
+    def applyUrl(self, url):
+        '''Slot for connected, show the page chosen by connect()'''
+        if url != self.url:
+            self.url = url
+            self.browser.setUrl(QUrl(self.url))
+
+    def reconnect(self):
+        '''Slot for reconnectButton'''
+        global URL
+        self.reconnectButton.hide()
+        self.downloadButton.hide()
+        self.panel.hide()
+        self.frame.hide()
+        self.showDownload = False
+        # handleUrlChange starts connect() once connecting.htm is shown
+        URL = self.url = page('connecting.htm')
+        self.browser.setUrl(QUrl(self.url))
+
+# Slots and signal handlers are timed when XENDER_PROFILE or XENDER_STALL_MS is set
+for cls in (NativeTransferItem, DownloadItem, DownloadModel, MainWindow):
+    MONITOR.instrument(cls)
+
+
+def main():
+    '''Start the window'''
+    app = QApplication(sys.argv)
+    trace('application created')
+    if TRACE_STARTUP:
+        firstPaint = FirstPaint()
+        app.installEventFilter(firstPaint)
+    # Kept in a name so the window is not collected while the app runs
+    window = MainWindow()
+    trace('window created')
+    if AUTO_CONNECT:
+        # Same as clicking Link Phone once the event loop runs
+        QTimer.singleShot(0, window.reconnect)
+    beatTimer = QTimer() # Lets the stall monitor see the event loop running
+    if MONITOR.enabled:
+        MONITOR.start()
+        beatTimer.timeout.connect(MONITOR.beat)
+        beatTimer.start(int(BEAT_INTERVAL * 1000))
+        app.aboutToQuit.connect(MONITOR.stop)
+        app.aboutToQuit.connect(MONITOR.report)
+    return app.exec()
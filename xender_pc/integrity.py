@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Integrity checks for downloaded files
+The file is hashed on its own thread while it is being written. Data that
+arrives at the hash position is hashed from memory, data written ahead of it
+by other segments is read back from the file once the hash gets there
+'''
+
+import re
+import base64
+import hashlib
+
+from queue import Queue
+from threading import Thread, Lock, Semaphore
+
+DEFAULT_ALGORITHM = 'blake2b' # Used when the server does not send a digest
+READ_SIZE = 1024 * 1024
+QUEUE_SIZE = 64 # Chunks waiting to be hashed before writers are held back
+
+
+def expected_digest(headers):
+    '''
+    Digest sent by the server as (algorithm, hex) or None
+    Understands Repr-Digest (RFC 9530) and Digest (RFC 3230) with SHA-256
+    '''
+    for name in ('Repr-Digest', 'Digest'):
+        value = headers.get(name, '')
+        match = re.search(r'sha-256=:?([A-Za-z0-9+/=]+):?', value, re.IGNORECASE)
+        if match:
+            try:
+                return 'sha256', base64.b64decode(match.group(1)).hex()
+            except ValueError:
+                continue
+    return None
+
+
+class StreamHasher:
+    '''
+    Hashes path in offset order from out of order (offset, data) writes
+    update() is called by writers after the data has reached the file.
+    Only data at the hash front is queued with its bytes, other writes
+    queue just their range so they never wait on a read back
+    '''
+    def __init__(self, path, algorithm=DEFAULT_ALGORITHM):
+        self.path = path
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+        self.position = 0 # Bytes hashed so far
+        self.ahead = {} # start to end of ranges written past position
+        self._ends = {} # end to start of the same ranges
+        self._queue = Queue()
+        self._slots = Semaphore(QUEUE_SIZE) # Held by queued chunks with their bytes
+        self._front = 0 # End of the last chunk queued with its bytes
+        self._lock = Lock()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, offset, data):
+        end = offset + len(data)
+        with self._lock:
+            front = offset == max(self._front, self.position)
+            if front:
+                self._front = end
+        if front:
+            self._slots.acquire()
+            self._queue.put((offset, end, data))
+        else:
+            self._queue.put((offset, end, None))
+
+    def close(self):
+        '''Stop hashing without a result, the transfer did not finish'''
+        self._queue.put(None)
+        self._thread.join()
+
+    def finish(self, size):
+        '''Hash whatever was not seen in memory and return the hex digest'''
+        self._queue.put(None)
+        self._thread.join()
+        self._read(size)
+        return self.hash.hexdigest()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            offset, end, data = chunk
+            if data is not None:
+                self._slots.release()
+                if offset == self.position:
+                    self.hash.update(data)
+                    self.position = end
+                    self._catch_up()
+                    continue
+            if end > self.position:
+                # Only the range is kept, the bytes are read back later
+                self._mark(max(offset, self.position), end)
+                self._catch_up()
+            # Data before position was already hashed by an earlier attempt
+
+    def _mark(self, start, end):
+        '''Remember a written range, joining it to the range it continues'''
+        if start in self._ends:
+            start = self._ends.pop(start)
+        self.ahead[start] = max(self.ahead.get(start, 0), end)
+        self._ends[self.ahead[start]] = start
+
+    def _catch_up(self):
+        '''Hash ranges written ahead that now join the hash position'''
+        while self.position in self.ahead:
+            end = self.ahead.pop(self.position)
+            self._ends.pop(end, None)
+            self._read(end)
+
+    def _read(self, end):
+        '''Hash the file from position to end'''
+        if end <= self.position:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.position)
+            while self.position < end:
+                data = f.read(min(READ_SIZE, end - self.position))
+                if not data:
+                    break
+                self.hash.update(data)
+                self.position += len(data)
+        # Ranges partly covered by the read now start at position
+        ahead = list(self.ahead.items())
+        self.ahead.clear()
+        self._ends.clear()
+        for start, stop in ahead:
+            if stop > self.position:
+                self._mark(max(start, self.position), stop)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Transfer journal used to resume interrupted downloads
+Each transfer has one file: a JSON header line with the url, target path
+and validators, followed by fixed size records of completed byte ranges.
+Records are only ever appended so saving progress is one small write
+'''
+
+import os
+import json
+import struct
+import hashlib
+
+from threading import Lock
+from urllib.parse import urlsplit
+
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.xender-for-pc', 'journal')
+RECORD = struct.Struct('<QQ') # start, end of a completed range
+SUFFIX = '.journal'
+
+
+def journal_path(path, directory=JOURNAL_DIR):
+    '''Journal file used for the download saved at path'''
+    name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(directory, name+SUFFIX)
+
+
+def merge(ranges):
+    '''Merge overlapping and touching [start, end) ranges'''
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def gaps(ranges, size):
+    '''Ranges of [0, size) not covered by the merged ranges'''
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+class Journal:
+    '''Append-only record of the progress of one download'''
+    def __init__(self, path, header, ranges=()):
+        self.path = path
+        self.header = header # url, host, path, size, etag, last_modified
+        self.ranges = merge(ranges)
+        self._file = None
+        self._lock = Lock()
+
+    @classmethod
+    def create(cls, header, directory=JOURNAL_DIR):
+        '''Start a new journal, replacing any old one for the same target'''
+        os.makedirs(directory, exist_ok=True)
+        journal = cls(journal_path(header['path'], directory), header)
+        journal._rewrite()
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        '''Read a journal and compact its range records'''
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            data = f.read()
+        # A torn record from a crash is ignored
+        usable = len(data) - len(data) % RECORD.size
+        ranges = [RECORD.unpack_from(data, i) for i in range(0, usable, RECORD.size)]
+        journal = cls(path, header, ranges)
+        journal._rewrite()
+        return journal
+
+    @classmethod
+    def find(cls, path, directory=JOURNAL_DIR):
+        '''Journal for the download saved at path or None'''
+        try:
+            return cls.load(journal_path(path, directory))
+        except (OSError, ValueError):
+            return None
+
+    def _rewrite(self):
+        '''Write the header and merged ranges to a fresh file'''
+        temp = self.path+'.tmp'
+        with open(temp, 'wb') as f:
+            f.write(json.dumps(self.header).encode('utf-8')+b'\n')
+            for start, end in self.ranges:
+                f.write(RECORD.pack(start, end))
+        os.replace(temp, self.path)
+
+    def matches(self, info):
+        '''Check the server still has the same file'''
+        return (info.get('ranges') and info['size'] == self.header['size']
+                and info.get('etag', '') == self.header.get('etag', '')
+                and info.get('last_modified', '') == self.header.get('last_modified', ''))
+
+    def missing(self):
+        '''Byte ranges still to be downloaded'''
+        return gaps(self.ranges, self.header['size'])
+
+    def record(self, start, end):
+        '''Append a completed range'''
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab', buffering=0)
+            self._file.write(RECORD.pack(start, end))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        '''Forget the transfer once it is finished or cancelled'''
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def source_host(header):
+    '''Host a journal's download came from, older journals only have the url'''
+    return header.get('host') or urlsplit(header['url']).hostname
+
+
+def pending(directory=JOURNAL_DIR, host=None):
+    '''Journals of interrupted downloads, only those from host when it is given'''
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    journals = []
+    for name in names:
+        if name.endswith(SUFFIX):
+            try:
+                journal = Journal.load(os.path.join(directory, name))
+            except (OSError, ValueError):
+                continue
+            if host is None or source_host(journal.header) == host:
+                journals.append(journal)
+    return journals
+
+
+def discard(path, directory=JOURNAL_DIR):
+    '''Forget the download saved at path, it will not be resumed'''
+    try:
+        os.remove(journal_path(path, directory))
+    except OSError:
+        pass
+
+
+def rebase(url, base):
+    '''Move url onto the host and port of base, the phone may change address'''
+    parts = urlsplit(url)
+    new = urlsplit(base)
+    return parts._replace(scheme=new.scheme, netloc=new.netloc).geturl()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Finds what freezes the window
+The GUI thread beats on a timer and a watchdog thread samples its stack
+when the beats fall behind, so a stall points at the code that caused it.
+Slots and signal handlers can be timed, and a session can be profiled
+with cProfile or saved as trace events for chrome://tracing or Perfetto.
+Nothing is wrapped or started unless it is enabled
+'''
+
+import os
+import sys
+import json
+import time
+import cProfile
+import traceback
+
+from collections import deque
+from functools import wraps
+from threading import Thread, Event, Lock, get_ident
+
+PROFILE = os.environ.get('XENDER_PROFILE') # .prof for cProfile, other names get trace events
+STALL_MS = float(os.environ.get('XENDER_STALL_MS', 0)) # Report GUI stalls longer than this
+INTERVAL = 0.05 # Seconds between beats of the GUI thread
+MAX_STALLS = 100 # Stalls kept for the report
+STACK_DEPTH = 12 # Innermost frames kept of a stack sample
+CO_VARARGS = 0x04
+
+
+def accepted(function):
+    '''Positional arguments function takes, None when it takes any number'''
+    code = function.__code__
+    if code.co_flags & CO_VARARGS:
+        return None
+    return code.co_argcount
+
+
+class Monitor:
+    '''
+    Stall detector, slot timings and profiler of the window
+    Disabled unless stall_ms or profile is set
+    '''
+    def __init__(self, stall_ms=STALL_MS, profile=PROFILE, clock=time.perf_counter):
+        self.clock = clock
+        self.configure(stall_ms, profile)
+        self.timings = {} # name to [calls, total seconds, longest seconds]
+        self.stalls = deque(maxlen=MAX_STALLS) # (start, seconds, stack)
+        self.events = [] # Trace events, kept only when profile is a trace file
+        self.thread = None # Ident of the GUI thread
+        self.last = None # Time of the last beat
+        self.profiler = None
+        self._sample = None # Stack of the stall in progress
+        self._stop = Event()
+        self._lock = Lock()
+
+    def configure(self, stall_ms=0, profile=None):
+        '''Settings from the command line, to be given before instrument()'''
+        self.stall_ms = stall_ms or 0
+        self.profile = profile
+        self.trace = bool(profile) and not profile.endswith(('.prof', '.pstats'))
+        self.enabled = bool(self.stall_ms or profile)
+
+    def timed(self, name, function):
+        '''function wrapped to record its time under name'''
+        count = accepted(function)
+        add = self.add
+        clock = self.clock
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if count is not None:
+                # Qt passes every argument of the signal, slots may take fewer
+                args = args[:count]
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(name, start, clock() - start)
+        return wrapper
+
+    def instrument(self, cls, names=None):
+        '''
+        Time the methods of cls, every public one when names is None
+        Does nothing while disabled so calls go straight to the methods
+        '''
+        if not self.enabled:
+            return cls
+        if names is None:
+            names = [name for name, value in vars(cls).items()
+                     if not name.startswith('__') and callable(value)
+                     and hasattr(value, '__code__')]
+        for name in names:
+            setattr(cls, name, self.timed(cls.__name__+'.'+name, vars(cls)[name]))
+        return cls
+
+    def add(self, name, start, elapsed):
+        stats = self.timings.get(name)
+        if stats is None:
+            stats = self.timings[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        if self.trace:
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(),
+                                'tid': get_ident(), 'ts': start * 1e6, 'dur': elapsed * 1e6})
+
+    def start(self):
+        '''Begin on the GUI thread, the caller then runs beat() every INTERVAL'''
+        if not self.enabled:
+            return
+        self.thread = get_ident()
+        self.last = self.clock()
+        if self.profile and not self.trace:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if self.stall_ms:
+            self._stop.clear()
+            Thread(target=self._watch, daemon=True).start()
+
+    def beat(self):
+        '''GUI thread is free, ends the stall it was in if any'''
+        now = self.clock()
+        lag = now - self.last - INTERVAL
+        with self._lock:
+            sample, self._sample = self._sample, None
+        if lag * 1000 >= self.stall_ms and sample is not None:
+            self.stalls.append((self.last + INTERVAL, lag, sample))
+            print('GUI stalled for %.0f ms in %s' % (lag * 1000, sample[-1]), file=sys.stderr)
+            if self.trace:
+                self.events.append({'name': 'stall', 'ph': 'X', 'pid': os.getpid(),
+                                    'tid': self.thread, 'ts': (self.last + INTERVAL) * 1e6,
+                                    'dur': lag * 1e6, 'args': {'stack': sample}})
+        self.last = now
+
+    def _watch(self):
+        '''Watchdog: sample the GUI thread's stack once per stall'''
+        step = max(0.01, self.stall_ms / 4000)
+        while not self._stop.wait(step):
+            lag = self.clock() - self.last - INTERVAL
+            if lag * 1000 < self.stall_ms or self._sample is not None:
+                continue
+            frame = sys._current_frames().get(self.thread)
+            if frame is None:
+                continue
+            stack = ['%s:%d %s' % (os.path.basename(entry.filename), entry.lineno, entry.name)
+                     for entry in traceback.extract_stack(frame, STACK_DEPTH)]
+            with self._lock:
+                self._sample = stack
+
+    def stop(self):
+        '''Stop watching and save the profile'''
+        self._stop.set()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+        elif self.trace:
+            with open(self.profile, 'w') as f:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def slowest(self, count=10):
+        '''(name, calls, total, longest) of the slots that took the most time'''
+        rows = [(name,) + tuple(stats) for name, stats in self.timings.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:count]
+
+    def report(self, file=sys.stderr):
+        '''Print the slowest slots and the stalls'''
+        if not self.enabled:
+            return
+        if self.timings:
+            print('Slowest slots:', file=file)
+            for name, calls, total, longest in self.slowest():
+                print('  %-40s %7d calls %9.1f ms total %7.1f ms longest'
+                      % (name, calls, total * 1000, longest * 1000), file=file)
+        if self.stall_ms:
+            print('%d stalls over %g ms' % (len(self.stalls), self.stall_ms), file=file)
+            for start, seconds, stack in sorted(self.stalls, key=lambda stall: -stall[1])[:5]:
+                print('  %.0f ms' % (seconds * 1000), file=file)
+                for line in stack:
+                    print('    '+line, file=file)
+        if self.profile:
+            print('Profile saved to', self.profile, file=file)
+
+
+MONITOR = Monitor()
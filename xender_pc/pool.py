@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Keep-alive connections to the phone's server
+Every transfer borrows connections from one pool so a burst of small files
+reuses a few persistent connections instead of opening one per request.
+The pool caps the connections open to each server, borrowers wait for a
+free one once the cap is reached
+'''
+
+import time
+import select
+import http.client
+
+from contextlib import contextmanager
+from threading import Condition
+from urllib.parse import urlsplit
+
+POOL_SIZE = 8 # Connections open to one server at most
+IDLE_TIMEOUT = 30 # Seconds an unused connection is kept
+TIMEOUT = 15
+
+
+def open_connection(url, timeout=TIMEOUT):
+    '''Open a HTTP connection to the host of url'''
+    parts = urlsplit(url)
+    if parts.scheme == 'https':
+        return http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout)
+    return http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+
+
+def request_path(url):
+    '''Path and query of url as sent in the request line'''
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return path
+
+
+def server(url):
+    '''Key of the server of url in the pool'''
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port
+
+
+def alive(conn):
+    '''
+    An idle connection is usable while its socket has nothing to read,
+    a readable socket means the server closed it or sent something unasked
+    '''
+    if conn.sock is None:
+        return False
+    try:
+        readable = select.select([conn.sock], [], [], 0)[0]
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class ConnectionPool:
+    '''Persistent connections per server, shared by every transfer'''
+    def __init__(self, size=POOL_SIZE, timeout=TIMEOUT, idle_timeout=IDLE_TIMEOUT,
+                 clock=time.monotonic):
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.idle = {} # server to [(connection, time it was given back)]
+        self.busy = {} # server to connections lent out
+        self.keys = {} # connection lent out to its server
+        self.parked = set() # Connections lent out that do not count against the cap
+        self.opened = 0 # Connections opened, reuse shows as requests above this
+        self._cond = Condition()
+
+    def acquire(self, url):
+        '''
+        Returns (connection, reused) for the server of url
+        Idle connections are used newest first, a new one is opened while
+        the server is under the cap and otherwise this waits for a release
+        '''
+        key = server(url)
+        stale = []
+        with self._cond:
+            while True:
+                idle = self.idle.get(key)
+                while idle:
+                    conn, stamp = idle.pop()
+                    if self.clock() - stamp < self.idle_timeout and alive(conn):
+                        self._lend(key, conn)
+                        return conn, True
+                    stale.append(conn)
+                if self.busy.get(key, 0) < self.size:
+                    break
+                self._cond.wait()
+            conn = open_connection(url, self.timeout)
+            self._lend(key, conn)
+            self.opened += 1
+        for old in stale:
+            old.close()
+        return conn, False
+
+    def _lend(self, key, conn):
+        self.busy[key] = self.busy.get(key, 0) + 1
+        self.keys[conn] = key
+
+    def release(self, conn, resp=None):
+        '''
+        Give conn back, it is kept only when resp was read to the end
+        and the server did not ask to close the connection
+        '''
+        keep = resp is not None and resp.isclosed() and conn.sock is not None
+        with self._cond:
+            key = self.keys.pop(conn)
+            if conn in self.parked:
+                self.parked.discard(conn)
+            else:
+                self.busy[key] -= 1
+            if keep:
+                self.idle.setdefault(key, []).append((conn, self.clock()))
+            self._cond.notify()
+        if not keep:
+            conn.close()
+
+    def park(self, conn):
+        '''
+        Stop counting conn against the cap while its borrower is paused,
+        for requests that cannot be continued on another connection
+        '''
+        with self._cond:
+            if conn not in self.parked:
+                self.parked.add(conn)
+                self.busy[self.keys[conn]] -= 1
+                self._cond.notify()
+
+    def unpark(self, conn):
+        '''Count conn again, the cap may be passed until it is released'''
+        with self._cond:
+            if conn in self.parked:
+                self.parked.discard(conn)
+                self.busy[self.keys[conn]] += 1
+
+    def request(self, method, url, headers=None, body=None):
+        '''
+        Send a request on a pooled connection, returns (connection, response)
+        Reused connections that the server dropped meanwhile are replaced
+        '''
+        while True:
+            conn, reused = self.acquire(url)
+            try:
+                conn.request(method, request_path(url), body, headers or {})
+                return conn, conn.getresponse()
+            except ConnectionError:
+                self.release(conn)
+                if not reused:
+                    raise
+            except BaseException:
+                self.release(conn)
+                raise
+
+    @contextmanager
+    def open(self, url, headers=None):
+        '''GET url and yield the response, the connection goes back on exit'''
+        conn, resp = self.request('GET', url, headers)
+        try:
+            yield resp
+        finally:
+            self.release(conn, resp)
+
+    def clear(self, url=None):
+        '''
+        Close idle connections to the server of url or to every server,
+        connections lent out are left alone
+        '''
+        with self._cond:
+            if url is None:
+                idle = [conn for conns in self.idle.values() for conn, stamp in conns]
+                self.idle.clear()
+            else:
+                idle = [conn for conn, stamp in self.idle.pop(server(url), [])]
+        for conn in idle:
+            conn.close()
+
+
+# Shared by every transfer in the process unless one is passed in
+POOL = ConnectionPool()
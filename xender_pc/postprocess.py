@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Work done on files once they are downloaded
+Each file goes through a list of stages, like hashing, sorting photos
+into dated folders, making a thumbnail and reading its metadata. Stages
+run in a pool of processes so neither the window nor the transfers wait
+for them, and only a few files are handed to the pool at a time so a
+large batch does not pile up in memory
+'''
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import mimetypes
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from queue import Queue
+from threading import Thread, Condition, Semaphore
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None # Thumbnails and photo metadata need Pillow
+
+from .integrity import DEFAULT_ALGORITHM, READ_SIZE
+
+DATA_DIR = os.path.join(os.path.expanduser('~'), '.xender-for-pc')
+THUMBNAIL_DIR = os.path.join(DATA_DIR, 'thumbnails')
+MEDIA_INDEX = os.path.join(DATA_DIR, 'media.sqlite')
+THUMBNAIL_SIZE = (256, 256)
+PENDING = 2 # Files handed to the pool per worker, the rest wait here
+BATCH = 200 # Index rows written per statement
+DEFAULT_STAGES = ('hash', 'metadata', 'thumbnail')
+DATE_TAGS = (36867, 306) # EXIF DateTimeOriginal, then DateTime
+EXIF_IFD = 0x8769
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    kind TEXT,
+    taken REAL,
+    width INTEGER,
+    height INTEGER,
+    digest TEXT,
+    thumbnail TEXT,
+    processed REAL NOT NULL
+) WITHOUT ROWID
+'''
+
+
+def image_info(path):
+    '''Width, height and time taken of a photo, empty without Pillow or for other files'''
+    if Image is None:
+        return {}
+    try:
+        with Image.open(path) as image:
+            info = {'width': image.width, 'height': image.height}
+            exif = image.getexif()
+            values = [exif.get_ifd(EXIF_IFD).get(DATE_TAGS[0]), exif.get(DATE_TAGS[1])]
+    except (OSError, ValueError, SyntaxError):
+        return {}
+    for value in values:
+        if value:
+            try:
+                info['taken'] = time.mktime(time.strptime(str(value).strip('\x00 '),
+                                                          '%Y:%m:%d %H:%M:%S'))
+                break
+            except (ValueError, OverflowError):
+                continue
+    return info
+
+
+def free_path(folder, name):
+    '''Path of name in folder that no file has yet, numbered like browsers do'''
+    base, ext = os.path.splitext(name)
+    path = os.path.join(folder, name)
+    number = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, '%s (%d)%s' % (base, number, ext))
+        number += 1
+    return path
+
+
+def hash_stage(path, info, options):
+    '''Digest of the whole file, as algorithm:hex'''
+    digest = hashlib.new(options.get('algorithm', DEFAULT_ALGORITHM))
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(data)
+    info['digest'] = '%s:%s' % (digest.name, digest.hexdigest())
+    return path
+
+
+def metadata_stage(path, info, options):
+    '''Size, type and, for photos, dimensions and the time taken'''
+    stat = os.stat(path)
+    info['size'] = stat.st_size
+    info['mtime'] = stat.st_mtime
+    info['kind'] = mimetypes.guess_type(path)[0] or ''
+    if info['kind'].startswith('image/'):
+        info.update(image_info(path))
+    return path
+
+
+def sort_stage(path, info, options):
+    '''Move the file to year/month folders by the time it was taken or else modified'''
+    stamp = info.get('taken')
+    if stamp is None and (mimetypes.guess_type(path)[0] or '').startswith('image/'):
+        stamp = image_info(path).get('taken')
+    if stamp is None:
+        stamp = os.path.getmtime(path)
+    day = time.localtime(stamp)
+    root = options.get('sort_root') or os.path.dirname(path)
+    folder = os.path.join(root, '%04d' % day.tm_year, '%02d' % day.tm_mon)
+    if os.path.abspath(folder) == os.path.abspath(os.path.dirname(path)):
+        return path
+    os.makedirs(folder, exist_ok=True)
+    target = free_path(folder, os.path.basename(path))
+    shutil.move(path, target)
+    return target
+
+
+def thumbnail_stage(path, info, options):
+    '''JPEG thumbnail of a photo in the thumbnail folder, skipped without Pillow'''
+    info['thumbnail'] = None
+    if Image is None or not (mimetypes.guess_type(path)[0] or '').startswith('image/'):
+        return path
+    folder = options.get('thumbnail_dir', THUMBNAIL_DIR)
+    os.makedirs(folder, exist_ok=True)
+    name = hashlib.sha1(os.path.abspath(path).encode('utf-8', 'replace')).hexdigest()
+    target = os.path.join(folder, name+'.jpg')
+    try:
+        with Image.open(path) as image:
+            image.thumbnail(options.get('thumbnail_size', THUMBNAIL_SIZE))
+            image.convert('RGB').save(target, 'JPEG', quality=85)
+    except (OSError, ValueError, SyntaxError):
+        return path # Not a picture Pillow can read
+    info['thumbnail'] = target
+    return path
+
+
+STAGES = {'hash': hash_stage,
+          'metadata': metadata_stage,
+          'sort': sort_stage,
+          'thumbnail': thumbnail_stage,
+          }
+
+
+def resolve(stages):
+    '''
+    Stage functions of a list of names or functions, or of a comma list
+    Functions must be defined at module level so the pool can send them
+    '''
+    if isinstance(stages, str):
+        stages = [name.strip() for name in stages.split(',') if name.strip()]
+    functions = []
+    for stage in stages:
+        if callable(stage):
+            functions.append(stage)
+        elif stage in STAGES:
+            functions.append(STAGES[stage])
+        else:
+            raise ValueError('Unknown stage: '+repr(stage))
+    return functions
+
+
+def process(path, stages, options=None):
+    '''
+    Run the stages on path, in a worker or in this process
+    Returns a dict of their results with the final path and, when a
+    stage failed, the error
+    '''
+    options = options or {}
+    info = {'path': path}
+    for stage in stages:
+        try:
+            path = stage(path, info, options)
+        except (OSError, ValueError) as e:
+            info['error'] = '%s: %s' % (stage.__name__, e)
+            break
+        info['path'] = path
+    return info
+
+
+class PostProcessor:
+    '''
+    Runs the stages on finished files in a pool of processes
+    submit() never blocks. on_state(key, state, info) is called from a
+    pool thread with 'processing' when the file is handed to the pool and
+    'processed' or 'failed' when it is done
+    '''
+    def __init__(self, stages=DEFAULT_STAGES, options=None, workers=None,
+                 pending=None, on_state=None):
+        self.stages = resolve(stages)
+        self.options = options or {}
+        self.workers = workers or os.cpu_count() or 1
+        self.on_state = on_state
+        self.executor = None # Started with the first file
+        self.waiting = Queue() # (key, path) not yet in the pool
+        self.active = 0 # Files submitted and not done
+        self._slots = Semaphore(pending or PENDING * self.workers)
+        self._idle = Condition()
+
+    def submit(self, key, path):
+        with self._idle:
+            self.active += 1
+            if self.executor is None:
+                # Forking a process with Qt and transfer threads running is not safe
+                self.executor = ProcessPoolExecutor(
+                    self.workers, multiprocessing.get_context('spawn'))
+                Thread(target=self._feed, daemon=True).start()
+        self.waiting.put((key, path))
+
+    def _feed(self):
+        '''Feeder thread: hand files to the pool as slots free up'''
+        while True:
+            item = self.waiting.get()
+            if item is None:
+                return
+            self._slots.acquire()
+            key, path = item
+            try:
+                future = self.executor.submit(process, path, self.stages, self.options)
+            except RuntimeError as e: # Pool shut down or broken
+                self._done(key, path, None, e)
+                continue
+            self._report(key, 'processing', {'path': path})
+            future.add_done_callback(partial(self._done, key, path))
+
+    def _done(self, key, path, future, error=None):
+        self._slots.release()
+        if future is not None:
+            try:
+                info = future.result()
+            except Exception as e: # Anything a stage raised or a worker that died
+                error = e
+        if error is not None:
+            info = {'path': path, 'error': str(error)}
+        self._report(key, 'failed' if 'error' in info else 'processed', info)
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def _report(self, key, state, info):
+        if self.on_state:
+            self.on_state(key, state, info)
+
+    def busy(self):
+        return self.active > 0
+
+    def wait(self, timeout=None):
+        '''Block until every submitted file is done, returns False on timeout'''
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.active, timeout)
+
+    def shutdown(self, wait=True):
+        '''Stop the pool, files still waiting are dropped'''
+        self.waiting.put(None)
+        if self.executor is not None:
+            self.executor.shutdown(wait)
+            self.executor = None
+
+
+class MediaIndex:
+    '''SQLite table of processed files, used from the thread that opened it'''
+    def __init__(self, path=MEDIA_INDEX):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(SCHEMA)
+        self.pending = [] # Rows not yet written
+
+    def record(self, info):
+        '''Remember the results of process(), written in batches'''
+        if 'size' not in info:
+            return # The metadata stage did not run
+        self.pending.append((os.path.abspath(info['path']), info['size'], info['mtime'],
+                             info.get('kind'), info.get('taken'), info.get('width'),
+                             info.get('height'), info.get('digest'), info.get('thumbnail'),
+                             time.time()))
+        if len(self.pending) >= BATCH:
+            self.commit()
+
+    def commit(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO media VALUES (?,?,?,?,?,?,?,?,?,?)',
+                                    self.pending)
+            self.pending = []
+
+    def find(self, path):
+        '''Row of path as a dict or None'''
+        cursor = self.db.execute('SELECT * FROM media WHERE path = ?', (os.path.abspath(path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Progress text shown for transfers, and batching of progress into
+periodic view updates. Only the latest byte counters of each transfer
+are kept between frames
+'''
+
+FRAME_RATE = 10 # View updates per second
+INTERVAL = 1000 // FRAME_RATE # Milliseconds between updates
+
+
+def get_size(size_bytes):
+    '''Convert bytes to KB, MB and GB'''
+    if size_bytes>1000000000:
+        calc_size = round(size_bytes/1000000000,1)
+        unit = 'GB'
+    elif size_bytes>1000000:
+        calc_size = round(size_bytes/1000000,1)
+        unit = 'MB'
+    elif size_bytes>1000:
+        calc_size = round(size_bytes/1000,1)
+        unit = 'KB'
+    elif size_bytes==0 or size_bytes==-1:
+        calc_size = ''
+        unit = 'Unknown'
+    else:
+        calc_size = size_bytes
+        unit = 'B'
+    
+    size_text = str(calc_size)+' '+unit
+    return size_text
+
+
+def progress_status(bytes_received, bytes_total):
+    '''Status text of a transfer in progress'''
+    if bytes_total==0 or bytes_total==-1:
+        return 'In Progress'
+    progress = str(int(100 * bytes_received / bytes_total))+'%'
+    return 'In Progress ('+progress+')'
+
+
+# Status text of finished states
+STATUS = {'queued': 'Queued',
+          'paused': 'Paused',
+          'cancelled': 'Cancelled',
+          'failed': 'Failed',
+          'corrupt': 'Corrupt',
+          }
+
+
+def finished_status(verification):
+    '''Status text of a completed transfer, only a matched digest is Verified'''
+    if verification == 'verified':
+        return 'Verified'
+    if verification == 'size':
+        return 'Completed (size OK)'
+    return 'Completed'
+
+
+class ProgressBatcher:
+    '''Collects (bytes_received, bytes_total) per transfer until taken'''
+    def __init__(self):
+        self._pending = {}
+
+    def report(self, key, bytes_received, bytes_total):
+        '''
+        Record the latest counters of key
+        Returns True when this is the first report since the last take
+        '''
+        first = not self._pending
+        self._pending[key] = (bytes_received, bytes_total)
+        return first
+
+    def discard(self, key):
+        '''Drop a pending report, used when a transfer goes away'''
+        self._pending.pop(key, None)
+
+    def clear(self):
+        self._pending.clear()
+
+    def take(self):
+        '''All reports since the last call, one per transfer'''
+        pending = self._pending
+        self._pending = {}
+        return pending.items()
+
+    def __len__(self):
+        return len(self._pending)
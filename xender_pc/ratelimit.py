@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Bandwidth limits for transfers
+A global token bucket caps the whole session and each transfer has its
+own bucket for a per-transfer cap. In fair share mode the global rate is
+split evenly so small files are not starved behind large ones.
+A rate of 0 means unlimited and costs nothing in the data path
+'''
+
+import re
+import time
+
+from threading import Lock
+
+BURST = 0.25 # Seconds of traffic a bucket may save up
+MIN_CHUNK = 16 * 1024 # Smallest read while limited
+
+
+def parse_rate(text):
+    '''Bytes per second from text like 500K, 2M or 1.5G'''
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)B?(?:/S)?\s*', text.upper())
+    if not match:
+        raise ValueError('Not a rate: '+repr(text))
+    scale = {'': 1, 'K': 1000, 'M': 1000**2, 'G': 1000**3}[match.group(2)]
+    return int(float(match.group(1)) * scale)
+
+
+class TokenBucket:
+    '''Hands out bytes at rate per second, callers sleep when it runs dry'''
+    def __init__(self, rate=0, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = rate
+        self.tokens = 0.0
+        self.stamp = clock()
+        self._lock = Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate:
+            self.tokens = min(self.rate * BURST, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, count):
+        '''Take count bytes, waiting until the bucket can pay for them'''
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            # Taking on debt reserves the bytes, later callers wait behind it
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+class TransferLimit:
+    '''Limits of one transfer: its own bucket, then the global one'''
+    def __init__(self, limiter, clock=time.monotonic, sleep=time.sleep):
+        self.limiter = limiter
+        self.bucket = TokenBucket(0, clock, sleep)
+
+    def chunk(self, size):
+        '''Read size that keeps bursts short at low rates'''
+        rates = [rate for rate in (self.bucket.rate, self.limiter.bucket.rate) if rate]
+        if not rates:
+            return size
+        return max(MIN_CHUNK, min(size, min(rates) // 10))
+
+    def consume(self, count):
+        self.bucket.consume(count)
+        self.limiter.bucket.consume(count)
+
+
+class BandwidthLimiter:
+    '''Global and per-transfer caps that can be changed while transfers run'''
+    def __init__(self, rate=0, per_transfer=0, fair_share=False,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.bucket = TokenBucket(rate, clock, sleep)
+        self.per_transfer = per_transfer
+        self.fair_share = fair_share
+        self.limits = {} # transfer to TransferLimit
+        self._lock = Lock()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def set_limits(self, rate=None, per_transfer=None, fair_share=None):
+        '''Change limits, running transfers follow straight away'''
+        if rate is not None:
+            self.bucket.set_rate(rate)
+        if per_transfer is not None:
+            self.per_transfer = per_transfer
+        if fair_share is not None:
+            self.fair_share = fair_share
+        with self._lock:
+            self._share()
+
+    def register(self, transfer):
+        with self._lock:
+            limit = self.limits[transfer] = TransferLimit(self, self.clock, self.sleep)
+            self._share()
+            return limit
+
+    def unregister(self, transfer):
+        with self._lock:
+            if self.limits.pop(transfer, None) is not None:
+                self._share()
+
+    def _share(self):
+        '''Set the rate of every transfer bucket'''
+        rate = self.per_transfer
+        if self.fair_share and self.bucket.rate and self.limits:
+            share = self.bucket.rate // len(self.limits)
+            rate = min(rate, share) if rate else share
+        for limit in self.limits.values():
+            limit.bucket.set_rate(rate)
+
+
+# Shared by every transfer in the process unless one is passed in
+LIMITER = BandwidthLimiter()
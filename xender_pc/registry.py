@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Registry of transfers indexed by target path and source url, and the
+order they are listed in. Items only need path and url attributes
+'''
+
+
+class TransferRegistry:
+    '''Constant time lookup of transfers by path or url'''
+    def __init__(self):
+        self.by_path = {}
+        self.by_url = {}
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def __contains__(self, item):
+        return self.by_path.get(item.path) is item
+
+    def find_path(self, path):
+        return self.by_path.get(path)
+
+    def find_url(self, url):
+        return self.by_url.get(url)
+
+    def replace(self, item):
+        '''
+        Register item in place of any transfer to the same path
+        Returns the transfer it replaced or None
+        '''
+        old = self.by_path.get(item.path)
+        if old is not None and old is not item:
+            self.discard(old)
+        else:
+            old = None
+        self.by_path[item.path] = item
+        self.by_url[item.url] = item
+        return old
+
+    def discard(self, item):
+        '''Forget item, entries that now point to another transfer are kept'''
+        if self.by_path.get(item.path) is item:
+            del self.by_path[item.path]
+        if self.by_url.get(item.url) is item:
+            del self.by_url[item.url]
+
+    def clear(self):
+        self.by_path.clear()
+        self.by_url.clear()
+
+
+class Rows:
+    '''
+    Items in the order they were added, in slots that are never renumbered
+    A Fenwick tree counts the items left in the slots, so the row of an
+    item, the item of a row, adding and removing all take O(log n)
+    '''
+    def __init__(self):
+        self.slots = [] # Items in the order added, None where one was removed
+        self.slot = {} # Item to its slot
+        self.tree = [0] # Fenwick tree of items per slot, from index 1
+
+    def __len__(self):
+        return len(self.slot)
+
+    def __iter__(self):
+        return iter([item for item in self.slots if item is not None])
+
+    def __contains__(self, item):
+        return item in self.slot
+
+    def _count(self, end):
+        '''Items in the first end slots'''
+        total = 0
+        tree = self.tree
+        while end:
+            total += tree[end]
+            end &= end - 1
+        return total
+
+    def _add(self, index, value):
+        tree = self.tree
+        while index < len(tree):
+            tree[index] += value
+            index += index & -index
+
+    def __getitem__(self, row):
+        '''Item of row, found by walking down the tree'''
+        if not 0 <= row < len(self.slot):
+            raise IndexError('row out of range')
+        tree = self.tree
+        index = 0
+        left = row + 1
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            following = index + step
+            if following < len(tree) and tree[following] < left:
+                index = following
+                left -= tree[following]
+            step >>= 1
+        return self.slots[index]
+
+    def row(self, item):
+        '''Row of item or None'''
+        slot = self.slot.get(item)
+        if slot is None:
+            return None
+        return self._count(slot + 1) - 1
+
+    def append(self, item):
+        '''Add item as the last row, returns its row'''
+        index = len(self.tree)
+        # The new node covers the slots after index minus its low bit
+        self.tree.append(1 + self._count(index - 1) - self._count(index - (index & -index)))
+        self.slot[item] = len(self.slots)
+        self.slots.append(item)
+        return len(self.slot) - 1
+
+    def pop(self, row):
+        '''Remove and return the item of row'''
+        item = self[row]
+        self.remove(item)
+        return item
+
+    def remove(self, item):
+        '''Remove item, returns the row it had or None'''
+        slot = self.slot.pop(item, None)
+        if slot is None:
+            return None
+        row = self._count(slot + 1) - 1
+        self.slots[slot] = None
+        self._add(slot + 1, -1)
+        if len(self.slots) > 64 and len(self.slot) * 2 < len(self.slots):
+            self._compact()
+        return row
+
+    def _compact(self):
+        '''Drop the empty slots once they are most of them, O(n) now and then'''
+        self.slots = [item for item in self.slots if item is not None]
+        self.slot = {item: slot for slot, item in enumerate(self.slots)}
+        tree = self.tree = [0] + [1] * len(self.slots)
+        for index in range(1, len(tree)):
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+
+    def clear(self):
+        self.slots = []
+        self.slot = {}
+        self.tree = [0]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File listing of the phone's server
+A listing page may be JSON (a list of objects with a url or path and
+optionally size and mtime) or HTML whose links point at files and folders
+'''
+
+import os
+import json
+import posixpath
+
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, unquote
+
+from .pool import POOL
+
+LISTING_PATH = '/' # Page of the phone's server that lists shared files
+MAX_PAGES = 1000 # Folders followed in one listing
+
+RemoteFile = namedtuple('RemoteFile', 'url path size mtime')
+
+
+class _Links(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+
+def fetch(url, pool=POOL):
+    '''Body and content type of url'''
+    with pool.open(url) as resp:
+        body = resp.read()
+        if resp.status != 200:
+            raise ConnectionError('Server answered '+str(resp.status))
+        return body, resp.getheader('Content-Type', '')
+
+
+def parse_json(body, page_url):
+    '''RemoteFiles of a JSON listing'''
+    data = json.loads(body.decode('utf-8'))
+    if isinstance(data, dict):
+        data = data.get('files', [])
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        link = entry.get('url') or entry.get('path')
+        if not link:
+            continue
+        url = urljoin(page_url, link)
+        yield RemoteFile(url, unquote(urlsplit(url).path),
+                         int(entry.get('size', -1)), float(entry.get('mtime', 0)))
+
+
+def parse_html(body, page_url):
+    '''Links of a HTML listing on the same server, split into files and folders'''
+    parser = _Links()
+    parser.feed(body.decode('utf-8', 'replace'))
+    host = urlsplit(page_url).netloc
+    page_path = urlsplit(page_url).path
+    files, folders = [], []
+    for link in parser.links:
+        url = urljoin(page_url, link).split('#')[0]
+        parts = urlsplit(url)
+        if parts.netloc != host or not parts.path.startswith(page_path):
+            continue # Other sites and parent folders
+        if parts.path == page_path:
+            continue
+        if parts.path.endswith('/'):
+            folders.append(url)
+        else:
+            files.append(RemoteFile(url, unquote(parts.path), -1, 0))
+    return files, folders
+
+
+def list_files(base_url, listing_path=LISTING_PATH):
+    '''Generate every RemoteFile shared by the phone'''
+    pages = [urljoin(base_url, listing_path)]
+    seen = set(pages)
+    while pages and len(seen) <= MAX_PAGES:
+        page = pages.pop(0)
+        body, content_type = fetch(page)
+        if 'json' in content_type or body.lstrip()[:1] in (b'[', b'{'):
+            for remote in parse_json(body, page):
+                yield remote
+            continue
+        files, folders = parse_html(body, page)
+        for remote in files:
+            yield remote
+        for folder in folders:
+            if folder not in seen:
+                seen.add(folder)
+                pages.append(folder)
+
+
+def local_path(dest, remote_path):
+    '''Where a remote file is saved under dest, never outside it'''
+    parts = [part for part in posixpath.normpath('/'+remote_path).split('/')
+             if part not in ('', '.', '..')]
+    if not parts:
+        raise ValueError('No file name in '+repr(remote_path))
+    return os.path.join(dest, *parts)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Limits how many transfers run at once
+Waiting transfers are started by priority, then smallest first, then in
+the order they arrived so many small files finish early
+'''
+
+import heapq
+import itertools
+
+MAX_ACTIVE = 3 # Transfers running at the same time
+UNKNOWN_SIZE = float('inf') # Files of unknown size go after known ones
+
+
+class TransferScheduler:
+    '''
+    Queue in front of transfer start
+    start(item) is called when item may begin, done(item) frees its slot
+    '''
+    def __init__(self, start, max_active=MAX_ACTIVE, small_first=True):
+        self.start = start
+        self.max_active = max_active
+        self.small_first = small_first
+        self.active = set()
+        self._queue = [] # (priority, size, order, item)
+        self._queued = set()
+        self._order = itertools.count()
+
+    def __len__(self):
+        '''Number of waiting transfers'''
+        return len(self._queued)
+
+    def queued(self, item):
+        return item in self._queued
+
+    def submit(self, item, size=-1, priority=0):
+        '''
+        Add item to the queue, lower priority values go first
+        Returns True if item was started straight away
+        '''
+        key = 0
+        if self.small_first:
+            key = size if size >= 0 else UNKNOWN_SIZE
+        heapq.heappush(self._queue, (priority, key, next(self._order), item))
+        self._queued.add(item)
+        self._fill()
+        return item in self.active
+
+    def start_now(self, item):
+        '''Start a waiting item without waiting for a free slot'''
+        if item in self._queued:
+            self._queued.discard(item)
+            self.active.add(item)
+            self.start(item)
+
+    def done(self, item):
+        '''item stopped running, start the next ones'''
+        if item in self.active:
+            self.active.discard(item)
+            self._fill()
+
+    def discard(self, item):
+        '''Forget item whether it is waiting or running'''
+        self._queued.discard(item) # Left in the heap and skipped when popped
+        self.done(item)
+
+    def set_limit(self, max_active):
+        self.max_active = max(1, max_active)
+        self._fill()
+
+    def clear(self):
+        self.active.clear()
+        self._queue.clear()
+        self._queued.clear()
+
+    def _fill(self):
+        while len(self.active) < self.max_active and self._queue:
+            item = heapq.heappop(self._queue)[3]
+            if item not in self._queued:
+                continue # Discarded while waiting
+            self._queued.discard(item)
+            self.active.add(item)
+            self.start(item)
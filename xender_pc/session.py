@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Transfers with several phones at once
+Each phone is a Session with its own server url and scheduler. Sessions
+share the process, the connection pool and the bandwidth limiter, and
+all their state changes are handled on the one thread that calls wait()
+'''
+
+import time
+
+from queue import Queue, Empty
+from threading import Thread, Lock
+from urllib.parse import urlsplit
+
+from .pool import POOL
+from .scheduler import MAX_ACTIVE, TransferScheduler
+
+ENDED = ('finished', 'cancelled', 'failed', 'corrupt')
+
+
+class Session:
+    '''One phone: its server, its scheduler and what it transferred'''
+    def __init__(self, url, name=None, max_active=MAX_ACTIVE, clock=time.monotonic):
+        self.url = url
+        self.name = name or urlsplit(url).netloc.replace(':', '_')
+        self.scheduler = TransferScheduler(lambda transfer: transfer.start(), max_active)
+        self.clock = clock
+        self.feeding = 0 # Listings still adding transfers
+        self.started = clock()
+        self.ended = None # When the last transfer stopped
+        self.bytes_total = 0 # Bytes of finished transfers
+        self.finished = 0
+        self.failed = 0
+
+    def busy(self):
+        return bool(self.feeding or self.scheduler.active or len(self.scheduler))
+
+    def done(self, transfer, state):
+        self.scheduler.done(transfer)
+        if state == 'finished':
+            self.finished += 1
+            self.bytes_total += max(0, transfer.bytes_total)
+        else:
+            self.failed += 1
+        if not self.busy():
+            self.ended = self.clock()
+
+    def throughput(self):
+        '''Bytes per second of finished transfers since the session started'''
+        elapsed = (self.ended or self.clock()) - self.started
+        return self.bytes_total / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        '''Suspend running transfers and drop waiting ones'''
+        for transfer in list(self.scheduler.active):
+            transfer.suspend()
+        self.scheduler.clear()
+
+
+class SessionManager:
+    '''
+    Sessions by server url, driven by one event queue
+    Sessions and their schedulers are only changed on the thread running
+    wait(), add() and drop() may be called from any thread and take effect
+    there. on_end(session, transfer, state) is called on that thread too
+    '''
+    def __init__(self, max_active=MAX_ACTIVE, on_end=None, pool=POOL):
+        self.max_active = max_active
+        self.on_end = on_end
+        self.pool = pool
+        self.sessions = {} # url to Session, owned by the thread running wait()
+        self.events = Queue() # (kind, session, transfer, value) from any thread
+        self._added = {} # url to Session added and not dropped, so add() gives one per url
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+
+    def add(self, url, name=None):
+        '''Session of url, made when it is new'''
+        with self._lock:
+            session = self._added.get(url)
+            if session is None:
+                session = self._added[url] = Session(url, name, self.max_active)
+                self.events.put(('add', session, None, None))
+        return session
+
+    def drop(self, url):
+        '''Stop the session of url, the others carry on'''
+        with self._lock:
+            session = self._added.pop(url, None)
+        if session is not None:
+            self.events.put(('drop', session, None, None))
+        return session
+
+    def submit(self, session, transfer, size=-1):
+        '''Queue transfer in session, may be called from any thread'''
+        transfer.on_state = lambda state: self.events.put(('state', session, transfer, state))
+        self.events.put(('submit', session, transfer, size))
+
+    def feed(self, session, transfers):
+        '''Submit the (transfer, size) pairs of an iterable on a thread of its own'''
+        self.events.put(('feed', session, None, None))
+        def run():
+            try:
+                for transfer, size in transfers:
+                    self.submit(session, transfer, size)
+            except (OSError, ValueError) as e:
+                self.events.put(('failed', session, None, e))
+            finally:
+                self.events.put(('fed', session, None, None))
+        Thread(target=run, daemon=True).start()
+
+    def busy(self):
+        return any(session.busy() for session in self.sessions.values())
+
+    def wait(self, tick=None, interval=1.0):
+        '''Handle events until every session is idle, tick() runs at least every interval'''
+        while self.busy() or not self.events.empty():
+            try:
+                kind, session, transfer, value = self.events.get(timeout=interval)
+            except Empty:
+                kind = None
+            if tick:
+                tick()
+            if kind == 'add':
+                self.sessions[session.url] = session
+                continue
+            if kind is None or self.sessions.get(session.url) is not session:
+                continue # Dropped sessions are ignored
+            if kind == 'drop':
+                del self.sessions[session.url]
+                session.stop()
+                self.pool.clear(session.url)
+            elif kind == 'feed':
+                session.feeding += 1
+            elif kind == 'submit':
+                session.scheduler.submit(transfer, value)
+            elif kind == 'state' and value in ENDED:
+                session.done(transfer, value)
+                if self.on_end:
+                    self.on_end(session, transfer, value)
+            elif kind == 'fed':
+                session.feeding -= 1
+            elif kind == 'failed':
+                session.failed += 1
+                print('Listing of', session.name, 'failed:', value)
+
+    def stop(self):
+        '''Stop every session, also those added since wait() last ran'''
+        with self._lock:
+            sessions = set(self._added.values())
+        for session in sessions.union(self.sessions.values()):
+            session.stop()
+
+
+def fairness(rates):
+    '''Jain's index of rates, 1.0 when every session got the same'''
+    rates = list(rates)
+    if not rates or not any(rates):
+        return 1.0
+    return sum(rates) ** 2 / (len(rates) * sum(rate * rate for rate in rates))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Writing downloads to disk
+A download is written to path.part, preallocated at its final size, and
+renamed to path only once it is complete. Each segment collects what it
+receives into a buffer that is written at aligned offsets, so the disk
+sees few large writes instead of many small ones
+'''
+
+import os
+import re
+
+from threading import Lock
+
+BUFFER_SIZE = 1024 * 1024 # Bytes a segment collects before writing
+ALIGNMENT = 1024 * 1024 # Segments start on multiples of this
+FSYNC = 'end' # 'never', 'end' to sync before the rename or 'always' after each write
+FSYNC_POLICIES = ('never', 'end', 'always')
+PART_SUFFIX = '.part'
+UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+
+def parse_size(text):
+    '''
+    Bytes from text like 256K, 4M or 1.5G, in powers of 1024
+    Sizes over ALIGNMENT are rounded up to a multiple of it so writes
+    stay lined up with the segments
+    '''
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)(?:I?B)?\s*', text.upper())
+    if not match:
+        raise ValueError('Not a size: '+repr(text))
+    size = int(float(match.group(1)) * UNITS[match.group(2)])
+    if size <= 0:
+        raise ValueError('Size must be positive: '+repr(text))
+    if size > ALIGNMENT:
+        size = -(-size // ALIGNMENT) * ALIGNMENT
+    return size
+
+
+def preallocate(fd, size):
+    '''Reserve size bytes, in one extent where the filesystem can'''
+    if size <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass # Not supported by the filesystem
+    os.ftruncate(fd, size)
+
+
+class WriteBuffer:
+    '''
+    Collects the data of one segment and writes it in buffer_size pieces
+    on_write(offset, data) is called once data has reached the file
+    '''
+    __slots__ = ('writer', 'start', 'data', 'limit', 'on_write')
+
+    def __init__(self, writer, start, on_write=None):
+        self.writer = writer
+        self.start = start # File offset of the first byte in data
+        self.data = bytearray()
+        self.on_write = on_write
+        self.limit = self._boundary()
+
+    def _boundary(self):
+        '''Writes end on multiples of the buffer size once the first one lines up'''
+        size = self.writer.buffer_size
+        return (self.start // size + 1) * size
+
+    def add(self, data):
+        self.data += data
+        if self.start + len(self.data) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if not self.data:
+            return
+        data = self.data
+        self.writer.write(self.start, data)
+        self.data = bytearray()
+        if self.on_write:
+            self.on_write(self.start, data)
+        self.start += len(data)
+        self.limit = self._boundary()
+
+
+class FileWriter:
+    '''
+    Positional writes to path.part from any number of segment threads
+    finalize() renames it to path, discard() removes it
+    '''
+    def __init__(self, path, size=-1, buffer_size=BUFFER_SIZE, fsync=FSYNC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: '+repr(fsync))
+        self.path = path
+        self.part = path + PART_SUFFIX
+        self.size = size
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.fd = None
+        self._lock = Lock() # Guards seek and write where pwrite is missing
+
+    def exists(self):
+        return os.path.isfile(self.part)
+
+    def create(self):
+        '''Start a new part file at its final size'''
+        self._open(os.O_CREAT | os.O_TRUNC)
+        preallocate(self.fd, self.size)
+
+    def open(self):
+        '''Open the part file left by an earlier attempt'''
+        self._open(0)
+
+    def _open(self, flags):
+        self.close()
+        self.fd = os.open(self.part, os.O_RDWR | getattr(os, 'O_BINARY', 0) | flags, 0o666)
+
+    def buffer(self, start, on_write=None):
+        return WriteBuffer(self, start, on_write)
+
+    def write(self, offset, data):
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self._lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self.fd, view):]
+        if self.fsync == 'always':
+            os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def finalize(self):
+        '''Make the finished file visible under its name'''
+        if self.fsync != 'never' and self.fd is not None:
+            os.fsync(self.fd)
+        self.close()
+        os.replace(self.part, self.path)
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.part)
+        except OSError:
+            pass
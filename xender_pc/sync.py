@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Index of files already pulled from the phone
+Rows are keyed by the local folder and the path on the phone, the server
+address is left out because it changes between hotspots. The phone's
+listing is compared against the index in batches as it streams in, so
+only new or changed files are queued and memory stays flat
+'''
+
+import os
+import time
+import sqlite3
+
+from itertools import islice
+
+INDEX_PATH = os.path.join(os.path.expanduser('~'), '.xender-for-pc', 'sync.sqlite')
+BATCH = 500 # Listing entries looked up and rows written per statement
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    dest TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT,
+    local TEXT NOT NULL,
+    synced REAL NOT NULL,
+    PRIMARY KEY (dest, path)
+) WITHOUT ROWID
+'''
+# move() finds rows by the saved file, after sorting that is every row
+LOCAL_INDEX = 'CREATE INDEX IF NOT EXISTS files_local ON files (local)'
+
+
+def unchanged(remote, row, check_local=True):
+    '''
+    remote matches the indexed row, sizes and times the listing does
+    not give are taken as equal. With check_local the saved file must
+    still be there at its size
+    '''
+    size, mtime, local = row
+    if remote.size >= 0 and remote.size != size:
+        return False
+    if remote.mtime and remote.mtime != mtime:
+        return False
+    if check_local:
+        try:
+            return os.path.getsize(local) == size
+        except OSError:
+            return False
+    return True
+
+
+class SyncIndex:
+    '''SQLite table of pulled files, used from the thread that opened it'''
+    def __init__(self, path=INDEX_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        # The write ahead log lets another window or command read while this writes
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(SCHEMA)
+        self.db.execute(LOCAL_INDEX)
+        self.pending = [] # Rows not yet written
+        self.skipped = 0 # Unchanged files left out by changes()
+
+    def lookup(self, dest, paths):
+        '''Dict of path to (size, mtime, local) for the indexed paths'''
+        dest = os.path.abspath(dest)
+        rows = {}
+        for i in range(0, len(paths), BATCH):
+            batch = paths[i:i+BATCH]
+            query = ('SELECT path, size, mtime, local FROM files WHERE dest = ? AND path IN (%s)'
+                     % ','.join('?' * len(batch)))
+            for path, size, mtime, local in self.db.execute(query, [dest]+batch):
+                rows[path] = size, mtime, local
+        return rows
+
+    def changes(self, dest, remotes, check_local=True):
+        '''Generate the RemoteFiles that are new or changed since they were pulled to dest'''
+        remotes = iter(remotes)
+        while True:
+            batch = list(islice(remotes, BATCH))
+            if not batch:
+                return
+            rows = self.lookup(dest, [remote.path for remote in batch])
+            for remote in batch:
+                row = rows.get(remote.path)
+                if row is not None and unchanged(remote, row, check_local):
+                    self.skipped += 1
+                else:
+                    yield remote
+
+    def record(self, dest, remote, local, size, digest=None):
+        '''Remember that remote was saved to local, written in batches'''
+        self.pending.append((os.path.abspath(dest), remote.path, size, remote.mtime,
+                             digest, os.path.abspath(local), time.time()))
+        if len(self.pending) >= BATCH:
+            self.commit()
+
+    def commit(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)',
+                                    self.pending)
+            self.pending = []
+
+    def move(self, local, new_local):
+        '''A pulled file was moved, like into a dated folder, keep it counted as pulled'''
+        self.commit()
+        with self.db:
+            self.db.execute('UPDATE files SET local = ? WHERE local = ?',
+                            (os.path.abspath(new_local), os.path.abspath(local)))
+
+    def forget(self, dest, path=None):
+        '''Drop one file or, without path, everything pulled to dest'''
+        dest = os.path.abspath(dest)
+        with self.db:
+            if path is None:
+                self.db.execute('DELETE FROM files WHERE dest = ?', (dest,))
+            else:
+                self.db.execute('DELETE FROM files WHERE dest = ? AND path = ?', (dest, path))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        self.commit()
+        self.db.close()
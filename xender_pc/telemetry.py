@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Transfer rate, ETA and session throughput
+Every transfer keeps a small ring of (time, bytes) samples so a progress
+event costs the same however long the transfer or session runs.
+Snapshots can be written as JSON lines or served as Prometheus text
+'''
+
+import json
+import time
+
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .progress import get_size
+
+SAMPLES = 32 # Samples kept per transfer
+SMOOTHING = 0.3 # Weight of the newest rate in the moving average
+MIN_SPAN = 0.5 # Seconds of samples needed before a rate is given
+STALL = 5.0 # Seconds without progress before a transfer counts as stalled
+
+
+class RateMeter:
+    '''Rate over the last SAMPLES progress samples'''
+    __slots__ = ('times', 'counts', 'index', 'filled', 'rate', 'received', 'total')
+
+    def __init__(self, size=SAMPLES):
+        self.times = [0.0] * size
+        self.counts = [0] * size
+        self.index = 0 # Slot of the next sample
+        self.filled = 0
+        self.rate = 0.0 # Smoothed bytes per second
+        self.received = 0
+        self.total = -1
+
+    def add(self, now, received, total=-1):
+        '''
+        Record a sample, returns the bytes added since the last one
+        The first sample is where the transfer starts, a resumed one has
+        bytes from before that were not moved now
+        '''
+        size = len(self.times)
+        delta = received - self.received if self.filled else 0
+        self.received = received
+        self.total = total
+        self.times[self.index] = now
+        self.counts[self.index] = received
+        self.index = (self.index + 1) % size
+        self.filled = min(self.filled + 1, size)
+        # The oldest sample sits where the next one will go once the ring is full
+        oldest = self.index if self.filled == size else 0
+        span = now - self.times[oldest]
+        if span >= MIN_SPAN:
+            window = (received - self.counts[oldest]) / span
+            self.rate = window if not self.rate else (
+                SMOOTHING * window + (1 - SMOOTHING) * self.rate)
+        return delta
+
+    def stalled(self, now, after=STALL):
+        '''No progress for after seconds'''
+        if not self.filled:
+            return False
+        return now - self.times[self.index-1] >= after
+
+    def eta(self):
+        '''Seconds left or None when it cannot be told'''
+        if self.total <= 0 or self.rate <= 0:
+            return None
+        return max(0.0, (self.total - self.received) / self.rate)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return ''
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
+
+def format_rate(meter):
+    '''Rate and time left of a meter for the download list'''
+    if not meter.rate:
+        return ''
+    text = get_size(int(meter.rate))+'/s'
+    eta = meter.eta()
+    if eta is not None:
+        text += ', '+format_eta(eta)+' left'
+    return text
+
+
+class Telemetry:
+    '''Meters of every active transfer and the totals of the session'''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.meters = {} # key to RateMeter
+        self.names = {} # key to the name used in snapshots
+        self.session = RateMeter() # Bytes of all transfers together
+        self.bytes_total = 0 # Bytes moved this session
+        self.completed = 0
+        self._lock = Lock()
+
+    def record(self, key, received, total=-1, name=''):
+        '''Progress event of key, returns its meter'''
+        now = self.clock()
+        with self._lock:
+            meter = self.meters.get(key)
+            if meter is None:
+                meter = self.meters[key] = RateMeter()
+                self.names[key] = name
+            delta = meter.add(now, received, total)
+            if delta > 0:
+                self.bytes_total += delta
+            self.session.add(now, self.bytes_total)
+            return meter
+
+    def end(self, key, completed=False):
+        '''key stopped, it no longer counts as active'''
+        with self._lock:
+            if self.meters.pop(key, None) is not None and completed:
+                self.completed += 1
+            self.names.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.meters.clear()
+            self.names.clear()
+
+    def active(self):
+        return len(self.meters)
+
+    def throughput(self):
+        '''Session bytes per second, idle once nothing is active'''
+        return self.session.rate if self.meters else 0.0
+
+    def snapshot(self):
+        '''Dict of the current totals and per transfer rates'''
+        now = self.clock()
+        with self._lock:
+            return {'time': time.time(),
+                    'active': len(self.meters),
+                    'completed': self.completed,
+                    'bytes_total': self.bytes_total,
+                    'throughput': self.throughput(),
+                    'transfers': [{'name': self.names.get(key, ''),
+                                   'received': meter.received,
+                                   'total': meter.total,
+                                   'rate': meter.rate,
+                                   'eta': meter.eta(),
+                                   'stalled': meter.stalled(now)}
+                                  for key, meter in self.meters.items()],
+                    }
+
+    def write_jsonl(self, path):
+        '''Append a snapshot to a JSON lines file'''
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot())+'\n')
+
+    def prometheus(self):
+        '''Snapshot in the Prometheus text format'''
+        snap = self.snapshot()
+        lines = ['# TYPE xender_active_transfers gauge',
+                 'xender_active_transfers %d' % snap['active'],
+                 '# TYPE xender_completed_transfers_total counter',
+                 'xender_completed_transfers_total %d' % snap['completed'],
+                 '# TYPE xender_bytes_total counter',
+                 'xender_bytes_total %d' % snap['bytes_total'],
+                 '# TYPE xender_throughput_bytes_per_second gauge',
+                 'xender_throughput_bytes_per_second %.1f' % snap['throughput'],
+                 '# TYPE xender_stalled_transfers gauge',
+                 'xender_stalled_transfers %d' % sum(1 for transfer in snap['transfers']
+                                                     if transfer['stalled']),
+                 ]
+        return '\n'.join(lines)+'\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        '''Serve /metrics on a background thread, returns the server'''
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = telemetry.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/snapshot':
+                    body = json.dumps(telemetry.snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
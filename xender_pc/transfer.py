@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Native download engine for transfers from the phone's server
+Large files are split into HTTP Range segments which are fetched
+over several pooled connections into a preallocated part file.
+Progress is journaled so interrupted transfers resume with Range requests,
+and the file is hashed as it is written to verify it on completion
+'''
+
+import re
+import http.client
+
+from collections import deque
+from threading import Thread, Lock, Event
+from urllib.parse import urlsplit
+
+from .pool import POOL
+from .journal import JOURNAL_DIR, Journal
+from .integrity import DEFAULT_ALGORITHM, StreamHasher, expected_digest
+from .ratelimit import LIMITER
+from .storage import ALIGNMENT, FileWriter
+
+CHUNK_SIZE = 256 * 1024 # Bytes read from a connection at a time
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024 # Files smaller than this use one connection
+MAX_SEGMENT_SIZE = 16 * 1024 * 1024 # Keeps data arriving near the hash position
+CONNECTIONS = 4 # Parallel connections for a large file
+RETRIES = 3 # Attempts per segment before the transfer fails
+
+
+class RangeIgnored(ConnectionError):
+    '''The server answered a Range request with something other than that range'''
+
+
+def probe(url, pool=POOL):
+    '''
+    Ask the server for the first byte of url
+    Returns the size, range support and validators of the file
+    '''
+    with pool.open(url, {'Range': 'bytes=0-0'}) as resp:
+        resp.read()
+        if resp.status not in (200, 206, 416):
+            raise ConnectionError('Server answered '+str(resp.status))
+        size = -1
+        ranges = False
+        if resp.status == 416:
+            size = 0 # Not even byte 0 is there, the file is empty
+        elif resp.status == 206:
+            match = re.match(r'bytes\s+\d+-\d+/(\d+)', resp.getheader('Content-Range', ''))
+            if match:
+                size = int(match.group(1))
+                ranges = True
+        elif resp.getheader('Content-Length'):
+            size = int(resp.getheader('Content-Length'))
+        return {'size': size,
+                'ranges': ranges,
+                'etag': resp.getheader('ETag', ''),
+                'last_modified': resp.getheader('Last-Modified', ''),
+                'digest': expected_digest(resp.headers),
+                }
+
+
+def split_segments(size, connections=CONNECTIONS, min_segment=MIN_SEGMENT_SIZE,
+                   max_segment=MAX_SEGMENT_SIZE, alignment=ALIGNMENT):
+    '''
+    Split size bytes into [start, end) ranges in file order
+    There is at least one per connection when the file is large enough to
+    share, and none much longer than max_segment so the connections work
+    close together and the hasher reads little back
+    '''
+    count = max(1, min(connections, size // min_segment))
+    if count > 1:
+        count = max(count, -(-size // max_segment))
+    step = max(1, -(-size // count))
+    if count > 1 and step >= alignment:
+        step += -step % alignment # Keeps the writes of every segment aligned
+    return [[start, min(size, start+step)] for start in range(0, size, step)] or [[0, size]]
+
+
+class Segment:
+    '''One byte range of a download and how much of it is on disk'''
+    __slots__ = ('start', 'end', 'offset')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end # -1 when the size is unknown
+        self.offset = start
+
+    def done(self):
+        return self.end != -1 and self.offset >= self.end
+
+
+class SegmentedDownload:
+    '''
+    Downloads url to path over one or more connections
+    on_progress(bytes_received, bytes_total) and on_state(state) are called
+    from worker threads. States match the download list:
+    inprogress, paused, finished, cancelled, failed and corrupt.
+    After finishing, verification is 'verified' when the server's digest
+    matched, 'size' when only the size could be checked and 'unchecked'
+    when the server sent neither.
+    storage(path, size) makes the writer, FileWriter unless given, and
+    hashing(path, algorithm) the hasher, StreamHasher unless given
+    '''
+    def __init__(self, url, path, connections=CONNECTIONS,
+                 on_progress=None, on_state=None, journal_dir=JOURNAL_DIR, limiter=None, pool=None,
+                 storage=FileWriter, hashing=StreamHasher):
+        self.url = url
+        self.path = path
+        self.connections = connections
+        self.journal_dir = journal_dir
+        self.journal = None
+        self.limiter = limiter or LIMITER
+        self.pool = pool or POOL
+        self.storage = storage
+        self.hashing = hashing
+        self.writer = None
+        self.limit = None # TransferLimit while running
+        self.on_progress = on_progress
+        self.on_state = on_state
+
+        self.state = 'waiting'
+        self.bytes_received = 0
+        self.bytes_total = -1
+        self.segments = []
+        self.info = {}
+        self.hasher = None
+        self.digest = None # (algorithm, hex) of the finished file
+        self.verification = None
+        self._lock = Lock()
+        self._running = Event() # Cleared while paused
+        self._running.set()
+        self._stop = None # 'cancel' or 'suspend'
+        self._error = None
+
+    def start(self):
+        '''Start the transfer in a background thread'''
+        Thread(target=self._run, daemon=True).start()
+
+    def pause(self):
+        if self.state == 'inprogress':
+            self._running.clear()
+            self._set_state('paused')
+
+    def resume(self):
+        if self.state == 'paused':
+            self._set_state('inprogress')
+            self._running.set()
+
+    def cancel(self):
+        '''Stop the transfer and discard the part file'''
+        if self.state in ('waiting', 'inprogress', 'paused'):
+            self._stop = 'cancel'
+            self._running.set()
+
+    def suspend(self):
+        '''Stop the transfer quietly, keeping the journal to resume later'''
+        if self.state in ('waiting', 'inprogress', 'paused'):
+            self._stop = 'suspend'
+            self._running.set()
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state:
+            self.on_state(state)
+
+    def _progress(self, count):
+        with self._lock:
+            self.bytes_received += count
+            received = self.bytes_received
+        if self.on_progress:
+            self.on_progress(received, self.bytes_total)
+
+    def _plan(self):
+        '''Probe the server and lay out segments and the target file'''
+        info = self.info = probe(self.url, self.pool)
+        self.bytes_total = info['size']
+        writer = self.writer = self.storage(self.path, self.bytes_total)
+        if not info['ranges'] or self.bytes_total <= 0:
+            # Nothing to split or resume, one stream from the start
+            self.segments = [Segment(0, self.bytes_total)]
+            writer.create()
+            return
+
+        journal = Journal.find(self.path, self.journal_dir)
+        if journal and journal.matches(info) and writer.exists():
+            writer.open()
+            missing = journal.missing()
+            self.bytes_received = self.bytes_total - sum(end-start for start, end in missing)
+        else:
+            if journal:
+                journal.remove()
+            writer.create()
+            journal = Journal.create({'url': self.url,
+                                      'host': urlsplit(self.url).hostname,
+                                      'path': self.path,
+                                      'size': self.bytes_total,
+                                      'etag': info['etag'],
+                                      'last_modified': info['last_modified'],
+                                      }, self.journal_dir)
+            missing = [[0, self.bytes_total]]
+        self.journal = journal
+
+        # The connections take the segments of the ranges still missing in file order
+        self.segments = [Segment(gap_start+start, gap_start+end)
+                         for gap_start, gap_end in missing
+                         for start, end in split_segments(gap_end-gap_start, self.connections)]
+        if self.on_progress:
+            # Where it starts, so meters count only what is fetched from here
+            self.on_progress(self.bytes_received, self.bytes_total)
+
+    def _run(self):
+        self._set_state('inprogress')
+        try:
+            self._plan()
+        except (OSError, http.client.HTTPException) as e:
+            if self.writer:
+                self.writer.close()
+            print('Download Failed:', e)
+            self._set_state('failed')
+            return
+        self.transfer()
+
+    def transfer(self):
+        '''Fetch every unfinished segment and wait for all of them'''
+        self.limit = self.limiter.register(self)
+        self._fetch_all()
+        if isinstance(self._error, RangeIgnored) and self._stop is None:
+            # Range worked for the probe only, start over as one stream
+            self._single_stream()
+            self._fetch_all()
+        self.limiter.unregister(self)
+
+        if self._stop is not None or self._error is not None:
+            self.hasher.close()
+
+        if self._stop == 'suspend':
+            if self.journal:
+                self.journal.close()
+            self.writer.close()
+            self.state = 'suspended'
+        elif self._stop == 'cancel':
+            if self.journal:
+                self.journal.remove()
+            self.writer.discard()
+            self._set_state('cancelled')
+        elif self._error is not None:
+            # The journal and part file stay so a retry can resume
+            if self.journal:
+                self.journal.close()
+            self.writer.close()
+            print('Download Failed:', self._error)
+            self._set_state('failed')
+        else:
+            if self.journal:
+                self.journal.remove()
+            self._verify()
+
+    def _fetch_all(self):
+        expected = self.info.get('digest')
+        self.hasher = self.hashing(self.writer.part,
+                                   expected[0] if expected else DEFAULT_ALGORITHM)
+        unfinished = [segment for segment in self.segments if not segment.done()]
+        if len(unfinished) == 1:
+            # Small files are fetched on this thread, a thread start costs more than they do
+            self._fetch(unfinished[0])
+        else:
+            pending = deque(unfinished)
+            workers = [Thread(target=self._work, args=(pending,), daemon=True)
+                       for i in range(min(self.connections, len(unfinished)))]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+    def _single_stream(self):
+        '''Drop what the segments wrote and fetch the file from the start'''
+        print('Server ignored Range, downloading in one stream:', self.url)
+        self.hasher.close()
+        if self.journal:
+            self.journal.remove()
+            self.journal = None
+        self.info['ranges'] = False
+        self.writer.create()
+        self._progress(-self.bytes_received)
+        self.segments = [Segment(0, self.bytes_total)]
+        self._error = None
+
+    def _verify(self):
+        '''
+        Compare the bytes written with the size and the server's digest,
+        only a file that passes is renamed to its final name
+        The part file was preallocated, so its own size tells nothing
+        '''
+        size = self.bytes_received
+        if self.bytes_total >= 0 and size != self.bytes_total:
+            self.hasher.close()
+            self.verification = 'corrupt'
+        else:
+            self.digest = (self.hasher.algorithm, self.hasher.finish(size))
+            expected = self.info.get('digest')
+            if expected and expected != self.digest:
+                self.verification = 'corrupt'
+            elif expected:
+                self.verification = 'verified'
+            else:
+                self.verification = 'size' if self.bytes_total >= 0 else 'unchecked'
+        if self.verification == 'corrupt':
+            # The part file is kept for a look, a retry starts it over
+            self.writer.close()
+            print('Download Corrupt:', self.path)
+            self._set_state('corrupt')
+            return
+        try:
+            self.writer.finalize()
+        except OSError as e:
+            print('Download Failed:', e)
+            self._set_state('failed')
+            return
+        self._set_state('finished')
+
+    def _work(self, pending):
+        '''Worker: fetch the next segment in file order until none are left'''
+        while self._stop is None and self._error is None:
+            try:
+                segment = pending.popleft()
+            except IndexError:
+                return
+            self._fetch(segment)
+
+    def _fetch(self, segment):
+        '''Worker: download one segment, retrying from where it stopped'''
+        attempts = 0
+        while not segment.done() and self._stop is None and self._error is None:
+            self._running.wait()
+            if self._stop is not None:
+                return
+            try:
+                self._fetch_once(segment)
+                if segment.end == -1: # Unknown size ends with the stream
+                    return
+            except RangeIgnored as e:
+                self._error = e # Retrying gets the same answer
+                return
+            except (OSError, http.client.HTTPException) as e:
+                attempts += 1
+                # Only range capable servers can continue a segment
+                if attempts >= RETRIES or (segment.offset > segment.start
+                                          and not self.info.get('ranges')):
+                    self._error = e
+                    return
+
+    def _fetch_once(self, segment):
+        headers = {}
+        if self.info.get('ranges'):
+            headers['Range'] = 'bytes=%d-%d' % (segment.offset, segment.end-1)
+        # The connection is kept for the next request once the body was read to the end
+        with self.pool.open(self.url, headers) as resp:
+            if resp.status not in (200, 206):
+                raise ConnectionError('Server answered '+str(resp.status))
+            if headers:
+                # A 200 or another range would put the wrong bytes at this offset
+                match = re.match(r'bytes\s+(\d+)-', resp.getheader('Content-Range', ''))
+                if resp.status != 206 or not match or int(match.group(1)) != segment.offset:
+                    raise RangeIgnored('Asked for bytes from %d, server answered %d %s'
+                                       % (segment.offset, resp.status,
+                                          resp.getheader('Content-Range', '')))
+            buffer = self.writer.buffer(segment.offset, self._written)
+            try:
+                while segment.end == -1 or segment.offset < segment.end:
+                    if headers and not self._running.is_set():
+                        # Paused: the connection goes back to the pool and
+                        # the rest is asked for with a new Range on resume
+                        return
+                    self._running.wait()
+                    if self._stop is not None:
+                        return
+                    size = self.limit.chunk(CHUNK_SIZE)
+                    if segment.end != -1:
+                        size = min(size, segment.end - segment.offset)
+                    data = resp.read(size)
+                    if not data:
+                        if segment.end == -1:
+                            return
+                        if resp.length == 0:
+                            # The whole answer came and it was short, asking
+                            # again gets the same, _verify finds the gap
+                            print('Server sent a short range:', self.url)
+                            segment.end = segment.offset
+                            return
+                        raise ConnectionError('Connection closed early')
+                    self.limit.consume(len(data))
+                    buffer.add(data)
+                    segment.offset += len(data)
+                    self._progress(len(data))
+            finally:
+                if self._stop != 'cancel':
+                    self._flush(segment, buffer)
+
+    def _flush(self, segment, buffer):
+        '''Write what a segment still holds, only what reached the file counts'''
+        try:
+            buffer.flush()
+        finally:
+            lost = segment.offset - buffer.start
+            if lost:
+                segment.offset = buffer.start
+                self._progress(-lost)
+
+    def _written(self, start, data):
+        '''Data is in the file, the journal and hasher may use it now'''
+        if self.journal:
+            self.journal.record(start, start+len(data))
+        self.hasher.update(start, data)
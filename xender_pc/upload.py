@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Uploads from the PC to the phone
+Files are streamed as multipart requests with socket.sendfile so they
+are never read into memory. Folders are walked lazily
+'''
+
+import os
+import uuid
+import http.client
+
+from threading import Thread, Event
+from urllib.parse import urljoin
+
+from .pool import POOL, request_path
+from .ratelimit import LIMITER
+
+UPLOAD_PATH = '/upload' # Form action of the phone's upload page
+FIELD = 'file' # Form field of the file
+CHUNK_SIZE = 1024 * 1024 # Bytes handed to sendfile at a time
+
+
+def walk(paths):
+    '''
+    Generate (path, name) for every file in paths
+    Files inside a dropped folder are named relative to its parent
+    '''
+    for path in paths:
+        if os.path.isfile(path):
+            yield path, os.path.basename(path)
+        elif os.path.isdir(path):
+            root = os.path.dirname(os.path.abspath(path))
+            folders = [path]
+            while folders:
+                with os.scandir(folders.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                        elif entry.is_file():
+                            name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                            yield entry.path, name
+
+
+def upload_url(base_url, upload_path=UPLOAD_PATH):
+    return urljoin(base_url, upload_path)
+
+
+class Upload:
+    '''
+    Sends path to url as one multipart/form-data request
+    Has the same callbacks and states as SegmentedDownload
+    '''
+    def __init__(self, url, path, name=None, on_progress=None, on_state=None, limiter=None, pool=None):
+        self.url = url
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.on_progress = on_progress
+        self.on_state = on_state
+        self.limiter = limiter or LIMITER
+        self.pool = pool or POOL
+
+        self.state = 'waiting'
+        self.bytes_received = 0 # Bytes sent, named like downloads for the views
+        self.bytes_total = os.path.getsize(path)
+        self.verification = None
+        self._running = Event() # Cleared while paused
+        self._running.set()
+        self._stop = None
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+
+    def pause(self):
+        if self.state == 'inprogress':
+            self._running.clear()
+            self._set_state('paused')
+
+    def resume(self):
+        if self.state == 'paused':
+            self._set_state('inprogress')
+            self._running.set()
+
+    def cancel(self):
+        if self.state in ('waiting', 'inprogress', 'paused'):
+            self._stop = 'cancel'
+            self._running.set()
+
+    def suspend(self):
+        '''Uploads cannot resume, stop without reporting'''
+        if self.state in ('waiting', 'inprogress', 'paused'):
+            self._stop = 'suspend'
+            self._running.set()
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state:
+            self.on_state(state)
+
+    def _parts(self):
+        '''Multipart text sent before and after the file'''
+        boundary = uuid.uuid4().hex
+        filename = self.name.replace('"', '%22')
+        head = ('--%s\r\n'
+                'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'
+                % (boundary, FIELD, filename)).encode('utf-8')
+        tail = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+        return boundary, head, tail
+
+    def _run(self):
+        self._set_state('inprogress')
+        limit = self.limiter.register(self)
+        try:
+            ok = self._send(limit)
+        except (OSError, http.client.HTTPException) as e:
+            print('Upload Failed:', e)
+            ok = False
+        finally:
+            self.limiter.unregister(self)
+        if self._stop == 'suspend':
+            self.state = 'suspended'
+        elif self._stop == 'cancel':
+            self._set_state('cancelled')
+        elif ok:
+            self._set_state('finished')
+        else:
+            self._set_state('failed')
+
+    def _send(self, limit):
+        boundary, head, tail = self._parts()
+        conn, reused = self.pool.acquire(self.url)
+        resp = None
+        try:
+            conn.putrequest('POST', request_path(self.url))
+            conn.putheader('Content-Type', 'multipart/form-data; boundary='+boundary)
+            conn.putheader('Content-Length', str(len(head)+self.bytes_total+len(tail)))
+            conn.endheaders()
+            conn.sock.sendall(head)
+            if self.on_progress:
+                self.on_progress(0, self.bytes_total) # Where it starts, for the meters
+            with open(self.path, 'rb') as f:
+                offset = 0
+                while offset < self.bytes_total:
+                    if not self._running.is_set():
+                        # A POST cannot continue elsewhere, but others may open connections meanwhile
+                        self.pool.park(conn)
+                        self._running.wait()
+                        self.pool.unpark(conn)
+                    if self._stop is not None:
+                        return False
+                    count = min(limit.chunk(CHUNK_SIZE), self.bytes_total-offset)
+                    limit.consume(count)
+                    # The kernel copies straight from the file to the socket
+                    sent = conn.sock.sendfile(f, offset, count)
+                    if not sent:
+                        raise ConnectionError('File shrank while sending')
+                    offset += sent
+                    self.bytes_received = offset
+                    if self.on_progress:
+                        self.on_progress(offset, self.bytes_total)
+            conn.sock.sendall(tail)
+            resp = conn.getresponse()
+            resp.read()
+            return 200 <= resp.status < 300
+        finally:
+            self.pool.release(conn, resp)